@@ -0,0 +1,239 @@
+"""Daily and weekly rollups of routes, visits and collected weights.
+
+The rollup tables are kept current by triggers on visit_events, routes and
+route_distances, so the /analytics endpoints only ever read a few rows per
+day or week. To recompute them from scratch (from the backend directory):
+
+    python analytics.py --db waste_management.db --rebuild
+"""
+import argparse
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+# Monday of the week a date falls in
+WEEK_START = "date({}, '-6 days', 'weekday 1')"
+# Houses neither the registry nor the dataset has a neighborhood for are reported under this name
+UNKNOWN_NEIGHBORHOOD = "Unknown"
+VISIT_COLUMNS = ["planned_stops", "visits", "skipped", "collections", "collected_kg"]
+PERIODS = {"daily": ("analytics_visits_daily", "analytics_routes_daily", "date"),
+           "weekly": ("analytics_visits_weekly", "analytics_routes_weekly", "week_start")}
+
+
+def _neighborhood(house_id):
+    return f"""COALESCE((SELECT neighborhood_type FROM house_registry WHERE house_id = {house_id}),
+                        (SELECT neighborhood_type FROM dataset_neighborhoods WHERE house_id = {house_id}),
+                        '{UNKNOWN_NEIGHBORHOOD}')"""
+
+
+def create_analytics_tables(cursor):
+    # Each house's neighborhood in the training dataset, for houses the registry has none for (the bundled
+    # database has an empty registry). Filled by sync_dataset_neighborhoods when the dataset is loaded
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS dataset_neighborhoods (
+            house_id INTEGER PRIMARY KEY,
+            neighborhood_type TEXT NOT NULL
+        )
+    """)
+    for table, key in (("analytics_visits_daily", "date"), ("analytics_visits_weekly", "week_start")):
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                {key} TEXT NOT NULL,
+                neighborhood_type TEXT NOT NULL,
+                planned_stops INTEGER DEFAULT 0,
+                visits INTEGER DEFAULT 0,
+                skipped INTEGER DEFAULT 0,
+                collections INTEGER DEFAULT 0,
+                collected_kg REAL DEFAULT 0,
+                PRIMARY KEY ({key}, neighborhood_type)
+            )
+        """)
+    for table, key in (("analytics_routes_daily", "date"), ("analytics_routes_weekly", "week_start")):
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                {key} TEXT PRIMARY KEY,
+                routes INTEGER DEFAULT 0,
+                km REAL DEFAULT 0
+            )
+        """)
+
+    visit_updates = []
+    for table, key, value in (("analytics_visits_daily", "date", "NEW.date"),
+                              ("analytics_visits_weekly", "week_start", WEEK_START.format("NEW.date"))):
+        visit_updates.append(f"""
+            INSERT OR IGNORE INTO {table} ({key}, neighborhood_type) VALUES ({value}, {_neighborhood("NEW.house_id")});
+            UPDATE {table} SET
+                planned_stops = planned_stops + (NEW.event_type = 'planned') - (NEW.event_type = 'unplanned'),
+                visits = visits + (NEW.event_type = 'visited'),
+                skipped = skipped + (NEW.event_type = 'skipped'),
+                collections = collections + (NEW.event_type = 'collected'),
+                collected_kg = collected_kg + CASE WHEN NEW.event_type = 'collected' THEN COALESCE(NEW.collected_kg, 0) ELSE 0 END
+            WHERE {key} = {value} AND neighborhood_type = {_neighborhood("NEW.house_id")};""")
+    # A trigger from before the dataset fallback only looks in the registry, it is replaced
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'visit_events_analytics'")
+    row = cursor.fetchone()
+    if row and "dataset_neighborhoods" not in row[0]:
+        cursor.execute("DROP TRIGGER IF EXISTS visit_events_analytics")
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS visit_events_analytics AFTER INSERT ON visit_events
+        BEGIN
+            {"".join(visit_updates)}
+        END
+    """)
+
+    route_updates, leg_updates, leg_deletes = [], [], []
+    for table, key, value in (("analytics_routes_daily", "date", "{}"), ("analytics_routes_weekly", "week_start", WEEK_START)):
+        route_date = value.format("NEW.date")
+        route_updates.append(f"""
+            INSERT OR IGNORE INTO {table} ({key}) VALUES ({route_date});
+            UPDATE {table} SET routes = routes + 1 WHERE {key} = {route_date};""")
+        # route_id is the routes rowid, see get_optimal_route
+        leg_date = value.format("(SELECT date FROM routes WHERE rowid = NEW.route_id)")
+        leg_updates.append(f"""
+            INSERT OR IGNORE INTO {table} ({key}) SELECT {leg_date} WHERE {leg_date} IS NOT NULL;
+            UPDATE {table} SET km = km + COALESCE(NEW.distance, 0) WHERE {key} = {leg_date};""")
+        # A replanned date's legs are replaced, see get_optimal_route
+        leg_deletes.append(f"""
+            UPDATE {table} SET km = km - COALESCE(OLD.distance, 0)
+            WHERE {key} = {value.format("(SELECT date FROM routes WHERE rowid = OLD.route_id)")};""")
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS routes_analytics AFTER INSERT ON routes
+        BEGIN
+            {"".join(route_updates)}
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS route_distances_analytics AFTER INSERT ON route_distances
+        BEGIN
+            {"".join(leg_updates)}
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS route_distances_analytics_delete AFTER DELETE ON route_distances
+        BEGIN
+            {"".join(leg_deletes)}
+        END
+    """)
+
+
+# Recompute every rollup from the source tables, e.g. for a database written before the triggers existed
+def rebuild_rollups(cursor):
+    for table, key, value in (("analytics_visits_daily", "date", "date"),
+                              ("analytics_visits_weekly", "week_start", WEEK_START.format("date"))):
+        cursor.execute(f"DELETE FROM {table}")
+        cursor.execute(f"""
+            INSERT INTO {table} ({key}, neighborhood_type, {", ".join(VISIT_COLUMNS)})
+            SELECT {value}, COALESCE(hr.neighborhood_type, dn.neighborhood_type, '{UNKNOWN_NEIGHBORHOOD}'),
+                   SUM(event_type = 'planned') - SUM(event_type = 'unplanned'), SUM(event_type = 'visited'),
+                   SUM(event_type = 'skipped'),
+                   SUM(event_type = 'collected'),
+                   SUM(CASE WHEN event_type = 'collected' THEN COALESCE(collected_kg, 0) ELSE 0 END)
+            FROM visit_events ve
+            LEFT JOIN house_registry hr ON hr.house_id = ve.house_id
+            LEFT JOIN dataset_neighborhoods dn ON dn.house_id = ve.house_id
+            GROUP BY 1, 2
+        """)
+    for table, key, value in (("analytics_routes_daily", "date", "date"),
+                              ("analytics_routes_weekly", "week_start", WEEK_START.format("date"))):
+        cursor.execute(f"DELETE FROM {table}")
+        cursor.execute(f"""
+            INSERT INTO {table} ({key}, routes, km)
+            SELECT {value}, COUNT(*), COALESCE(SUM(legs.km), 0)
+            FROM routes r
+            LEFT JOIN (SELECT route_id, SUM(distance) AS km FROM route_distances GROUP BY route_id) legs
+            ON legs.route_id = r.rowid
+            GROUP BY 1
+        """)
+
+
+# Rollups start empty on databases that had routes before this module existed
+def ensure_rollups(cursor):
+    cursor.execute("SELECT (SELECT COUNT(*) FROM analytics_routes_daily) + (SELECT COUNT(*) FROM analytics_visits_daily)")
+    if cursor.fetchone()[0]:
+        return
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM routes) OR EXISTS (SELECT 1 FROM visit_events)")
+    if cursor.fetchone()[0]:
+        rebuild_rollups(cursor)
+
+
+# Record each house's latest neighborhood in the dataset frame. Events counted before a house's neighborhood was
+# known (or when it was a different one) sit under the wrong name, so the rollups are rebuilt when anything changed
+def sync_dataset_neighborhoods(cursor, dataset):
+    latest = dataset.dropna(subset=["neighborhood_type"]).sort_values("date").drop_duplicates("house_id", keep="last")
+    neighborhoods = dict(zip(latest["house_id"].astype(int).tolist(), latest["neighborhood_type"].tolist()))
+    cursor.execute("SELECT house_id, neighborhood_type FROM dataset_neighborhoods")
+    known = {row[0]: row[1] for row in cursor.fetchall()}
+    changed = [(house_id, name) for house_id, name in neighborhoods.items() if known.get(house_id) != name]
+    if not changed:
+        return 0
+    cursor.executemany("INSERT OR REPLACE INTO dataset_neighborhoods (house_id, neighborhood_type) VALUES (?, ?)", changed)
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM visit_events)")
+    if cursor.fetchone()[0]:
+        rebuild_rollups(cursor)
+    return len(changed)
+
+
+def _range_filter(key, start, end):
+    clauses, params = [], []
+    if start:
+        clauses.append(f"{key} >= ?")
+        params.append(start)
+    if end:
+        clauses.append(f"{key} <= ?")
+        params.append(end)
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+# Totals per day or week: stops, visits and kg from the visit rollup, routes and km from the route rollup
+def period_totals(cursor, period, start=None, end=None):
+    visits_table, routes_table, key = PERIODS[period]
+    where, params = _range_filter(key, start, end)
+    cursor.execute(f"""
+        SELECT {key} AS period, {", ".join(f"SUM({column}) AS {column}" for column in VISIT_COLUMNS)}
+        FROM {visits_table}{where} GROUP BY {key}
+    """, params)
+    totals = {row["period"]: dict(row) for row in cursor.fetchall()}
+    cursor.execute(f"SELECT {key} AS period, routes, km FROM {routes_table}{where}", params)
+    for row in cursor.fetchall():
+        totals.setdefault(row["period"], {"period": row["period"], **{column: 0 for column in VISIT_COLUMNS}})
+        totals[row["period"]].update(routes=row["routes"], km=row["km"])
+    result = []
+    for period_key in sorted(totals):
+        row = totals[period_key]
+        row.setdefault("routes", 0)
+        row.setdefault("km", 0.0)
+        row["km_per_route"] = row["km"] / row["routes"] if row["routes"] else None
+        result.append(row)
+    return result
+
+
+def neighborhood_trends(cursor, period, start=None, end=None):
+    visits_table, _, key = PERIODS[period]
+    where, params = _range_filter(key, start, end)
+    cursor.execute(f"""
+        SELECT {key} AS period, neighborhood_type, {", ".join(VISIT_COLUMNS)}
+        FROM {visits_table}{where} ORDER BY {key}, neighborhood_type
+    """, params)
+    return [dict(row) for row in cursor.fetchall()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the analytics rollup tables")
+    parser.add_argument("--db", default="waste_management.db")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute every rollup from the source tables")
+    args = parser.parse_args()
+
+    from schema import create_tables
+    logging.basicConfig(level=logging.INFO)
+    conn = sqlite3.connect(args.db)
+    create_tables(conn.cursor())
+    if args.rebuild:
+        rebuild_rollups(conn.cursor())
+        logger.info(f"Rebuilt analytics rollups in {args.db}")
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import json
+import os
+import statistics
+import time
+
+HISTORY_PATH = os.path.join(os.path.dirname(__file__), "history.json")
+# A benchmark regresses when its median is this many times the recent baseline
+DEFAULT_THRESHOLD = 1.5
+BASELINE_RUNS = 5
+# Differences below this are timer noise, whatever the ratio
+MIN_DELTA_MS = 0.5
+
+
+# Time `fn` `repeat` times after `warmup` untimed calls, in milliseconds
+def measure(fn, repeat=5, warmup=1):
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        "runs": repeat,
+        "min_ms": round(timings[0], 3),
+        "median_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+    }
+
+
+def load_history(path=HISTORY_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_history(history, path=HISTORY_PATH):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(history, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+# Compare a run's results against the median of the last few recorded runs
+def find_regressions(results, history, threshold=DEFAULT_THRESHOLD, baseline_runs=BASELINE_RUNS, min_delta_ms=MIN_DELTA_MS):
+    regressions = []
+    for name, result in results.items():
+        previous = [run["results"][name]["median_ms"] for run in history if name in run["results"]]
+        if not previous:
+            continue
+        baseline = statistics.median(previous[-baseline_runs:])
+        ratio = result["median_ms"] / baseline if baseline else float("inf")
+        if ratio > threshold and result["median_ms"] - baseline > min_delta_ms:
+            regressions.append({"name": name, "baseline_ms": baseline, "median_ms": result["median_ms"], "ratio": round(ratio, 2)})
+    return regressions
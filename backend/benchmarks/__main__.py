@@ -0,0 +1,113 @@
+"""Benchmark suite for prediction, selection, routing, DB access and every endpoint.
+
+Usage (from the backend directory):
+
+    python -m benchmarks --sizes 100 1000 10000 --repeat 5
+
+Each size gets a generated city (cached under benchmarks/.cities) with a small
+model trained from its own history. Results are appended to
+benchmarks/history.json, and the run fails when a benchmark's median is more
+than --threshold times the median of its recent runs.
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+from benchmarks import DEFAULT_THRESHOLD, HISTORY_PATH, find_regressions, load_history, save_history
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CITIES_DIR = os.path.join(BACKEND_DIR, "benchmarks", ".cities")
+
+
+def prepare_city(num_houses, days=14, cities_dir=CITIES_DIR):
+    from citygen import generate_city
+    from features import build_features
+    from training import load_training_data, publish_model, train_model
+
+    city_dir = os.path.join(cities_dir, f"city_{num_houses}")
+    models_dir = os.path.join(city_dir, "models")
+    if os.path.exists(os.path.join(models_dir, "current.json")):
+        return city_dir
+
+    generate_city(city_dir, num_houses, num_days=days, seed=42)
+    history_path = os.path.join(city_dir, "history.parquet")
+    if not os.path.exists(history_path):
+        history_path = os.path.join(city_dir, "history.csv")
+    features_path = os.path.join(city_dir, "features.parquet")
+    build_features(history_path, features_path)
+    X, y = load_training_data(features_path=features_path)
+    model, metrics = train_model(X, y, n_estimators=20, max_depth=10)
+    publish_model(model, metrics, models_dir=models_dir)
+    return city_dir
+
+
+def run_size(city_dir, repeat, skip_macro=False):
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        out_path = f.name
+    command = [sys.executable, "-m", "benchmarks.worker", "--city", city_dir, "--repeat", str(repeat), "--out", out_path]
+    if skip_macro:
+        command.append("--skip-macro")
+    subprocess.run(command, cwd=BACKEND_DIR, check=True, stdout=subprocess.DEVNULL)
+    with open(out_path) as f:
+        results = json.load(f)
+    os.remove(out_path)
+    return results
+
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the benchmark suite")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--days", type=int, default=14, help="Days of history generated per city")
+    parser.add_argument("--skip-macro", action="store_true", help="Only run the micro-benchmarks")
+    parser.add_argument("--history", default=HISTORY_PATH)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--no-save", action="store_true", help="Do not append this run to the history")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    results = {}
+    for size in args.sizes:
+        city_dir = prepare_city(size, days=args.days)
+        logger.info(f"Running benchmarks for {size} houses")
+        for name, result in run_size(city_dir, args.repeat, args.skip_macro).items():
+            results[f"{name}[{size}]"] = result
+
+    width = max(len(name) for name in results)
+    print(f"{'benchmark':<{width}}  {'median ms':>10}  {'p95 ms':>10}")
+    for name, result in results.items():
+        print(f"{name:<{width}}  {result['median_ms']:>10.3f}  {result['p95_ms']:>10.3f}")
+
+    history = load_history(args.history)
+    regressions = find_regressions(results, history, threshold=args.threshold)
+    if not args.no_save:
+        history.append({
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": current_commit(),
+            "results": results,
+        })
+        save_history(history, args.history)
+
+    for regression in regressions:
+        print(f"REGRESSION {regression['name']}: {regression['median_ms']:.3f} ms vs baseline "
+              f"{regression['baseline_ms']:.3f} ms ({regression['ratio']}x)")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import itertools
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+
+from benchmarks import measure
+from benchmarks.micro import CAPACITY_SHARE
+
+AVERAGE_HOUSE_KG = 9.0
+PNG_BYTES = b"\x89PNG\r\n\x1a\n" + b"\x00" * 4096
+
+
+# Drive every endpoint of the app in-process
+def run_macro(main, repeat=5):
+    house_ids = main.resources.get("dataset")['house_id'].tolist()
+    house_id, other_house_id = house_ids[0], house_ids[1]
+    capacity = len(house_ids) * AVERAGE_HOUSE_KG * CAPACITY_SHARE
+    planning_dates = (str(date(2100, 1, 1) + timedelta(days=i)) for i in itertools.count())
+    pickup_date = str(date.today() + timedelta(days=1))
+    results = {}
+
+    with TestClient(main.app) as client:
+        def call(method, url, **kwargs):
+            response = client.request(method, url, **kwargs)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{method} {url} returned {response.status_code}: {response.text[:200]}")
+            return response
+
+        def plan(route_date):
+            return call("POST", "/get-optimal-route", json={
+                "day": "Monday", "is_holiday": 0, "weather": "Sunny",
+                "date": route_date, "truck_capacity": capacity,
+            })
+
+        cached_date = next(planning_dates)
+        route = plan(cached_date).json()["optimal_route"]
+        query_id = call("POST", "/add-query", data={"house_id": house_id, "phone_number": "+910000000000", "query": "bench"}).json()["id"]
+        request_id = call("POST", "/request-extra-waste-pickup", json={
+            "house_id": house_id, "date": pickup_date, "description": "bench",
+        }).json()["id"]
+
+        endpoints = {
+            "get_optimal_route_miss": lambda: plan(next(planning_dates)),
+            "get_optimal_route_hit": lambda: plan(cached_date),
+            "get_visit_history_all": lambda: call("GET", "/get-visit-history-all"),
+            "get_visit_history": lambda: call("GET", "/get-visit-history", params={"date": cached_date}),
+            "get_last_visited_date": lambda: call("GET", "/get-last-visited-date"),
+            "set_phone_number": lambda: call("POST", "/set-phone-number", json={"house_id": house_id, "phone_number": "+910000000000"}),
+            "update_visit_time": lambda: call("POST", "/update-visit-time", json={"house_id": house_id, "collected_kg": 8.0}),
+            "get_distance": lambda: call("GET", "/get-distance", params={"house1": route[0], "house2": route[1]}),
+            "get_visit_info": lambda: call("GET", "/get-visit-info", params={"date": cached_date, "house_id": other_house_id}),
+            "add_query": lambda: call("POST", "/add-query",
+                                      data={"house_id": house_id, "phone_number": "+910000000000", "query": "bench"},
+                                      files={"image": ("bench.png", PNG_BYTES, "image/png")}),
+            "get_queries": lambda: call("GET", "/get-queries"),
+            "mark_query_done": lambda: call("PATCH", "/mark-query-done", json={"query_id": query_id}),
+            "request_extra_waste_pickup": lambda: call("POST", "/request-extra-waste-pickup", json={
+                "house_id": house_id, "date": pickup_date, "description": "bench",
+            }),
+            "get_waste_requests": lambda: call("GET", "/get-waste-requests"),
+            "update_waste_request": lambda: call("POST", "/update-waste-request", json={"request_id": request_id, "status": "completed"}),
+        }
+        for name, request in endpoints.items():
+            results[name] = measure(request, repeat)
+    return results
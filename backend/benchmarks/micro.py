@@ -0,0 +1,41 @@
+from benchmarks import measure
+
+# Truck capacity as a share of the city's predicted waste, so the selection work scales with size
+CAPACITY_SHARE = 0.1
+
+
+def run_micro(main, repeat=5):
+    results = {}
+    df = main.resources.get("dataset")
+    house_ids = df['house_id'].tolist()
+    neighborhood_encoded = df['neighborhood_encoded'].values
+    previous_day_waste = df['previous_day_waste'].values
+    main.resources.preload()
+
+    def predict():
+        return main.predict_waste_for_today(house_ids, 0, 0, neighborhood_encoded, 0, previous_day_waste)
+
+    results["predict_waste_for_today"] = measure(predict, repeat)
+
+    predictions = predict()
+    capacity = float(predictions["predicted_waste_weight"].sum()) * CAPACITY_SHARE
+    results["select_houses"] = measure(lambda: main.select_houses(predictions, capacity), repeat)
+
+    optimal_route = sorted(main.select_houses(predictions, capacity))
+    results["route_legs"] = measure(lambda: main.route_legs(optimal_route), repeat)
+
+    def query(sql):
+        with main.get_db() as db:
+            return db.execute(sql).fetchall()
+
+    results["db_unvisited_houses"] = measure(lambda: query("SELECT house_id FROM houses WHERE visited = 0"), repeat)
+    results["db_last_visited_dates"] = measure(
+        lambda: query("SELECT house_id, last_planned_date FROM house_visit_summary WHERE last_planned_date IS NOT NULL"), repeat
+    )
+
+    def latest_weights():
+        with main.get_db() as db:
+            return main.latest_collected_weights(db.cursor(), df)
+
+    results["db_latest_collected_weights"] = measure(latest_weights, repeat)
+    return results
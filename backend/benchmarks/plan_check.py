@@ -0,0 +1,346 @@
+"""Invariant and golden-plan checks for every planner.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.plan_check --random 20 --seed 0
+    python -m benchmarks.plan_check --update-golden
+
+Each instance is a seeded synthetic city: clustered houses with a detour-
+perturbed distance matrix, predicted loads, a truck capacity and a few
+requested pickups. In the random cities the last houses are missing from the
+matrix and are routed by their coordinates, like houses added through the API. Every planner plans it through the same selection as
+get_optimal_route, and every plan is checked for:
+
+    no stop planned twice, and no stop that wasn't selected
+    every selected house routed; zones and multi_trip may leave out houses
+    that fit on no truck or into no shift, those are counted as left out
+    capacity never exceeded, per selection, per truck and per trip
+    every requested pickup that fits the capacity served
+    multi_trip trips within max_trips and the shift
+    route length no worse than the baseline (the selection in house id
+    order, as the default "sorted" planner returns it)
+
+Each instance's date is also planned, replanned with less capacity and
+rolled back on a scratch database. After every step the date's visits,
+the per-house visit summary and the daily rollup must match the plan in
+force, and the stored diff between two versions must turn one into the
+other. The selection is also run on int house ids with the pickups, and
+must still store every id as "12.0".
+
+The fixed instances in golden_plans.json also hold each planner's length and
+time when they were last updated; a plan longer than the golden one by more
+than --tolerance fails, the speed and length deltas are reported. The run
+exits with 1 on any failure.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from citygen import CITY_CENTER
+from dayplan import parse_clock, plan_day
+from distances import KM_PER_DEGREE, CoordinateDistances, MatrixDistances
+from route_versions import apply_edits, route_diff
+from routing import PLANNERS, plan_routes, route_length
+from schema import create_tables
+
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), "golden_plans.json")
+GOLDEN_INSTANCES = [
+    {"name": "small", "seed": 1, "houses": 40},
+    {"name": "medium", "seed": 2, "houses": 150},
+    {"name": "large", "seed": 3, "houses": 400},
+]
+# A plan may be this much longer than its golden plan, multi_start stops on a time budget
+DEFAULT_TOLERANCE = 0.01
+# Selected share of the city's predicted load per truck
+CAPACITY_SHARE = 0.15
+MANDATORY_PICKUPS = 3
+# Houses of a random city registered after its distance matrix, as POST /houses adds them
+ADDED_HOUSES = 2
+# Fleet per planner, and the shift multi_trip plans
+TRUCKS = {"sorted": 1, "multi_start": 1, "zones": 3, "multi_trip": 2}
+SHIFT = {"shift_start": "06:00", "max_hours": 8.0, "max_trips": 3, "unload_minutes": 20.0, "service_minutes": 1.5}
+SEARCH = {"starts": 4, "time_budget_s": 10.0, "seed": 0}
+# Share of the capacity the version check replans a date with, so the replan drops houses
+REPLAN_SHARE = 0.6
+VERSION_DATE = "2100-01-01"
+
+
+class Instance:
+    def __init__(self, name, seed, num_houses, added_houses=0):
+        rng = np.random.default_rng(seed)
+        self.name = name
+        clusters = rng.normal(0, 1.5, (max(1, num_houses // 50), 2))
+        xy = clusters[rng.integers(0, len(clusters), num_houses)] + rng.normal(0, 0.3, (num_houses, 2))
+        lat = CITY_CENTER[0] + xy[:, 1] / KM_PER_DEGREE
+        lon = CITY_CENTER[1] + xy[:, 0] / (KM_PER_DEGREE * np.cos(np.radians(CITY_CENTER[0])))
+        # Sparse, unordered ids, as in a registry that grew over time
+        self.house_ids = np.sort(rng.choice(np.arange(1, 20 * num_houses), num_houses, replace=False))
+        self.coordinates = CoordinateDistances(self.house_ids, lat, lon)
+        detour = 1 + 0.3 * rng.random((num_houses, num_houses))
+        matrix = self.coordinates.submatrix(self.house_ids) * np.minimum(detour, detour.T)
+        # Random cities also have houses added after the matrix was built, routed by their coordinates
+        in_matrix = num_houses - added_houses
+        self.distances = MatrixDistances(self.house_ids[:in_matrix], matrix[:in_matrix, :in_matrix],
+                                         fallback=self.coordinates if added_houses else None)
+        loads = rng.gamma(4.0, 2.5, num_houses)
+        # Floats, as the houses come out of the prediction frame in get_optimal_route
+        self.predictions = pd.DataFrame({"house_id": self.house_ids.astype(np.float64), "predicted_waste_weight": loads})
+        self.loads = dict(zip(self.house_ids.tolist(), loads.tolist()))
+        self.capacity = float(loads.sum()) * CAPACITY_SHARE
+        self.mandatory = sorted(rng.choice(self.house_ids, MANDATORY_PICKUPS, replace=False).tolist())
+        self.depot = [float(lat.mean()), float(lon.mean())]
+        self.disposal_sites = [[float(lat.min()), float(lon.min())], [float(lat.max()), float(lon.max())]]
+
+
+def plan(instance, planner, select_houses):
+    trucks = TRUCKS[planner]
+    trips = SHIFT["max_trips"] if planner == "multi_trip" else 1
+    started = time.perf_counter()
+    selected = select_houses(instance.predictions, instance.capacity * trucks * trips, mandatory=instance.mandatory)
+    loads = [instance.loads[int(h)] for h in selected]
+    unserved, day = [], None
+    if planner == "multi_trip":
+        day, unserved = plan_day(
+            selected, loads, instance.distances, instance.coordinates, instance.depot, instance.disposal_sites,
+            trucks, instance.capacity, mandatory=instance.mandatory, **SHIFT
+        )
+        truck_routes = [[h for trip in truck for h in trip["houses"]] for truck in day]
+    else:
+        truck_routes = plan_routes(selected, instance.distances, planner=planner, loads=loads, num_trucks=trucks,
+                                   capacity=instance.capacity, keep=instance.mandatory, **SEARCH)
+    ms = (time.perf_counter() - started) * 1000
+    truck_routes = [[int(h) for h in route] for route in truck_routes]
+    if planner == "zones":
+        routed = {h for route in truck_routes for h in route}
+        unserved = [int(h) for h in selected if int(h) not in routed]
+    return {"selected": [int(h) for h in selected], "truck_routes": truck_routes, "day": day,
+            "unserved": unserved, "ms": ms, "trucks": trucks}
+
+
+# House-to-house km of every truck's route
+def plan_length(instance, truck_routes):
+    total = 0.0
+    for route in truck_routes:
+        if len(route) > 1:
+            total += route_length(instance.distances.submatrix(route), np.arange(len(route)))
+    return total
+
+
+def check(instance, planner, result):
+    failures = []
+    stops = [h for route in result["truck_routes"] for h in route]
+    selected = set(result["selected"])
+    if len(stops) != len(set(stops)):
+        failures.append(f"{len(stops) - len(set(stops))} stops planned twice")
+    if set(stops) - selected:
+        failures.append(f"{len(set(stops) - selected)} stops that weren't selected")
+    missing = selected - set(stops) - set(result["unserved"])
+    if missing:
+        failures.append(f"{len(missing)} selected houses neither routed nor left out")
+
+    capacity = instance.capacity
+    trips = SHIFT["max_trips"] if planner == "multi_trip" else 1
+    selected_load = sum(instance.loads[h] for h in selected)
+    if selected_load > capacity * result["trucks"] * trips + 1e-6:
+        failures.append(f"selection of {selected_load:.1f} kg over the fleet's {capacity * result['trucks'] * trips:.1f} kg")
+    if planner == "multi_trip":
+        shift_end = parse_clock(SHIFT["shift_start"]) + SHIFT["max_hours"] * 60
+        for truck, day in enumerate(result["day"]):
+            if len(day) > SHIFT["max_trips"]:
+                failures.append(f"truck {truck} makes {len(day)} trips")
+            for trip in day:
+                if trip["load"] > capacity + 1e-6:
+                    failures.append(f"truck {truck} trip of {trip['load']:.1f} kg over {capacity:.1f} kg")
+                if trip["end"] > shift_end + 1e-6:
+                    failures.append(f"truck {truck} trip ends after the shift")
+    else:
+        for truck, route in enumerate(result["truck_routes"]):
+            load = sum(instance.loads[h] for h in route)
+            if load > capacity + 1e-6:
+                failures.append(f"truck {truck} carries {load:.1f} kg over {capacity:.1f} kg")
+
+    # Requested pickups are taken first, so all of them fit whenever each fits a truck and their total the fleet
+    pickup_loads = [instance.loads[h] for h in instance.mandatory]
+    if max(pickup_loads) <= capacity and sum(pickup_loads) <= capacity * result["trucks"] * trips:
+        unserved = set(instance.mandatory) - set(stops)
+        if unserved:
+            failures.append(f"requested pickups {sorted(unserved)} not served")
+
+    baseline = plan_length(instance, [sorted(route) for route in result["truck_routes"]]) if planner == "sorted" \
+        else plan_length(instance, [sorted(stops)])
+    length = plan_length(instance, result["truck_routes"])
+    if length > baseline + 1e-6:
+        failures.append(f"{length:.2f} km, longer than the {baseline:.2f} km baseline")
+    return failures, length, baseline
+
+
+# The plan in force for the date, as visits, the visit summary and the rollup record it
+def check_plan_records(cursor, plan, houses):
+    failures = []
+    cursor.execute("SELECT house_id FROM visits WHERE date = ?", (VERSION_DATE,))
+    if {row["house_id"] for row in cursor.fetchall()} != set(plan):
+        failures.append("visits don't match the plan")
+    cursor.execute("SELECT house_id, last_planned_date, planned_count FROM house_visit_summary")
+    summary = {row["house_id"]: (row["last_planned_date"], row["planned_count"]) for row in cursor.fetchall()}
+    stale = [h for h in houses if summary.get(h, (None, 0)) != ((VERSION_DATE, 1) if h in plan else (None, 0))]
+    if stale:
+        failures.append(f"visit summary of {len(stale)} houses doesn't match the plan")
+    cursor.execute("SELECT COALESCE(SUM(planned_stops), 0) FROM analytics_visits_daily WHERE date = ?", (VERSION_DATE,))
+    planned_stops = cursor.fetchone()[0]
+    if planned_stops != len(plan):
+        failures.append(f"{planned_stops} planned stops in the rollup for a plan of {len(plan)}")
+    return failures
+
+
+# The selection with int ids, as inference frames can carry them, and the pickups: the route text must keep
+# the "12.0,15.0" form /get-visit-info matches on
+def check_selection(instance, select_houses):
+    predictions = instance.predictions.astype({"house_id": np.int64})
+    selected = select_houses(predictions, instance.capacity, mandatory=instance.mandatory)
+    failures = [f"house {h!r} selected as {type(h).__name__}, not float" for h in selected if not isinstance(h, float)]
+    stored = ",".join(map(str, selected)).split(",")
+    failures += [f"house {h} stored as {text!r}" for h, text in zip(selected, stored) if text != f"{int(h)}.0"]
+    if sum(instance.loads[h] for h in instance.mandatory) <= instance.capacity:
+        failures += [f"pickup {h} not selected" for h in sorted(set(instance.mandatory) - {int(h) for h in selected})]
+    return failures
+
+
+# Plan, replan with less capacity and roll back one date through store_plan, as get_optimal_route and
+# /routes/{date}/rollback do
+def check_versions(instance, select_houses, store_plan):
+    plans = []
+    for share in (1.0, REPLAN_SHARE):
+        selected = select_houses(instance.predictions, instance.capacity * share, mandatory=instance.mandatory)
+        loads = [instance.loads[int(h)] for h in selected]
+        routes = plan_routes(selected, instance.distances, planner="zones", loads=loads, num_trucks=2)
+        plans.append([int(h) for route in routes for h in route])
+    houses = set(plans[0]) | set(plans[1])
+
+    db = sqlite3.connect(":memory:")
+    db.row_factory = sqlite3.Row
+    cursor = db.cursor()
+    create_tables(cursor)
+    failures, route_id, previous = [], None, []
+    for step, (plan, restored_from) in enumerate([(plans[0], None), (plans[1], None), (plans[0], 1)]):
+        store_plan(cursor, VERSION_DATE, route_id, None, ",".join(map(str, plan)), [], plan, previous,
+                   restored_from=restored_from)
+        cursor.execute("SELECT rowid FROM routes WHERE date = ?", (VERSION_DATE,))
+        route_id, previous = cursor.fetchone()[0], plan
+        failures += [f"version {step + 1}: {failure}" for failure in check_plan_records(cursor, plan, houses)]
+    db.close()
+
+    for old, new in ((plans[0], plans[1]), (plans[1], plans[0])):
+        if apply_edits(old, route_diff(old, new)["edits"]) != new:
+            failures.append("diff edits don't turn one version into the other")
+    return failures
+
+
+def digest(truck_routes):
+    return hashlib.sha1(json.dumps(truck_routes).encode()).hexdigest()[:12]
+
+
+def load_golden(path=GOLDEN_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check planner invariants and compare against golden plans")
+    parser.add_argument("--planners", nargs="+", default=PLANNERS + ["multi_trip"])
+    parser.add_argument("--random", type=int, default=20, help="Randomized instances per planner")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the randomized instances")
+    parser.add_argument("--max-houses", type=int, default=300)
+    parser.add_argument("--golden", default=GOLDEN_PATH)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--update-golden", action="store_true", help="Record the current plans as the golden ones")
+    args = parser.parse_args()
+
+    os.environ.setdefault("PRELOAD_RESOURCES", "0")
+    from main import select_houses, store_plan
+
+    rng = np.random.default_rng(args.seed)
+    instances = [Instance(f"random-{args.seed}-{i}", int(rng.integers(2 ** 31)), int(rng.integers(10, args.max_houses)),
+                          added_houses=ADDED_HOUSES)
+                 for i in range(args.random)]
+    golden_instances = [Instance(entry["name"], entry["seed"], entry["houses"]) for entry in GOLDEN_INSTANCES]
+    golden = load_golden(args.golden)
+    # Planners left out of this run keep their golden plans
+    updated = {"instances": GOLDEN_INSTANCES,
+               "plans": {name: dict(plans) for name, plans in golden.get("plans", {}).items()}}
+
+    failed = False
+    summary = {}
+    for planner in args.planners:
+        stats = summary[planner] = {"instances": 0, "failures": 0, "left_out": 0, "ms": [], "vs_baseline": [],
+                                    "vs_golden": [], "ms_vs_golden": [], "changed": 0}
+        for instance in instances + golden_instances:
+            result = plan(instance, planner, select_houses)
+            failures, length, baseline = check(instance, planner, result)
+            stats["instances"] += 1
+            stats["left_out"] += len(result["unserved"])
+            stats["ms"].append(result["ms"])
+            if baseline:
+                stats["vs_baseline"].append(length / baseline)
+
+            if instance in golden_instances:
+                entry = {"stops": len([h for route in result["truck_routes"] for h in route]),
+                         "length_km": round(length, 4), "ms": round(result["ms"], 2),
+                         "digest": digest(result["truck_routes"])}
+                updated["plans"].setdefault(instance.name, {})[planner] = entry
+                previous = golden.get("plans", {}).get(instance.name, {}).get(planner)
+                if previous and not args.update_golden:
+                    if previous["digest"] != entry["digest"]:
+                        stats["changed"] += 1
+                    if previous["length_km"]:
+                        stats["vs_golden"].append(length / previous["length_km"])
+                        if length > previous["length_km"] * (1 + args.tolerance):
+                            failures.append(f"{length:.2f} km, longer than the golden {previous['length_km']:.2f} km")
+                    if previous["ms"]:
+                        stats["ms_vs_golden"].append(result["ms"] / previous["ms"])
+
+            for failure in failures:
+                print(f"FAIL {planner} {instance.name}: {failure}")
+            if failures:
+                stats["failures"] += 1
+                failed = True
+
+    version_failures = 0
+    for instance in instances + golden_instances:
+        failures = check_selection(instance, select_houses) + check_versions(instance, select_houses, store_plan)
+        for failure in failures:
+            print(f"FAIL versions {instance.name}: {failure}")
+        if failures:
+            version_failures += 1
+            failed = True
+
+    print(f"{'planner':<12} {'plans':>5} {'failed':>6} {'left out':>8} {'median ms':>10} {'vs baseline':>12} "
+          f"{'length vs golden':>17} {'time vs golden':>15} {'changed':>8}")
+    for planner, stats in summary.items():
+        def ratio(values):
+            return f"{(statistics.mean(values) - 1) * 100:+.1f}%" if values else "n/a"
+        print(f"{planner:<12} {stats['instances']:>5} {stats['failures']:>6} {stats['left_out']:>8} "
+              f"{statistics.median(stats['ms']):>10.1f} "
+              f"{ratio(stats['vs_baseline']):>12} {ratio(stats['vs_golden']):>17} {ratio(stats['ms_vs_golden']):>15} "
+              f"{stats['changed']:>8}")
+
+    print(f"versions: {len(instances) + len(golden_instances)} dates replanned and rolled back, {version_failures} failed")
+
+    if args.update_golden:
+        with open(args.golden, "w") as f:
+            json.dump(updated, f, indent=2)
+        print(f"Wrote golden plans for {len(args.planners)} planners to {args.golden}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
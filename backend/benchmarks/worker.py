@@ -0,0 +1,47 @@
+# Runs the benchmarks for one generated city, in its own process so main.py loads that city
+import argparse
+import json
+import os
+import shutil
+import tempfile
+
+
+class NullSMSClient:
+    class messages:
+        @staticmethod
+        def create(**kwargs):
+            return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--city", required=True)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--skip-macro", action="store_true")
+    args = parser.parse_args()
+
+    from citygen import city_env
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    db_path = os.path.join(workdir, "waste_management.db")
+    shutil.copy(os.path.join(args.city, "waste_management.db"), db_path)
+    os.environ.update(city_env(args.city))
+    os.environ["WASTE_DB_PATH"] = db_path
+    os.environ["WASTE_MODELS_DIR"] = os.path.join(args.city, "models")
+
+    import main as app
+    from benchmarks.macro import run_macro
+    from benchmarks.micro import run_micro
+
+    # Load tests must not send real SMS
+    app.resources.set("sms_client", NullSMSClient())
+    results = {f"micro.{name}": result for name, result in run_micro(app, args.repeat).items()}
+    if not args.skip_macro:
+        results.update({f"macro.{name}": result for name, result in run_macro(app, args.repeat).items()})
+    with open(args.out, "w") as f:
+        json.dump(results, f)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""Synthetic city generator for load and scale testing.
+
+Usage (from the backend directory):
+
+    python citygen.py --houses 100000 --days 365 --out city_100k
+
+The output directory holds everything the API and the offline tools read:
+
+    houses.csv            house_id, lat, lon, neighborhood_type, ward
+    enhanced_dataset.csv  latest day per house, the snapshot main.py predicts from
+    history.parquet       daily waste per house (history.csv without pyarrow), input for features.py
+    distance_matrix.csv   only up to --matrix-limit houses, larger cities use coordinate distances
+    waste_management.db   houses, house_registry, routes, route_distances, visits and house_visits pre-populated
+
+Serve it with the environment printed at the end. Houses, history and routes are
+generated with NumPy array operations rather than per-house or per-day loops.
+"""
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from distances import KM_PER_DEGREE, CoordinateDistances
+from features import NEIGHBORHOOD_TYPES
+from schema import init_db
+from training import DAYS_OF_WEEK, WEATHER_CONDITIONS
+
+logger = logging.getLogger(__name__)
+
+CITY_CENTER = (18.5204, 73.8567)
+HOUSES_PER_NEIGHBORHOOD = 250
+DEFAULT_PHONE_NUMBER = '+919945100418'
+# Same generating process as the notebook: base kg per neighborhood type, adjusted by weather
+BASE_WASTE = {"Residential": 8.0, "Commercial": 15.0}
+WEATHER_ADJUSTMENT = {"Sunny": 0.0, "Rainy": -2.0, "Cloudy": 1.0}
+WEATHER_PROBABILITIES = [0.6, 0.2, 0.2]
+
+
+def generate_houses(num_houses, num_wards, rng):
+    num_neighborhoods = max(1, num_houses // HOUSES_PER_NEIGHBORHOOD)
+    # Keep the density roughly constant as the city grows
+    city_radius_km = 2.0 * np.sqrt(num_houses / 1000.0) + 1.0
+
+    angle = rng.uniform(0, 2 * np.pi, num_neighborhoods)
+    radius = city_radius_km * np.sqrt(rng.uniform(0, 1, num_neighborhoods))
+    center_x, center_y = radius * np.cos(angle), radius * np.sin(angle)
+    commercial = rng.random(num_neighborhoods) < 0.2
+
+    neighborhood = rng.integers(0, num_neighborhoods, num_houses)
+    x = center_x[neighborhood] + rng.normal(0, 0.3, num_houses)
+    y = center_y[neighborhood] + rng.normal(0, 0.3, num_houses)
+    lat = CITY_CENTER[0] + y / KM_PER_DEGREE
+    lon = CITY_CENTER[1] + x / (KM_PER_DEGREE * np.cos(np.radians(CITY_CENTER[0])))
+
+    sector = ((np.arctan2(y, x) + np.pi) / (2 * np.pi) * num_wards).astype(np.int64) % num_wards
+    return pd.DataFrame({
+        'house_id': np.arange(1, num_houses + 1),
+        'lat': lat,
+        'lon': lon,
+        'neighborhood_type': np.where(commercial[neighborhood], "Commercial", "Residential"),
+        'ward': ("Ward-" + pd.Series(sector + 1).astype(str).str.zfill(2)).to_numpy(),
+    })
+
+
+def generate_days(start_date, num_days, rng):
+    dates = pd.date_range(start=start_date, periods=num_days)
+    weather = rng.choice(len(WEATHER_CONDITIONS), size=num_days, p=WEATHER_PROBABILITIES)
+    weekend = dates.dayofweek >= 5
+    is_holiday = (weekend | (rng.random(num_days) < 0.1)).astype(np.int8)
+    return pd.DataFrame({
+        'date': dates.strftime("%Y-%m-%d"),
+        'day': np.array(DAYS_OF_WEEK)[dates.dayofweek],
+        'isholiday': is_holiday,
+        'weather': np.array(WEATHER_CONDITIONS)[weather],
+    })
+
+
+# Waste for a block of days x all houses in one array operation
+def generate_waste(houses, days, rng):
+    base = houses['neighborhood_type'].map(BASE_WASTE).to_numpy(dtype=np.float32)
+    adjustment = days['weather'].map(WEATHER_ADJUSTMENT).to_numpy(dtype=np.float32)
+    noise = rng.normal(0, 2, size=(len(days), len(houses))).astype(np.float32)
+    return np.maximum(base[None, :] + adjustment[:, None] + noise, 0)
+
+
+def history_frame(houses, days, waste):
+    num_houses, num_days = len(houses), len(days)
+    # Repeated strings as categoricals, written as dictionary-encoded columns
+    day_index = np.repeat(np.arange(num_days), num_houses)
+    neighborhood = pd.Categorical(houses['neighborhood_type'], categories=NEIGHBORHOOD_TYPES)
+    return pd.DataFrame({
+        'house_id': np.tile(houses['house_id'].to_numpy(), num_days),
+        'date': pd.Categorical.from_codes(day_index, categories=days['date'].to_numpy()),
+        'day': pd.Categorical.from_codes(
+            pd.Categorical(days['day'], categories=DAYS_OF_WEEK).codes[day_index], categories=DAYS_OF_WEEK
+        ),
+        'isholiday': days['isholiday'].to_numpy()[day_index],
+        'weather': pd.Categorical.from_codes(
+            pd.Categorical(days['weather'], categories=WEATHER_CONDITIONS).codes[day_index], categories=WEATHER_CONDITIONS
+        ),
+        'neighborhood_type': pd.Categorical.from_codes(np.tile(neighborhood.codes, num_days), categories=NEIGHBORHOOD_TYPES),
+        'waste_weight': waste.ravel(),
+    })
+
+
+# Write the history a block of days at a time, returns the last two days of waste
+def write_history(houses, days, out_dir, rng, max_rows_per_block=5_000_000, write=True):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        pa = None
+    path = os.path.join(out_dir, "history.parquet" if pa else "history.csv")
+    days_per_block = max(1, max_rows_per_block // len(houses))
+    writer = None
+    tail = None
+    for start in range(0, len(days), days_per_block):
+        block_days = days.iloc[start:start + days_per_block]
+        waste = generate_waste(houses, block_days, rng)
+        tail = waste[-2:] if tail is None or len(waste) >= 2 else np.vstack([tail[-1:], waste])
+        if not write:
+            continue
+        block = history_frame(houses, block_days, waste)
+        if pa:
+            table = pa.Table.from_pandas(block, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema, compression="zstd")
+            writer.write_table(table)
+        else:
+            block.to_csv(path, mode="a", header=start == 0, index=False)
+    if writer is not None:
+        writer.close()
+    return tail
+
+
+# The one-day snapshot in enhanced_dataset.csv layout
+def snapshot_frame(houses, last_day, tail):
+    today = tail[-1]
+    previous = tail[-2] if len(tail) > 1 else np.full_like(today, today.mean())
+    neighborhood_encoded = pd.Categorical(houses['neighborhood_type'], categories=NEIGHBORHOOD_TYPES).codes
+    return pd.DataFrame({
+        'house_id': houses['house_id'],
+        'date': last_day['date'],
+        'day': last_day['day'],
+        'isholiday': last_day['isholiday'],
+        'weather': last_day['weather'],
+        'neighborhood_type': houses['neighborhood_type'],
+        'waste_weight': today,
+        'day_encoded': DAYS_OF_WEEK.index(last_day['day']),
+        'neighborhood_encoded': neighborhood_encoded,
+        'weather_encoded': WEATHER_CONDITIONS.index(last_day['weather']),
+        'previous_day_waste': previous,
+    })
+
+
+# Past routes in the format the API writes them: sorted ids stored as "12.0,15.0,..."
+def populate_db(db_path, houses, distances, route_dates, stops_per_route, rng):
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    conn = init_db(db_path)
+    cursor = conn.cursor()
+    house_ids = houses['house_id'].to_numpy()
+    num_routes = len(route_dates)
+    stops_per_route = min(stops_per_route, len(house_ids))
+
+    order = rng.permutation(house_ids)
+    picks = np.resize(order, num_routes * stops_per_route).reshape(num_routes, stops_per_route)
+    picks = np.sort(picks, axis=1)
+
+    visited = np.zeros(len(house_ids), dtype=np.int64)
+    if num_routes * stops_per_route < len(house_ids):
+        visited[picks.ravel() - 1] = 1
+    cursor.executemany(
+        "INSERT INTO houses (house_id, visited) VALUES (?, ?)",
+        zip(house_ids.tolist(), visited.tolist()),
+    )
+
+    cursor.executemany(
+        "INSERT INTO house_registry (house_id, lat, lon, neighborhood_type, ward) VALUES (?, ?, ?, ?, ?)",
+        zip(house_ids.tolist(), houses['lat'].tolist(), houses['lon'].tolist(), houses['neighborhood_type'].tolist(),
+            houses['ward'].tolist()),
+    )
+
+    route_texts = [",".join(f"{house_id}.0" for house_id in route) for route in picks.tolist()]
+    cursor.executemany("INSERT INTO routes (date, optimal_route) VALUES (?, ?)", zip(route_dates, route_texts))
+    route_ids = np.arange(1, num_routes + 1)
+
+    if stops_per_route > 1:
+        from_ids, to_ids = picks[:, :-1].ravel(), picks[:, 1:].ravel()
+        legs = distances.pairwise(from_ids, to_ids)
+        leg_routes = np.repeat(route_ids, stops_per_route - 1)
+        cursor.executemany(
+            "INSERT INTO route_distances (route_id, from_house_id, to_house_id, distance) VALUES (?, ?, ?, ?)",
+            zip(leg_routes.tolist(), from_ids.tolist(), to_ids.tolist(), legs.tolist()),
+        )
+
+    visit_dates = np.repeat(np.asarray(route_dates), stops_per_route)
+    cursor.executemany(
+        "INSERT INTO visits (date, house_id) VALUES (?, ?)",
+        zip(visit_dates.tolist(), picks.ravel().tolist()),
+    )
+
+    # Later routes overwrite earlier ones, leaving each house's latest visit
+    last_visited = pd.Series(visit_dates, index=picks.ravel())
+    last_visited = last_visited[~last_visited.index.duplicated(keep="last")].reindex(house_ids) + " 09:00:00"
+    last_visited = last_visited.astype(object).where(last_visited.notna(), None)
+    cursor.executemany(
+        "INSERT INTO house_visits (house_id, last_visited_date, phone_number) VALUES (?, ?, ?)",
+        zip(house_ids.tolist(), last_visited.tolist(), [DEFAULT_PHONE_NUMBER] * len(house_ids)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def generate_city(out_dir, num_houses, num_days=365, route_days=30, stops_per_route=50, num_wards=15,
+                  matrix_limit=1000, start_date="2023-01-01", seed=42, write_history_file=True):
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    started = time.perf_counter()
+
+    houses = generate_houses(num_houses, num_wards, rng)
+    houses.to_csv(os.path.join(out_dir, "houses.csv"), index=False)
+    distances = CoordinateDistances(houses['house_id'], houses['lat'], houses['lon'])
+    if num_houses <= matrix_limit:
+        distances.to_matrix().to_csv(os.path.join(out_dir, "distance_matrix.csv"))
+    logger.info(f"Generated {num_houses} houses in {time.perf_counter() - started:.2f}s")
+
+    days = generate_days(start_date, max(num_days, 1), rng)
+    tail = write_history(houses, days, out_dir, rng, write=write_history_file and num_days > 0)
+    snapshot_frame(houses, days.iloc[-1], tail).to_csv(os.path.join(out_dir, "enhanced_dataset.csv"), index=False)
+    logger.info(f"Generated {len(days)} days of history in {time.perf_counter() - started:.2f}s")
+
+    route_dates = days['date'].iloc[-route_days:].tolist() if route_days else []
+    populate_db(os.path.join(out_dir, "waste_management.db"), houses, distances, route_dates, stops_per_route, rng)
+    logger.info(f"City written to {out_dir} in {time.perf_counter() - started:.2f}s")
+    return houses
+
+
+# Environment that points main.py at a generated city
+def city_env(out_dir):
+    out_dir = os.path.abspath(out_dir)
+    return {
+        "WASTE_DB_PATH": os.path.join(out_dir, "waste_management.db"),
+        "DISTANCE_MATRIX_PATH": os.path.join(out_dir, "distance_matrix.csv"),
+        "HOUSES_PATH": os.path.join(out_dir, "houses.csv"),
+        "DATASET_PATH": os.path.join(out_dir, "enhanced_dataset.csv"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic city for load and scale testing")
+    parser.add_argument("--houses", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=365, help="Days of waste history")
+    parser.add_argument("--route-days", type=int, default=30, help="Past days with a route in the database")
+    parser.add_argument("--stops-per-route", type=int, default=50)
+    parser.add_argument("--wards", type=int, default=15)
+    parser.add_argument("--matrix-limit", type=int, default=1000, help="Largest city that gets a dense distance_matrix.csv")
+    parser.add_argument("--start-date", default="2023-01-01")
+    parser.add_argument("--no-history", action="store_true", help="Skip writing the history file")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="city")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    generate_city(
+        args.out, args.houses,
+        num_days=args.days,
+        route_days=args.route_days,
+        stops_per_route=args.stops_per_route,
+        num_wards=args.wards,
+        matrix_limit=args.matrix_limit,
+        start_date=args.start_date,
+        seed=args.seed,
+        write_history_file=not args.no_history,
+    )
+    for key, value in city_env(args.out).items():
+        print(f"export {key}={value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import os
+
+import numpy as np
+
+from distances import ROAD_FACTOR, haversine_km
+from routing import bisect_zones, get_executor, two_opt
+
+DEFAULT_SPEED_KMH = float(os.getenv("DEFAULT_SPEED_KMH", "25"))
+
+
+# Piecewise constant speeds, [[from_hour, km/h], ...]; the first entry also covers the hours before it
+class SpeedProfile:
+    def __init__(self, breakpoints=None):
+        breakpoints = sorted(breakpoints or [[0, DEFAULT_SPEED_KMH]])
+        self.hours = np.array([float(hour) for hour, _ in breakpoints])
+        self.kmh = np.array([float(kmh) for _, kmh in breakpoints])
+
+    def speed(self, minute):
+        index = int(np.searchsorted(self.hours, (minute / 60) % 24, side="right")) - 1
+        return self.kmh[max(index, 0)]
+
+    # A leg is driven at the speed of the hour it starts in
+    def travel_minutes(self, km, depart_minute):
+        return km / self.speed(depart_minute) * 60
+
+
+def parse_clock(clock):
+    hours, minutes = clock.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def format_clock(minute):
+    minute = int(round(minute))
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+# Matrix over the houses followed by the depot and the disposal sites. Legs to and from the sites are
+# straight lines times the road factor, from the registry coordinates
+def site_matrix(house_ids, distances, coordinates, depot, disposal_sites):
+    sites = np.array([depot] + list(disposal_sites), dtype=np.float64)
+    positions = coordinates.positions(house_ids)
+    lat = np.concatenate([coordinates.lat[positions], sites[:, 0]])
+    lon = np.concatenate([coordinates.lon[positions], sites[:, 1]])
+    matrix = haversine_km(lat[:, None], lon[:, None], lat[None, :], lon[None, :]) * ROAD_FACTOR
+    n = len(house_ids)
+    matrix[:n, :n] = distances.submatrix(house_ids)
+    return matrix
+
+
+# Open path from `start` through every node in `nodes`, always to the nearest unvisited one
+def _nearest_neighbor_from(matrix, start, nodes):
+    unvisited = list(nodes)
+    tour, current = [start], start
+    while unvisited:
+        nearest = int(np.argmin(matrix[current, unvisited]))
+        current = unvisited.pop(nearest)
+        tour.append(current)
+    return tour
+
+
+# Times along a trip: minute the last house is left, minute the disposal site is reached
+def _trip_timeline(matrix, start, houses, disposal, clock, speeds, service_minutes):
+    at = start
+    for house in houses:
+        clock += speeds.travel_minutes(matrix[at, house], clock) + service_minutes
+        at = house
+    return clock, clock + speeds.travel_minutes(matrix[at, disposal], clock)
+
+
+def _nearest_disposal(matrix, house, disposals):
+    return disposals[int(np.argmin(matrix[house, disposals]))]
+
+
+# One truck's working day: trips from the depot (later from the last disposal site) through houses and on to
+# the disposal site nearest the last stop, until the truck is full, the shift would overrun (including the
+# final drive back to the depot) or max_trips is reached. One tour through all the truck's houses is built up
+# front; every trip takes its houses in that tour's order and 2-opt polishes them from there, so each unload
+# cycle starts warm from what is left of the previous solution instead of being solved from scratch.
+# Mandatory houses (requested pickups) are offered to each trip before the others.
+# Works on matrix positions, so it can run in a pool process. Returns the trips and the houses left over
+def plan_truck_day(matrix, loads, houses, depot, disposals, capacity, shift_start, shift_minutes, speed_profile,
+                   service_minutes, unload_minutes, max_trips, mandatory=()):
+    speeds = SpeedProfile(speed_profile)
+    disposals = np.asarray(disposals, dtype=np.int64)
+    shift_end = shift_start + shift_minutes
+    nodes = [depot] + [int(h) for h in houses]
+    submatrix = matrix[np.ix_(nodes, nodes)]
+    warm = two_opt(submatrix, _nearest_neighbor_from(submatrix, 0, range(1, len(nodes))), fixed_start=True)
+    remaining = [nodes[i] for i in warm[1:]]
+
+    trips = []
+    clock, location = shift_start, depot
+    while remaining and len(trips) < max_trips:
+        trip, load, at, t = [], 0.0, location, clock
+        mandatory = [house for house in mandatory if house in remaining]
+        for house in mandatory + [house for house in remaining if house not in mandatory]:
+            if load + loads[house] > capacity:
+                continue
+            leave = t + speeds.travel_minutes(matrix[at, house], t) + service_minutes
+            disposal = _nearest_disposal(matrix, house, disposals)
+            unloaded = leave + speeds.travel_minutes(matrix[house, disposal], leave) + unload_minutes
+            if unloaded + speeds.travel_minutes(matrix[disposal, depot], unloaded) > shift_end:
+                continue
+            trip.append(house)
+            load += loads[house]
+            at, t = house, leave
+        if not trip:
+            break
+
+        disposal = _nearest_disposal(matrix, trip[-1], disposals)
+        nodes = [location] + trip + [disposal]
+        order = two_opt(matrix[np.ix_(nodes, nodes)], np.arange(len(nodes)), fixed_start=True, fixed_end=True)
+        polished = [nodes[i] for i in order[1:-1]]
+        polished_disposal = _nearest_disposal(matrix, polished[-1], disposals)
+        _, arrival = _trip_timeline(matrix, location, polished, polished_disposal, clock, speeds, service_minutes)
+        unloaded = arrival + unload_minutes
+        # Speeds change over the day, so a shorter order can still finish later; keep the greedy one then
+        if unloaded + speeds.travel_minutes(matrix[polished_disposal, depot], unloaded) <= shift_end:
+            trip, disposal = polished, polished_disposal
+        else:
+            _, arrival = _trip_timeline(matrix, location, trip, disposal, clock, speeds, service_minutes)
+            unloaded = arrival + unload_minutes
+
+        path = [location] + trip + [disposal]
+        trips.append({
+            "houses": trip,
+            "load": float(load),
+            "km": float(sum(matrix[a, b] for a, b in zip(path[:-1], path[1:]))),
+            "start": clock,
+            "end": unloaded,
+            "disposal": int(disposal),
+        })
+        taken = set(trip)
+        remaining = [house for house in remaining if house not in taken]
+        clock, location = unloaded, disposal
+
+    if trips:
+        # The last trip's km include the drive back to the depot
+        trips[-1]["km"] += float(matrix[location, depot])
+    return trips, remaining
+
+
+def _plan_truck_day(args):
+    return plan_truck_day(*args)
+
+
+# A full day for the fleet: the houses are split into one load-balanced group per truck, and each truck's
+# day is planned in the process pool. Returns per truck a list of trips (house ids, load, km, times and the
+# index of the disposal site) and the house ids that did not fit into any shift
+def plan_day(selected_houses, loads, distances, coordinates, depot, disposal_sites, num_trucks, capacity,
+             shift_start="06:00", max_hours=8.0, speed_profile=None, service_minutes=1.5, unload_minutes=20.0,
+             max_trips=4, workers=None, mandatory=()):
+    house_ids = np.array([int(h) for h in selected_houses], dtype=np.int64)
+    loads = np.asarray(loads, dtype=np.float64)
+    if len(house_ids) == 0:
+        return [[] for _ in range(num_trucks)], []
+    groups = bisect_zones(house_ids, loads, distances, num_trucks)
+    mandatory = {int(h) for h in mandatory}
+    jobs = []
+    for positions in groups:
+        ids = house_ids[positions]
+        matrix = site_matrix(ids, distances, coordinates, depot, disposal_sites)
+        n = len(ids)
+        jobs.append((matrix, loads[positions], np.arange(n), n, list(range(n + 1, n + 1 + len(disposal_sites))),
+                     capacity, parse_clock(shift_start), max_hours * 60, speed_profile, service_minutes,
+                     unload_minutes, max_trips, [i for i, h in enumerate(ids) if int(h) in mandatory]))
+    if len(jobs) > 1:
+        results = list(get_executor(workers).map(_plan_truck_day, jobs))
+    else:
+        results = [_plan_truck_day(job) for job in jobs]
+
+    days, unserved = [], []
+    for positions, (trips, remaining) in zip(groups, results):
+        ids = house_ids[positions]
+        n = len(ids)
+        for trip in trips:
+            trip["houses"] = [int(ids[house]) for house in trip["houses"]]
+            trip["disposal"] -= n + 1
+        days.append(trips)
+        unserved.extend(int(ids[house]) for house in remaining)
+    # bisect_zones gives fewer groups than trucks when there are fewer houses
+    days.extend([] for _ in range(num_trucks - len(days)))
+    return days, unserved
@@ -0,0 +1,152 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.0
+# Road distance is longer than the straight line between two houses
+ROAD_FACTOR = 1.3
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+# Dense house-to-house matrix, rows and columns are addressed by house id
+class MatrixDistances:
+    def __init__(self, house_ids, matrix, fallback=None):
+        self.house_ids = np.asarray(house_ids, dtype=np.int64)
+        self.matrix = matrix
+        self.index = {int(house_id): i for i, house_id in enumerate(self.house_ids)}
+        # Distances for houses added after the matrix was built, e.g. the house registry's coordinates
+        self.fallback = fallback
+
+    # distance_matrix.csv layout: first column holds the house ids, the other columns are named by house id
+    @classmethod
+    def from_csv(cls, path):
+        frame = pd.read_csv(path)
+        house_ids = frame.iloc[:, 0].to_numpy(dtype=np.int64)
+        frame = frame.set_index(frame.columns[0])
+        frame.columns = frame.columns.astype(np.int64)
+        return cls(house_ids, frame.loc[house_ids, house_ids].to_numpy(dtype=np.float64))
+
+    def to_csv(self, path):
+        frame = pd.DataFrame(self.matrix, columns=self.house_ids)
+        frame.insert(0, "0", self.house_ids)
+        frame.to_csv(path, index=False)
+
+    # Binary layout: float32 matrix in `path`, house ids next to it in `<path>.ids.npy`
+    @classmethod
+    def from_npy(cls, path, mmap=True):
+        matrix = np.load(path, mmap_mode="r" if mmap else None)
+        return cls(np.load(f"{path}.ids.npy"), matrix)
+
+    def to_npy(self, path):
+        np.save(path, np.asarray(self.matrix, dtype=np.float32))
+        np.save(f"{path}.ids.npy", self.house_ids)
+
+    def positions(self, house_ids):
+        return np.array([self.index[int(house_id)] for house_id in house_ids], dtype=np.int64)
+
+    # Whether a house only the fallback knows can be routed: its pairs with matrix houses are measured by the
+    # fallback, which then needs every matrix house as well
+    def fallback_covers_matrix(self):
+        return self.fallback is not None and all(int(house_id) in self.fallback.index for house_id in self.house_ids)
+
+    def _covers(self, house_ids):
+        return self.fallback is None or all(int(house_id) in self.index for house_id in house_ids)
+
+    def distance(self, from_house_id, to_house_id):
+        if not self._covers((from_house_id, to_house_id)):
+            return self.fallback.distance(from_house_id, to_house_id)
+        return float(self.matrix[self.index[int(from_house_id)], self.index[int(to_house_id)]])
+
+    def pairwise(self, from_house_ids, to_house_ids):
+        if not self._covers(list(from_house_ids) + list(to_house_ids)):
+            in_matrix = np.array(
+                [int(f) in self.index and int(t) in self.index for f, t in zip(from_house_ids, to_house_ids)], dtype=bool
+            )
+            result = self.fallback.pairwise(from_house_ids, to_house_ids)
+            if in_matrix.any():
+                from_ids, to_ids = np.asarray(from_house_ids)[in_matrix], np.asarray(to_house_ids)[in_matrix]
+                result[in_matrix] = self.matrix[self.positions(from_ids), self.positions(to_ids)]
+            return result
+        return np.asarray(self.matrix[self.positions(from_house_ids), self.positions(to_house_ids)], dtype=np.float64)
+
+    def submatrix(self, house_ids):
+        if not self._covers(house_ids):
+            in_matrix = np.array([int(house_id) in self.index for house_id in house_ids], dtype=bool)
+            result = self.fallback.submatrix(house_ids)
+            known = np.flatnonzero(in_matrix)
+            positions = self.positions(np.asarray(house_ids)[known])
+            result[np.ix_(known, known)] = self.matrix[np.ix_(positions, positions)]
+            return result
+        positions = self.positions(house_ids)
+        return np.asarray(self.matrix[np.ix_(positions, positions)], dtype=np.float64)
+
+
+# Distances computed on demand from house coordinates, for cities too large for a dense matrix
+class CoordinateDistances:
+    def __init__(self, house_ids, lat, lon, road_factor=ROAD_FACTOR):
+        self.house_ids = np.asarray(house_ids, dtype=np.int64)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.road_factor = road_factor
+        self.index = {int(house_id): i for i, house_id in enumerate(self.house_ids)}
+
+    @classmethod
+    def from_csv(cls, path):
+        frame = pd.read_csv(path, usecols=["house_id", "lat", "lon"])
+        return cls(frame["house_id"], frame["lat"], frame["lon"])
+
+    def add(self, house_id, lat, lon):
+        position = len(self.house_ids)
+        self.house_ids = np.append(self.house_ids, int(house_id))
+        self.lat = np.append(self.lat, float(lat))
+        self.lon = np.append(self.lon, float(lon))
+        # Published last, so concurrent readers never see an id without its coordinates
+        self.index[int(house_id)] = position
+
+    def positions(self, house_ids):
+        return np.array([self.index[int(house_id)] for house_id in house_ids], dtype=np.int64)
+
+    def distance(self, from_house_id, to_house_id):
+        i, j = self.index[int(from_house_id)], self.index[int(to_house_id)]
+        return float(haversine_km(self.lat[i], self.lon[i], self.lat[j], self.lon[j]) * self.road_factor)
+
+    def pairwise(self, from_house_ids, to_house_ids):
+        i, j = self.positions(from_house_ids), self.positions(to_house_ids)
+        return haversine_km(self.lat[i], self.lon[i], self.lat[j], self.lon[j]) * self.road_factor
+
+    def submatrix(self, house_ids):
+        positions = self.positions(house_ids)
+        lat, lon = self.lat[positions], self.lon[positions]
+        return haversine_km(lat[:, None], lon[:, None], lat[None, :], lon[None, :]) * self.road_factor
+
+    def to_matrix(self):
+        return MatrixDistances(self.house_ids, self.submatrix(self.house_ids))
+
+
+# Prefer an explicit matrix, fall back to coordinates. A .npy matrix is memory-mapped,
+# so every worker process shares the same pages of the OS page cache
+def load_distances(matrix_path="distance_matrix.csv", houses_path="houses.csv"):
+    if matrix_path and os.path.exists(matrix_path):
+        if matrix_path.endswith(".npy"):
+            return MatrixDistances.from_npy(matrix_path)
+        return MatrixDistances.from_csv(matrix_path)
+    if houses_path and os.path.exists(houses_path):
+        return CoordinateDistances.from_csv(houses_path)
+    raise FileNotFoundError(f"Neither {matrix_path} nor {houses_path} exists")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert distance_matrix.csv to the memory-mappable .npy layout")
+    parser.add_argument("csv_path")
+    parser.add_argument("npy_path")
+    args = parser.parse_args()
+    MatrixDistances.from_csv(args.csv_path).to_npy(args.npy_path)
@@ -0,0 +1,200 @@
+"""Streaming CSV/Parquet exports of routes, visits, queries and waste requests.
+
+Rows are read with fetchmany and written out chunk by chunk, so memory stays
+flat however much history is exported. Usage (from the backend directory):
+
+    python export.py visits --db waste_management.db --format csv --out visits.csv
+    python export.py route_distances --format parquet --start 2024-01-01 --end 2024-12-31 --out legs.parquet
+
+Parquet needs pyarrow. Without --out, CSV is written to stdout.
+"""
+import argparse
+import csv
+import io
+import logging
+import sqlite3
+import sys
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+CHUNK_ROWS = 5000
+
+# name: (columns with their types, query, column the start/end dates filter on, order)
+EXPORTS = {
+    "routes": (
+        [("id", "int"), ("date", "text"), ("optimal_route", "text")],
+        "SELECT rowid, date, optimal_route FROM routes",
+        "date", "rowid",
+    ),
+    "route_distances": (
+        [("id", "int"), ("route_id", "int"), ("date", "text"), ("from_house_id", "int"), ("to_house_id", "int"),
+         ("distance", "real")],
+        """SELECT rd.id, rd.route_id, r.date, CAST(rd.from_house_id AS INTEGER), CAST(rd.to_house_id AS INTEGER),
+                  CAST(rd.distance AS REAL)
+           FROM route_distances rd LEFT JOIN routes r ON r.rowid = rd.route_id""",
+        "r.date", "rd.id",
+    ),
+    "visits": (
+        [("date", "text"), ("house_id", "int")],
+        "SELECT date, CAST(house_id AS INTEGER) FROM visits",
+        "date", "rowid",
+    ),
+    # Image blobs are left out, has_image tells which queries carry one
+    "user_queries": (
+        [("id", "int"), ("house_id", "int"), ("phone_number", "text"), ("query", "text"), ("status", "text"),
+         ("created_at", "text"), ("has_image", "bool")],
+        """SELECT id, CAST(house_id AS INTEGER), phone_number, query, status, created_at, image IS NOT NULL
+           FROM user_queries""",
+        "date(created_at)", "id",
+    ),
+    "waste_requests": (
+        [("id", "int"), ("house_id", "int"), ("date", "text"), ("description", "text"), ("status", "text"),
+         ("created_at", "text")],
+        "SELECT id, CAST(house_id AS INTEGER), date, description, status, created_at FROM waste_requests",
+        "date", "id",
+    ),
+}
+
+
+def connect_readonly(db_path):
+    # A streaming response is iterated from whichever threadpool thread is free
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+    conn.text_factory = lambda value: value.decode("utf-8", errors="replace")
+    return conn
+
+
+def columns_of(name):
+    return [column for column, _ in EXPORTS[name][0]]
+
+
+# Lists of at most chunk_rows rows, read from one statement so the export is a consistent snapshot
+def iter_chunks(db_path, name, start=None, end=None, chunk_rows=CHUNK_ROWS):
+    _, query, date_column, order = EXPORTS[name]
+    clauses, params = [], []
+    if start:
+        clauses.append(f"{date_column} >= ?")
+        params.append(start)
+    if end:
+        clauses.append(f"{date_column} <= ?")
+        params.append(end)
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    conn = connect_readonly(db_path)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"{query} ORDER BY {order}", params)
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+
+def iter_csv(chunks, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only, for an empty export
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+# Collects what ParquetWriter writes, so it can be handed out between row groups
+class _ChunkSink(io.RawIOBase):
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def arrow_schema(name):
+    types = {"int": pa.int64(), "real": pa.float64(), "text": pa.string(), "bool": pa.bool_()}
+    return pa.schema([(column, types[kind]) for column, kind in EXPORTS[name][0]])
+
+
+# One row group per chunk
+def iter_parquet(chunks, name):
+    schema = arrow_schema(name)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        for rows in chunks:
+            # SQLite hands booleans back as 0/1
+            arrays = [pa.array(values, type=pa.int64()).cast(pa.bool_()) if field.type == pa.bool_()
+                      else pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            data = sink.take()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def stream_export(db_path, name, format="csv", start=None, end=None, chunk_rows=CHUNK_ROWS):
+    chunks = iter_chunks(db_path, name, start, end, chunk_rows)
+    if format == "parquet":
+        return iter_parquet(chunks, name)
+    return iter_csv(chunks, columns_of(name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a table as CSV or Parquet")
+    parser.add_argument("table", choices=sorted(EXPORTS))
+    parser.add_argument("--db", default="waste_management.db")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+    parser.add_argument("--start", default=None, help="First date to export (YYYY-MM-DD)")
+    parser.add_argument("--end", default=None, help="Last date to export (YYYY-MM-DD)")
+    parser.add_argument("--out", default=None, help="Output file, stdout when omitted")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.format == "parquet" and pq is None:
+        parser.error("parquet export needs pyarrow")
+    if args.out is None and args.format == "parquet":
+        parser.error("parquet export needs --out")
+    out = open(args.out, "wb") if args.out else sys.stdout.buffer
+    size = 0
+    try:
+        for data in stream_export(args.db, args.table, args.format, args.start, args.end, args.chunk_rows):
+            out.write(data)
+            size += len(data)
+    finally:
+        if args.out:
+            out.close()
+    if args.out:
+        logger.info(f"Wrote {size} bytes of {args.table} to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
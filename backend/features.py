@@ -0,0 +1,173 @@
+"""Streaming feature engineering over raw waste history.
+
+Usage (from the backend directory):
+
+    python features.py history.csv --out features.parquet --latest house_features.parquet
+
+The history (CSV or Parquet with house_id, date, waste_weight and optionally
+isholiday, weather, neighborhood_type) is read in chunks. Lag and rolling
+statistics are computed per house with vectorized groupby operations, carrying
+the last `window` rows of every house into the next chunk, so the full history
+is never held in memory. It must be ordered by date within each house, which
+is how the generators append it.
+"""
+import argparse
+import logging
+
+import numpy as np
+import pandas as pd
+
+from training import TARGET_COLUMN, WEATHER_CONDITIONS
+
+logger = logging.getLogger(__name__)
+
+# Category codes used by enhanced_dataset.csv
+NEIGHBORHOOD_TYPES = ["Commercial", "Residential"]
+ROLLING_WINDOW = 7
+CARRY_COLUMNS = ['house_id', 'date', TARGET_COLUMN, 'neighborhood_encoded']
+OUTPUT_DTYPES = {
+    'date': str,
+    'house_id': np.int64,
+    'day_encoded': np.int8,
+    'isholiday': np.int8,
+    'neighborhood_encoded': np.int8,
+    'weather_encoded': np.int8,
+    'previous_day_waste': np.float32,
+    'rolling_mean': np.float32,
+    'rolling_std': np.float32,
+    TARGET_COLUMN: np.float32,
+}
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("pyarrow is required for Parquet input/output: pip install pyarrow")
+    return pyarrow
+
+
+def iter_history_chunks(path, chunksize, columns=None):
+    if path.endswith(".parquet"):
+        pa = _require_pyarrow()
+        for batch in pa.parquet.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize, usecols=columns)
+
+
+# Mean waste weight over the whole history, in a pass that reads only that column
+def history_mean(path, chunksize):
+    total, count = 0.0, 0
+    for chunk in iter_history_chunks(path, chunksize, columns=[TARGET_COLUMN]):
+        total += float(chunk[TARGET_COLUMN].astype(np.float32).sum())
+        count += len(chunk)
+    return total / count if count else 0.0
+
+
+# Day, holiday, weather and neighborhood encodings, all vectorized
+def encode_calendar(chunk):
+    dates = pd.to_datetime(chunk['date'])
+    encoded = pd.DataFrame({
+        'house_id': chunk['house_id'].to_numpy(dtype=np.int64),
+        'date': dates.dt.strftime("%Y-%m-%d").to_numpy(),
+        TARGET_COLUMN: chunk[TARGET_COLUMN].to_numpy(dtype=np.float32),
+        'day_encoded': dates.dt.dayofweek.to_numpy(dtype=np.int8),
+    })
+    if 'isholiday' in chunk:
+        encoded['isholiday'] = chunk['isholiday'].to_numpy(dtype=np.int8)
+    else:
+        encoded['isholiday'] = (encoded['day_encoded'] >= 5).astype(np.int8)
+    if 'weather' in chunk:
+        weather_codes = pd.Categorical(chunk['weather'], categories=WEATHER_CONDITIONS).codes
+        encoded['weather_encoded'] = weather_codes.astype(np.int8)
+    else:
+        encoded['weather_encoded'] = chunk['weather_encoded'].to_numpy(dtype=np.int8)
+    if 'neighborhood_type' in chunk:
+        neighborhood_codes = pd.Categorical(chunk['neighborhood_type'], categories=NEIGHBORHOOD_TYPES).codes
+        encoded['neighborhood_encoded'] = neighborhood_codes.astype(np.int8)
+    else:
+        encoded['neighborhood_encoded'] = chunk['neighborhood_encoded'].to_numpy(dtype=np.int8)
+    return encoded
+
+
+# Lag and rolling features for one chunk, given the tail rows carried from earlier chunks
+def compute_chunk_features(encoded, carry, fill_value, window=ROLLING_WINDOW):
+    encoded['_new'] = True
+    if carry is not None:
+        frame = pd.concat([carry.assign(_new=False), encoded], ignore_index=True)
+    else:
+        frame = encoded
+    frame = frame.sort_values(['house_id', 'date'], kind='stable', ignore_index=True)
+
+    by_house = frame.groupby('house_id', sort=False)
+    lagged = by_house[TARGET_COLUMN].shift(1)
+    rolling = lagged.groupby(frame['house_id'], sort=False).rolling(window, min_periods=1)
+    frame['rolling_mean'] = rolling.mean().reset_index(level=0, drop=True).astype(np.float32)
+    frame['rolling_std'] = rolling.std().reset_index(level=0, drop=True).astype(np.float32)
+    frame['previous_day_waste'] = lagged.fillna(fill_value).astype(np.float32)
+
+    new_carry = by_house.tail(window)[CARRY_COLUMNS]
+    features = frame.loc[frame['_new'].astype(bool), list(OUTPUT_DTYPES)].astype(OUTPUT_DTYPES)
+    return features, new_carry
+
+
+def build_features(history_path, out_path, latest_path=None, window=ROLLING_WINDOW, chunksize=1_000_000):
+    pa = _require_pyarrow()
+    writer = None
+    carry = None
+    rows = 0
+    # The first ever row of a house has no lag, it gets the mean of the whole history like the notebook's
+    # fillna did, so the features don't depend on the chunk size
+    fill_value = history_mean(history_path, chunksize)
+    try:
+        for chunk in iter_history_chunks(history_path, chunksize):
+            encoded = encode_calendar(chunk)
+            features, carry = compute_chunk_features(encoded, carry, fill_value, window)
+            table = pa.Table.from_pandas(features, preserve_index=False)
+            if writer is None:
+                writer = pa.parquet.ParquetWriter(out_path, table.schema, compression="zstd")
+            writer.write_table(table)
+            rows += len(features)
+            logger.info(f"Wrote {rows} feature rows")
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if latest_path and carry is not None:
+        write_latest_features(carry, latest_path)
+    return rows
+
+
+# Per-house snapshot the serving side needs for tomorrow's prediction, the carry already
+# holds exactly the last `window` rows of each house
+def write_latest_features(carry, latest_path):
+    pa = _require_pyarrow()
+    by_house = carry.groupby('house_id', sort=True)
+    latest = pd.DataFrame({
+        'last_date': by_house['date'].last(),
+        'neighborhood_encoded': by_house['neighborhood_encoded'].last(),
+        'previous_day_waste': by_house[TARGET_COLUMN].last(),
+        'rolling_mean': by_house[TARGET_COLUMN].mean(),
+        'rolling_std': by_house[TARGET_COLUMN].std(),
+    }).reset_index()
+    pa.parquet.write_table(pa.Table.from_pandas(latest, preserve_index=False), latest_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build lag/rolling features from raw waste history")
+    parser.add_argument("history", help="History CSV or Parquet, ordered by date")
+    parser.add_argument("--out", default="features.parquet")
+    parser.add_argument("--latest", default=None, help="Also write the per-house serving snapshot here")
+    parser.add_argument("--window", type=int, default=ROLLING_WINDOW)
+    parser.add_argument("--chunksize", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    rows = build_features(args.history, args.out, args.latest, window=args.window, chunksize=args.chunksize)
+    logger.info(f"Done: {rows} rows written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import threading
+import weakref
+
+import numpy as np
+
+# Per-model leaf values of every tree laid end to end, with each tree's offset into them
+_leaf_tables = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def quantile_column(q):
+    return f"predicted_waste_q{q:g}"
+
+
+def _leaf_table(model):
+    with _lock:
+        table = _leaf_tables.get(model)
+        if table is None:
+            trees = [estimator.tree_ for estimator in model.estimators_]
+            values = np.concatenate([tree.value[:, 0, 0] for tree in trees])
+            offsets = np.cumsum([0] + [tree.node_count for tree in trees[:-1]])
+            table = _leaf_tables[model] = (values, offsets)
+    return table
+
+
+# Forests average their trees, boosted models (whose estimators_ is an array of stages) do not
+def _is_forest(model):
+    estimators = getattr(model, "estimators_", None)
+    return isinstance(estimators, list) and hasattr(model, "apply") and all(hasattr(e, "tree_") for e in estimators)
+
+
+# (houses x trees) predictions: one apply() call finds every tree's leaf, one gather reads their values.
+# Other models give their point prediction as the only column
+def tree_predictions(model, X):
+    if not _is_forest(model):
+        return np.asarray(model.predict(X), dtype=np.float64)[:, None]
+    values, offsets = _leaf_table(model)
+    leaves = model.apply(X)
+    return values[leaves + offsets[None, :]]
+
+
+# Forest mean plus the requested quantiles of the per-tree predictions, per house
+def predict_distribution(model, X, quantiles=()):
+    per_tree = tree_predictions(model, X)
+    mean = per_tree.mean(axis=1)
+    if not len(quantiles):
+        return mean, {}
+    levels = np.quantile(per_tree, quantiles, axis=1)
+    return mean, dict(zip(quantiles, levels))
@@ -0,0 +1,209 @@
+"""House registry: location and attributes of every house, with a spatial index.
+
+Usage (from the backend directory), to load houses.csv into the database:
+
+    python house_registry.py --db waste_management.db --houses houses.csv
+
+houses.csv needs house_id, lat and lon, and may carry neighborhood_type and
+ward (citygen.py writes that layout). Houses added later through the API have
+no matrix row and are routed by their coordinates, so the matrix never needs
+to be rebuilt.
+"""
+import argparse
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+from distances import KM_PER_DEGREE, CoordinateDistances, haversine_km
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ["house_id", "lat", "lon", "neighborhood_type", "ward"]
+# Side of a spatial index cell, in km
+DEFAULT_CELL_KM = 0.5
+
+
+# Uniform lat/lon grid: each cell lists the houses inside it, a radius query only looks at the cells it overlaps
+class GridIndex:
+    def __init__(self, cell_km=DEFAULT_CELL_KM):
+        self.cell_deg = cell_km / KM_PER_DEGREE
+        self.cells = {}
+
+    def _cells(self, lat, lon):
+        rows = np.floor(np.asarray(lat) / self.cell_deg).astype(np.int64)
+        cols = np.floor(np.asarray(lon) / self.cell_deg).astype(np.int64)
+        return rows, cols
+
+    def insert_many(self, house_ids, lat, lon):
+        if len(house_ids) == 0:
+            return
+        rows, cols = self._cells(lat, lon)
+        grouped = pd.Series(np.asarray(house_ids, dtype=np.int64)).groupby([rows, cols]).agg(list)
+        for cell, ids in grouped.items():
+            self.cells.setdefault(cell, []).extend(ids)
+
+    def insert(self, house_id, lat, lon):
+        self.insert_many([house_id], [lat], [lon])
+
+    # Ids of the houses in every cell that overlaps the circle, a superset of the houses within radius_km
+    def candidates(self, lat, lon, radius_km):
+        lat_span = radius_km / KM_PER_DEGREE
+        lon_span = radius_km / (KM_PER_DEGREE * max(np.cos(np.radians(lat)), 1e-6))
+        rows, cols = self._cells([lat - lat_span, lat + lat_span], [lon - lon_span, lon + lon_span])
+        (row_min, row_max), (col_min, col_max) = rows.tolist(), cols.tolist()
+        ids = []
+        for row in range(row_min, row_max + 1):
+            for col in range(col_min, col_max + 1):
+                ids.extend(self.cells.get((row, col), ()))
+        return np.asarray(ids, dtype=np.int64)
+
+
+# Plain Lloyd's k-means with k-means++ seeding, on points in km
+def kmeans(points, k, seed=0, iterations=50):
+    rng = np.random.default_rng(seed)
+    k = min(k, len(points))
+    centers = [points[rng.integers(len(points))]]
+    closest = ((points - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        total = closest.sum()
+        choice = rng.choice(len(points), p=closest / total) if total > 0 else rng.integers(len(points))
+        centers.append(points[choice])
+        closest = np.minimum(closest, ((points - points[choice]) ** 2).sum(axis=1))
+    centers = np.array(centers)
+    labels = None
+    point_norms = (points ** 2).sum(axis=1)[:, None]
+    for _ in range(iterations):
+        # Squared distances without materialising a points x centers x 2 array
+        distances = point_norms - 2 * points @ centers.T + (centers ** 2).sum(axis=1)[None, :]
+        new_labels = distances.argmin(axis=1)
+        if labels is not None and (new_labels == labels).all():
+            break
+        labels = new_labels
+        for zone in range(k):
+            members = points[labels == zone]
+            if len(members):
+                centers[zone] = members.mean(axis=0)
+    return labels, centers
+
+
+# Local flat projection around the houses' mean position, good enough at city scale
+def project_km(lat, lon):
+    lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+    ref_lat = lat.mean()
+    return np.column_stack([(lon - lon.mean()) * KM_PER_DEGREE * np.cos(np.radians(ref_lat)), (lat - ref_lat) * KM_PER_DEGREE])
+
+
+class HouseRegistry:
+    def __init__(self, frame, cell_km=DEFAULT_CELL_KM):
+        self.frame = frame[COLUMNS].set_index("house_id")
+        located = self.frame.dropna(subset=["lat", "lon"])
+        self.coordinates = CoordinateDistances(located.index, located["lat"], located["lon"])
+        self.grid = GridIndex(cell_km)
+        self.grid.insert_many(located.index.to_numpy(), located["lat"].to_numpy(), located["lon"].to_numpy())
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_db(cls, cursor, cell_km=DEFAULT_CELL_KM):
+        cursor.execute(f"SELECT {', '.join(COLUMNS)} FROM house_registry ORDER BY house_id")
+        frame = pd.DataFrame([tuple(row) for row in cursor.fetchall()], columns=COLUMNS)
+        return cls(frame, cell_km)
+
+    def __len__(self):
+        return len(self.frame)
+
+    def __contains__(self, house_id):
+        return int(house_id) in self.frame.index
+
+    # Pick up houses another worker process added since this registry was loaded
+    def refresh(self, cursor):
+        cursor.execute("SELECT COUNT(*) FROM house_registry")
+        if cursor.fetchone()[0] == len(self.frame):
+            return
+        cursor.execute(f"SELECT {', '.join(COLUMNS)} FROM house_registry")
+        for row in cursor.fetchall():
+            if row[0] not in self:
+                self._add_local(*row)
+
+    def _add_local(self, house_id, lat, lon, neighborhood_type, ward):
+        with self._lock:
+            if house_id in self:
+                return
+            row = pd.DataFrame([[lat, lon, neighborhood_type, ward]], columns=COLUMNS[1:], index=[int(house_id)])
+            self.frame = pd.concat([self.frame, row])
+            if lat is not None and lon is not None:
+                self.coordinates.add(house_id, lat, lon)
+                self.grid.insert(house_id, lat, lon)
+
+    # Register a new house in the database and in memory, it gets no matrix row
+    def add(self, cursor, house_id, lat, lon, neighborhood_type, ward=None):
+        cursor.execute("""
+            INSERT INTO house_registry (house_id, lat, lon, neighborhood_type, ward)
+            VALUES (?, ?, ?, ?, ?)
+        """, (house_id, lat, lon, neighborhood_type, ward))
+        self._add_local(house_id, lat, lon, neighborhood_type, ward)
+
+    def next_house_id(self, cursor):
+        cursor.execute("SELECT MAX(house_id) FROM houses")
+        return (cursor.fetchone()[0] or 0) + 1
+
+    # (house_id, km) of every located house within radius_km in a straight line, nearest first
+    def within_km(self, lat, lon, radius_km):
+        candidates = self.grid.candidates(lat, lon, radius_km)
+        if len(candidates) == 0:
+            return []
+        positions = self.coordinates.positions(candidates)
+        km = haversine_km(lat, lon, self.coordinates.lat[positions], self.coordinates.lon[positions])
+        inside = km <= radius_km
+        order = np.argsort(km[inside], kind="stable")
+        return list(zip(candidates[inside][order].tolist(), km[inside][order].tolist()))
+
+    # Group located houses into compact service zones, returns a house_id -> zone Series and the zones' centers
+    def cluster_zones(self, num_zones, seed=0, house_ids=None):
+        located = self.frame.dropna(subset=["lat", "lon"])
+        if house_ids is not None:
+            located = located[located.index.isin(house_ids)]
+        if located.empty:
+            return pd.Series(dtype=np.int64, name="zone"), pd.DataFrame(columns=["lat", "lon"])
+        labels, _ = kmeans(project_km(located["lat"], located["lon"]), num_zones, seed=seed)
+        zones = pd.Series(labels, index=located.index, name="zone")
+        centers = located.groupby(labels)[["lat", "lon"]].mean()
+        return zones, centers
+
+
+# Upsert houses.csv into the house_registry table
+def import_houses(cursor, houses_path):
+    houses = pd.read_csv(houses_path)
+    for column in ("neighborhood_type", "ward"):
+        if column not in houses:
+            houses[column] = None
+    houses = houses[COLUMNS].astype(object).where(houses[COLUMNS].notna(), None)
+    cursor.executemany("""
+        INSERT INTO house_registry (house_id, lat, lon, neighborhood_type, ward)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(house_id) DO UPDATE SET lat=excluded.lat, lon=excluded.lon,
+            neighborhood_type=excluded.neighborhood_type, ward=excluded.ward
+    """, houses.itertuples(index=False, name=None))
+    cursor.executemany("INSERT OR IGNORE INTO houses (house_id) VALUES (?)", ((int(h),) for h in houses["house_id"]))
+    return len(houses)
+
+
+def main():
+    from schema import init_db
+
+    parser = argparse.ArgumentParser(description="Load houses.csv into the house registry")
+    parser.add_argument("--db", default="waste_management.db")
+    parser.add_argument("--houses", default="houses.csv")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    conn = init_db(args.db)
+    count = import_houses(conn.cursor(), args.houses)
+    conn.commit()
+    conn.close()
+    logger.info(f"Registered {count} houses in {args.db}")
+
+
+if __name__ == "__main__":
+    main()
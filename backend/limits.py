@@ -0,0 +1,196 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+
+# "class=rate/burst,...": tokens per second and bucket size per client for each endpoint class, e.g.
+# "planning=0.2/3,upload=1/5,export=0.1/2,driver=20/60,default=10/30". Classes without an entry, and without
+# a "default" one, are not limited. Off unless set: clients are told apart by address only, so every driver
+# behind one NAT would share a bucket; set it behind a proxy together with TRUST_FORWARDED_FOR
+RATE_LIMITS = os.getenv("RATE_LIMITS", "")
+# Requests planning at once per worker process, and how many more may wait for a turn before 429s
+PLANNING_CONCURRENCY = int(os.getenv("PLANNING_CONCURRENCY", "2"))
+PLANNING_QUEUE = int(os.getenv("PLANNING_QUEUE", "8"))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(5 * 1024 * 1024)))
+# Clients keyed by the first X-Forwarded-For address, only behind a proxy that sets it
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "0") == "1"
+# Buckets kept, least recently used clients beyond this start over with a full bucket
+MAX_TRACKED_CLIENTS = int(os.getenv("MAX_TRACKED_CLIENTS", "10000"))
+
+# Endpoint class by path, or by path prefix for the ones ending in "/"; everything else is "default"
+ENDPOINT_CLASSES = {
+    "/get-optimal-route": "planning",
+    "/simulate": "planning",
+    "/add-query": "upload",
+    "/export/": "export",
+    "/bulk-check-in": "driver",
+    "/update-visit-time": "driver",
+    "/skip-visit": "driver",
+    "/get-visit-info": "driver",
+    "/get-distance": "driver",
+}
+UNLIMITED_PATHS = {"/healthz", "/readyz", "/metrics"}
+
+
+def parse_rate_limits(spec):
+    limits = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        name, value = entry.split("=")
+        rate, burst = value.split("/")
+        limits[name.strip()] = (float(rate), float(burst))
+    return limits
+
+
+def endpoint_class(path):
+    for prefix, name in ENDPOINT_CLASSES.items():
+        if path == prefix or (prefix.endswith("/") and path.startswith(prefix)):
+            return name
+    return "default"
+
+
+def client_key(request):
+    if TRUST_FORWARDED_FOR and request.headers.get("x-forwarded-for"):
+        return request.headers["x-forwarded-for"].split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    # Seconds until a token is available, 0 when one was taken
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+
+# One token bucket per (client, endpoint class), so a client hammering planning keeps its driver budget
+class RateLimiter:
+    def __init__(self, limits, max_clients=MAX_TRACKED_CLIENTS, clock=time.monotonic):
+        self.limits = limits
+        self.max_clients = max_clients
+        self.clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def retry_after(self, client, name):
+        limit = self.limits.get(name, self.limits.get("default"))
+        if limit is None:
+            return 0.0
+        rate, burst = limit
+        now = self.clock()
+        key = (client, name)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(rate, burst, now)
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.take(now)
+
+
+# Admission for expensive work: at most max_active requests run, at most max_waiting wait for a slot, any
+# more are turned away at once. Waiting happens on the event loop, so queued requests hold no threadpool
+# thread and cheap endpoints keep theirs
+class WorkQueue:
+    def __init__(self, max_active=PLANNING_CONCURRENCY, max_waiting=PLANNING_QUEUE):
+        self.max_active = max_active
+        self.max_waiting = max_waiting
+        self.active = 0
+        self.waiting = 0
+        # Running average of how long a request holds its slot, for Retry-After
+        self.average_s = 1.0
+        self._loop = None
+        self._semaphore = None
+
+    def _get_semaphore(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._semaphore = loop, asyncio.Semaphore(self.max_active)
+        return self._semaphore
+
+    def full(self):
+        return self.active >= self.max_active and self.waiting >= self.max_waiting
+
+    def retry_after(self):
+        return max(1, math.ceil((self.waiting / self.max_active + 1) * self.average_s))
+
+    @asynccontextmanager
+    async def slot(self):
+        semaphore = self._get_semaphore()
+        self.waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.active -= 1
+            semaphore.release()
+            self.average_s += 0.2 * (time.perf_counter() - started - self.average_s)
+
+
+def too_many_requests(retry_after, detail):
+    return JSONResponse(status_code=429, content={"detail": detail},
+                        headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+# Caps request bodies on the given path prefixes: a Content-Length over max_bytes is refused before
+# anything is read, a body sent without one fails with 413 as soon as it streams past the limit
+class UploadLimit:
+    def __init__(self, app, max_bytes=MAX_UPLOAD_BYTES, paths=("/add-query",)):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = tuple(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.paths):
+            return await self.app(scope, receive, send)
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > self.max_bytes:
+            response = JSONResponse(status_code=413, content={"detail": f"Uploads are limited to {self.max_bytes} bytes"})
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail=f"Uploads are limited to {self.max_bytes} bytes")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+# The upload's bytes, read in chunks so an oversized file is rejected without being read whole
+async def read_upload(upload, max_bytes=MAX_UPLOAD_BYTES, chunk_size=64 * 1024):
+    chunks, size = [], 0
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            return b"".join(chunks)
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Uploads are limited to {max_bytes} bytes")
+        chunks.append(chunk)
@@ -1,26 +1,104 @@
 import base64
 import logging
-from fastapi import Depends, FastAPI, File, Form, HTTPException, UploadFile
+from fastapi import Depends, FastAPI, File, Form, HTTPException, Request, UploadFile
 from pydantic import BaseModel
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Dict, Optional
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from typing import List, Dict, Optional, Tuple
 import sqlite3
 import pandas as pd
 import numpy as np
-import joblib
 from datetime import datetime
-from twilio.rest import Client
 import os
+import re
+import time
+import uuid
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager, contextmanager
+import analytics
+import export
+from dayplan import format_clock, plan_day
+from distances import MatrixDistances, load_distances
+from features import NEIGHBORHOOD_TYPES
+from forecast import predict_distribution, quantile_column
+from house_registry import HouseRegistry
+from limits import (MAX_UPLOAD_BYTES, RATE_LIMITS, UNLIMITED_PATHS, RateLimiter, UploadLimit, WorkQueue, client_key,
+                    endpoint_class, parse_rate_limits, read_upload, too_many_requests)
+from metrics import registry as metrics_registry, span, time_request
+from model_registry import ModelRegistry, model_report
+from notifications import NotificationSender, enqueue_many
+from resources import ResourceRegistry
+from responses import check_format, fast_response
+from route_versions import (UNHASHED_FIELDS, inputs_hash, latest_version, list_versions, load_version, route_diff,
+                            save_version)
+from routing import PLANNERS, plan_routes
+from schema import create_tables
+from tenants import (DEFAULT_TENANT, TENANT_HEADER, TenantConfig, TenantRegistry, TenantResources, current_tenant,
+                     load_tenant_configs, use_tenant)
+from training import DAYS_OF_WEEK, WEATHER_CONDITIONS, LiveModel
 
 load_dotenv()
 
+# Lifespan event handler: create tables, then warm up resources without blocking startup
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Other tenants' databases are prepared when they are first used
+    prepare_db(default_tenant.db_path)
+    if os.getenv("PRELOAD_RESOURCES", "1") == "1":
+        resources.preload_in_background()
+    # Drain notifications left queued by a previous run, in every tenant database there is
+    for tenant_id, config in tenants.configs.items():
+        if os.path.exists(config.db_path):
+            notifier_for(tenant_id).start()
+    yield
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
-# CORS Middleware setup
+# Body size cap on uploads, checked while the body streams in rather than after it is buffered. Added before
+# the http middlewares so it sits inside them, next to the app that reads the body
+app.add_middleware(UploadLimit, max_bytes=MAX_UPLOAD_BYTES, paths=("/add-query",))
+# Request latency per endpoint, exposed on /metrics
+app.middleware("http")(time_request)
+
+# Every request runs for the tenant named by its X-Tenant-ID header, the default one without it
+@app.middleware("http")
+async def tenant_scope(request, call_next):
+    tenant_id = request.headers.get(TENANT_HEADER, DEFAULT_TENANT)
+    if tenant_id not in tenants:
+        return JSONResponse(status_code=404, content={"detail": f"Unknown tenant {tenant_id}"})
+    with tenants.active(tenant_id):
+        # Built here rather than on first resource use, which can be inside an open write transaction
+        await run_in_threadpool(tenants.state, tenant_id)
+        return await call_next(request)
+
+# Runs before tenant_scope: a client over its budget for the endpoint class, or a planning request finding
+# the queue full, is answered with 429 before any tenant state is touched
+@app.middleware("http")
+async def rate_limit(request, call_next):
+    if request.method == "OPTIONS" or request.url.path in UNLIMITED_PATHS:
+        return await call_next(request)
+    endpoint = endpoint_class(request.url.path)
+    client = f"{request.headers.get(TENANT_HEADER, DEFAULT_TENANT)}/{client_key(request)}"
+    retry_after = rate_limiter.retry_after(client, endpoint)
+    if retry_after:
+        metrics_registry.increment("rate_limited_total", {"class": endpoint, "reason": "rate"})
+        return too_many_requests(retry_after, f"Too many {endpoint} requests, retry later")
+    if endpoint != "planning":
+        return await call_next(request)
+    if planning_queue.full():
+        metrics_registry.increment("rate_limited_total", {"class": endpoint, "reason": "queue"})
+        return too_many_requests(planning_queue.retry_after(), "Planning queue is full, retry later")
+    queued = time.perf_counter()
+    async with planning_queue.slot():
+        metrics_registry.observe("planning_queue_wait_seconds", {}, time.perf_counter() - queued)
+        return await call_next(request)
+
+# CORS Middleware setup. Registered last so it is the outermost layer: preflights are answered before any
+# limit, and 429s, 413s and unknown-tenant 404s still carry the CORS headers the browser needs to read them
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -29,23 +107,158 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Load resources
-model = joblib.load("random_forest_model.joblib")
-distance_matrix = pd.read_csv('distance_matrix.csv')
-df = pd.read_csv("enhanced_dataset.csv")
+# Resource locations, overridable to serve a generated city (see citygen.py)
+DB_PATH = os.getenv("WASTE_DB_PATH", "waste_management.db")
+MODELS_DIR = os.getenv("WASTE_MODELS_DIR", "models")
+MODEL_PATH = os.getenv("WASTE_MODEL_PATH", "random_forest_model.joblib")
+DISTANCE_MATRIX_PATH = os.getenv("DISTANCE_MATRIX_PATH", "distance_matrix.csv")
+HOUSES_PATH = os.getenv("HOUSES_PATH", "houses.csv")
+DATASET_PATH = os.getenv("DATASET_PATH", "enhanced_dataset.csv")
+# Plans whole working days with depot, disposal sites and several trips per truck, see dayplan.py
+DAY_PLANNER = "multi_trip"
+MULTI_TRUCK_PLANNERS = ["zones", DAY_PLANNER]
+# Largest batch /bulk-check-in accepts
+MAX_CHECKIN_EVENTS = int(os.getenv("MAX_CHECKIN_EVENTS", "1000"))
+# Scenarios of one /simulate request evaluated concurrently
+SIMULATION_WORKERS = int(os.getenv("SIMULATION_WORKERS", os.cpu_count() or 1))
+# Several worker processes share the database, wait for each other's write locks instead of failing
+SQLITE_BUSY_TIMEOUT_S = float(os.getenv("SQLITE_BUSY_TIMEOUT_S", "30"))
+# How long a worker may hold a date's plan lease, and how often the others look whether it is gone
+PLAN_LEASE_S = float(os.getenv("PLAN_LEASE_S", "120"))
+PLAN_LEASE_POLL_S = float(os.getenv("PLAN_LEASE_POLL_S", "0.1"))
+# Per-client token buckets by endpoint class and the admission queue for planning, see limits.py
+rate_limiter = RateLimiter(parse_rate_limits(RATE_LIMITS))
+planning_queue = WorkQueue()
+
+# Resources are loaded lazily on first use, or in parallel by the lifespan preload. Each tenant has its own
+# model, houses, matrix and dataset (see tenants.py), the SMS client is shared by all of them
+def load_sms_client():
+    from twilio.rest import Client
+    return Client(os.getenv('TWILIO_ACCOUNT_SID'), os.getenv('TWILIO_AUTH_TOKEN'))
+
+def load_houses(config):
+    with open_db(config.db_path) as db:
+        return HouseRegistry.from_db(db.cursor())
+
+# The matrix when there is one, with registry coordinates for houses added after it was built
+def load_route_distances(config, resources):
+    houses = resources.get("houses")
+    if not os.path.exists(config.distance_matrix_path) and len(houses.coordinates.house_ids):
+        return houses.coordinates
+    distances = load_distances(config.distance_matrix_path, config.houses_path)
+    if isinstance(distances, MatrixDistances):
+        distances.fallback = houses.coordinates
+    return distances
+
+# The training dataset, whose neighborhoods also attribute houses the registry doesn't cover in the analytics
+def load_dataset(config):
+    dataset = pd.read_csv(config.dataset_path)
+    try:
+        with open_db(config.db_path) as db:
+            cursor = db.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            changed = analytics.sync_dataset_neighborhoods(cursor, dataset)
+            db.commit()
+        if changed:
+            logger.info(f"Recorded dataset neighborhoods of {changed} houses, analytics rollups rebuilt")
+    except sqlite3.Error:
+        logger.exception("Failed to record the dataset neighborhoods, analytics keep their current attribution")
+    return dataset
 
 # Database connection with context manager
 @contextmanager
-def get_db():
-    conn = sqlite3.connect("waste_management.db")
+def open_db(db_path):
+    conn = sqlite3.connect(db_path, timeout=SQLITE_BUSY_TIMEOUT_S)
     conn.row_factory = sqlite3.Row
     try:
         yield conn
     finally:
         conn.close()
 
-# Predict waste for today
-def predict_waste_for_today(house_ids, day_encoded, is_holiday, neighborhood_encoded, weather_encoded, previous_day_waste):
+# The current tenant's database
+def get_db():
+    return open_db(tenants.config().db_path)
+
+def prepare_db(db_path):
+    with open_db(db_path) as db:
+        # WAL lets readers in other workers proceed while one worker writes
+        db.execute("PRAGMA journal_mode=WAL")
+        cursor = db.cursor()
+        create_tables(cursor)
+        db.commit()
+
+# Everything loaded for one tenant, dropped again when the tenant is evicted
+class TenantState:
+    def __init__(self, config):
+        self.config = config
+        if config.tenant_id != DEFAULT_TENANT:
+            prepare_db(config.db_path)
+        self.live_model = LiveModel(models_dir=config.models_dir, fallback_path=config.model_path)
+        self.resources = ResourceRegistry()
+        self.resources.register("model", self.load_model)
+        self.resources.register("houses", lambda: load_houses(config))
+        self.resources.register("distances", lambda: load_route_distances(config, self.resources))
+        self.resources.register("dataset", lambda: load_dataset(config))
+        self.models = ModelRegistry(self.live_model, lambda: open_db(config.db_path), models_dir=config.models_dir)
+
+    def load_model(self):
+        self.live_model.get()
+        return self.live_model
+
+    def close(self):
+        self.models.shutdown()
+
+default_tenant = TenantConfig(
+    DEFAULT_TENANT, DB_PATH, DISTANCE_MATRIX_PATH, HOUSES_PATH, DATASET_PATH, MODELS_DIR, MODEL_PATH
+)
+tenants = TenantRegistry(load_tenant_configs(default_tenant), TenantState)
+shared_resources = ResourceRegistry()
+shared_resources.register("sms_client", load_sms_client)
+resources = TenantResources(tenants, shared_resources, shared_names=["sms_client"])
+
+# Queued SMS are sent per tenant database; senders are cheap and outlive evictions
+notifiers = {}
+
+def notifier_for(tenant_id):
+    if tenant_id not in notifiers:
+        db_path = tenants.config(tenant_id).db_path
+        # Other tenants' databases may not be prepared yet when the sender starts at startup
+        prepare = None if tenant_id == DEFAULT_TENANT else lambda: prepare_db(db_path)
+        notifiers.setdefault(tenant_id, NotificationSender(
+            lambda: open_db(db_path), lambda: resources.get("sms_client"), os.getenv('TWILIO_MESSAGING_SERVICE_SID'),
+            prepare=prepare
+        ))
+    return notifiers[tenant_id]
+
+# truck_capacity and num_trucks left out of a request come from the tenant's fleet
+def with_fleet(details):
+    fleet = tenants.config().fleet
+    update = {}
+    if details.truck_capacity is None:
+        update["truck_capacity"] = fleet.get("truck_capacity")
+    if details.num_trucks is None:
+        # Only the zones and multi_trip planners can use more than one truck
+        update["num_trucks"] = fleet.get("num_trucks", 1) if details.planner in MULTI_TRUCK_PLANNERS else 1
+    if details.planner == DAY_PLANNER:
+        shift = details.shift or Shift()
+        shift = update["shift"] = shift.model_copy(update={
+            key: fleet[key] for key in ("depot", "disposal_sites", "speed_profile")
+            if getattr(shift, key) is None and key in fleet
+        })
+        if shift.depot is None or not shift.disposal_sites:
+            raise HTTPException(status_code=400, detail="The multi_trip planner needs a depot and at least one disposal site")
+        if shift.max_hours <= 0 or shift.max_trips < 1 or not re.fullmatch(r"\d{1,2}:\d{2}", shift.start):
+            raise HTTPException(status_code=400, detail="shift needs a HH:MM start, positive max_hours and max_trips")
+    details = details.model_copy(update=update)
+    if details.truck_capacity is None:
+        raise HTTPException(status_code=400, detail="truck_capacity is required, this tenant has no fleet default")
+    return details
+
+# Predict waste for today: the mean prediction per house, plus a predicted_waste_q<q> column for each requested
+# quantile of the trees' predictions.
+# Batches predicted for a date are also logged and scored by the candidate models, see model_registry.py
+def predict_waste_for_today(house_ids, day_encoded, is_holiday, neighborhood_encoded, weather_encoded, previous_day_waste,
+                            quantiles=(), date=None):
     today_data = pd.DataFrame({
         'house_id': house_ids,
         'day_encoded': [day_encoded] * len(house_ids),
@@ -54,23 +267,314 @@ def predict_waste_for_today(house_ids, day_encoded, is_holiday, neighborhood_enc
         'weather_encoded': [weather_encoded] * len(house_ids),
         'previous_day_waste': previous_day_waste
     })
-    predictions = model.predict(today_data)
+    started = time.perf_counter()
+    predictions, levels = predict_distribution(resources.get("model").get(), today_data, quantiles)
+    if date is not None:
+        tenants.state().models.observe(date, today_data, predictions, time.perf_counter() - started)
     today_data['predicted_waste_weight'] = predictions
+    for q, level in levels.items():
+        today_data[quantile_column(q)] = level
     return today_data
 
+# Greedily fill the truck with the heaviest predicted houses, weighed by `column`. Mandatory houses
+# (requested pickups) are taken before any other, as long as they fit
+def select_houses(predictions, truck_capacity, column="predicted_waste_weight", mandatory=()):
+    predictions = predictions.sort_values(by=column, ascending=False)
+    if len(mandatory):
+        # Pickups first, heaviest first within each group; ordered through a separate array so no bool column
+        # turns the rows into objects
+        first = predictions["house_id"].isin([int(h) for h in mandatory]).to_numpy()
+        predictions = predictions.iloc[np.argsort(~first, kind="stable")]
+    selected_houses = []
+    current_weight = 0
+    for _, row in predictions.iterrows():
+        if current_weight + row[column] <= truck_capacity:
+            # Routes are stored as "12.0,15.0", whatever dtype the ids came in
+            selected_houses.append(float(row["house_id"]))
+            current_weight += row[column]
+        if current_weight >= truck_capacity:
+            break
+    return selected_houses
+
+# Consecutive (from, to, distance) legs of a route
+def route_legs(optimal_route):
+    distances = resources.get("distances")
+    legs = []
+    for i in range(len(optimal_route) - 1):
+        from_house_id = int(optimal_route[i])
+        to_house_id = int(optimal_route[i + 1])
+        legs.append((from_house_id, to_house_id, distances.distance(from_house_id, to_house_id)))
+    return legs
+
+# Most recent collected weight per house, falling back to the dataset's lag value
+def latest_collected_weights(cursor, today_data):
+    cursor.execute("""
+        SELECT cw.house_id, cw.collected_kg
+        FROM collected_weights cw
+        JOIN (SELECT house_id, MAX(id) AS id FROM collected_weights GROUP BY house_id) latest
+        ON cw.id = latest.id
+    """)
+    latest = {row["house_id"]: row["collected_kg"] for row in cursor.fetchall()}
+    previous_day_waste = today_data['previous_day_waste'].to_numpy(dtype=float, copy=True)
+    if latest:
+        overrides = today_data['house_id'].map(latest).to_numpy(dtype=float)
+        mask = ~np.isnan(overrides)
+        previous_day_waste[mask] = overrides[mask]
+    return previous_day_waste
+
+# Houses added after the dataset snapshot: neighborhood from the registry, the neighborhood's mean waste as lag
+def registered_house_rows(cursor, df, house_ids):
+    houses = resources.get("houses")
+    houses.refresh(cursor)
+    registered = houses.frame.loc[houses.frame.index.intersection(house_ids)].dropna(subset=["neighborhood_type"])
+    neighborhood_encoded = registered['neighborhood_type'].map(NEIGHBORHOOD_TYPES.index).astype(int)
+    mean_waste = df.groupby('neighborhood_encoded')['previous_day_waste'].mean()
+    return pd.DataFrame({
+        'house_id': registered.index.astype(int),
+        'neighborhood_encoded': neighborhood_encoded.to_numpy(),
+        'previous_day_waste': neighborhood_encoded.map(mean_waste).fillna(df['previous_day_waste'].mean()).to_numpy(),
+    })
+
+# Per-house model inputs for the given candidate houses
+def house_features(cursor, house_ids):
+    df = resources.get("dataset")
+    today_data = df[df['house_id'].isin(house_ids)]
+    missing = sorted(set(house_ids) - set(today_data['house_id']))
+    if missing:
+        today_data = pd.concat([today_data, registered_house_rows(cursor, df, missing)], ignore_index=True)
+    return {
+        "house_ids": today_data['house_id'].tolist(),
+        "neighborhood_encoded": today_data['neighborhood_encoded'].values,
+        "previous_day_waste": latest_collected_weights(cursor, today_data),
+    }
+
+# Log actual collected weights together with the features they were produced under.
+# Events are (house_id, visited_at, collected_kg), each one is the next one's lag for the same house
+def record_collected_weights(cursor, events):
+    events = sorted(events, key=lambda event: event[1])
+    house_ids = sorted({event[0] for event in events})
+    dates = sorted({event[1][:10] for event in events})
+
+    conditions = {}
+    for chunk in sql_chunks(dates):
+        cursor.execute(f"""
+            SELECT date, day_encoded, isholiday, weather_encoded FROM day_conditions
+            WHERE date IN ({','.join('?' * len(chunk))})
+        """, chunk)
+        conditions.update({row[0]: tuple(row[1:]) for row in cursor.fetchall()})
+
+    previous = {}
+    for chunk in sql_chunks(house_ids):
+        cursor.execute(f"""
+            SELECT cw.house_id, cw.collected_kg
+            FROM collected_weights cw
+            JOIN (SELECT house_id, MAX(id) AS id FROM collected_weights
+                  WHERE house_id IN ({','.join('?' * len(chunk))}) GROUP BY house_id) latest
+            ON cw.id = latest.id
+        """, chunk)
+        previous.update({row[0]: row[1] for row in cursor.fetchall()})
+
+    df = resources.get("dataset")
+    house_rows = df[df['house_id'].isin(house_ids)].drop_duplicates('house_id').set_index('house_id')
+    rows = []
+    for house_id, visited_at, collected_kg in events:
+        date = visited_at[:10]
+        if date in conditions:
+            day_encoded, is_holiday, weather_encoded = conditions[date]
+        else:
+            weekday = datetime.strptime(date, "%Y-%m-%d").weekday()
+            day_encoded, is_holiday, weather_encoded = weekday, int(weekday >= 5), None
+        known = house_id in house_rows.index
+        neighborhood_encoded = int(house_rows.at[house_id, 'neighborhood_encoded']) if known else None
+        if house_id in previous:
+            previous_day_waste = previous[house_id]
+        elif known:
+            previous_day_waste = float(house_rows.at[house_id, 'previous_day_waste'])
+        else:
+            previous_day_waste = None
+        rows.append((house_id, date, collected_kg, day_encoded, is_holiday, neighborhood_encoded, weather_encoded, previous_day_waste))
+        previous[house_id] = collected_kg
+
+    cursor.executemany("""
+        INSERT INTO collected_weights (house_id, date, collected_kg, day_encoded, isholiday,
+                                       neighborhood_encoded, weather_encoded, previous_day_waste)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+
+def record_collected_weight(cursor, house_id, visited_at, collected_kg):
+    record_collected_weights(cursor, [(house_id, visited_at, collected_kg)])
+
+# Append to the visit event log: (house_id, event_type, date, occurred_at, collected_kg, route_id) rows.
+# A trigger keeps house_visit_summary up to date
+def log_visit_events(cursor, events):
+    cursor.executemany("""
+        INSERT INTO visit_events (house_id, event_type, date, occurred_at, collected_kg, route_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, events)
+
+# Events of one check-in: the visit, and the collected weight when the driver reported one
+def visit_events_for(house_id, visited_at, collected_kg):
+    events = [(house_id, "visited", visited_at[:10], visited_at, None, None)]
+    if collected_kg is not None:
+        events.append((house_id, "collected", visited_at[:10], visited_at, collected_kg, None))
+    return events
+
+# Split values for `IN (...)` lists, staying under SQLite's bound-parameter limit
+def sql_chunks(values, size=500):
+    values = list(values)
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
 # Pydantic models
+# A working day for the multi_trip planner; depot, disposal sites and speeds default to the tenant's fleet
+class Shift(BaseModel):
+    # [lat, lon]
+    depot: Optional[List[float]] = None
+    disposal_sites: Optional[List[List[float]]] = None
+    start: str = "06:00"
+    max_hours: float = 8.0
+    # [[from_hour, km/h], ...], e.g. slower in the rush hours
+    speed_profile: Optional[List[List[float]]] = None
+    service_minutes: float = 1.5
+    unload_minutes: float = 20.0
+    max_trips: int = 4
+
 class DayDetails(BaseModel):
     day: str
     is_holiday: int
     weather: str
     date: str
-    truck_capacity: float
+    # Both default to the tenant's fleet
+    truck_capacity: Optional[float] = None
+    planner: str = "sorted"
+    # Trucks of truck_capacity each, only the zones planner splits the work between several
+    num_trucks: Optional[int] = None
+    # Options of the multi_start planner
+    search_starts: Optional[int] = None
+    search_budget_s: Optional[float] = None
+    search_seed: int = 0
+    # Accepted chance that a truck's load exceeds truck_capacity. When set, houses are packed by their
+    # (1 - overflow_probability) quantile instead of the mean prediction
+    overflow_probability: Optional[float] = None
+    shift: Optional[Shift] = None
+    # Plan a new version even when the inputs haven't changed
+    replan: bool = False
+
+class Scenario(BaseModel):
+    name: Optional[str] = None
+    day: str
+    is_holiday: int
+    weather: str
+    truck_capacity: Optional[float] = None
+    planner: str = "sorted"
+    num_trucks: Optional[int] = None
+    search_starts: Optional[int] = None
+    search_budget_s: Optional[float] = None
+    search_seed: int = 0
+    overflow_probability: Optional[float] = None
+    shift: Optional[Shift] = None
+    # Pickups requested for this date are planned first, as /get-optimal-route does; today when left out
+    date: Optional[str] = None
+
+class SimulationRequest(BaseModel):
+    scenarios: List[Scenario]
+
+class ScenarioResult(BaseModel):
+    name: Optional[str] = None
+    route: List[int]
+    truck_routes: List[List[int]]
+    kg_collected: float
+    km_driven: float
+    houses_visited: int
+    houses_skipped: int
+
+class HouseCreate(BaseModel):
+    house_id: Optional[int] = None
+    lat: float
+    lon: float
+    neighborhood_type: str
+    ward: Optional[str] = None
+    phone_number: Optional[str] = None
+
+class HouseResponse(BaseModel):
+    house_id: int
+    lat: float
+    lon: float
+    neighborhood_type: str
+    ward: Optional[str] = None
+
+class NearbyHouse(BaseModel):
+    house_id: int
+    distance_km: float
+
+class ServiceZone(BaseModel):
+    zone: int
+    center_lat: float
+    center_lon: float
+    house_ids: List[int]
+
+class TripResponse(BaseModel):
+    truck: int
+    trip: int
+    route: List[int]
+    load_kg: float
+    km: float
+    start: str
+    end: str
+    # Index into the shift's disposal_sites
+    disposal_site: int
 
 class OptimalRouteResponse(BaseModel):
     optimal_route: List[int]
+    truck_routes: Optional[List[List[int]]] = None
+    trips: Optional[List[TripResponse]] = None
+    version: Optional[int] = None
+    inputs_hash: Optional[str] = None
+    # The served plan was made from other inputs (pickups, model version, options); replan=true replaces it
+    stale: bool = False
+
+class RouteVersion(BaseModel):
+    version: int
+    inputs_hash: Optional[str] = None
+    stops: int
+    restored_from: Optional[int] = None
+    created_at: Optional[str] = None
+
+class RouteDiff(BaseModel):
+    date: str
+    from_version: int
+    to_version: int
+    inputs_hash: Optional[str] = None
+    added: List[int]
+    removed: List[int]
+    moved: List[int]
+    # [start, end, houses]: houses replace cached[start:end]
+    edits: List[Tuple[int, int, List[int]]]
+
+class RouteRollback(BaseModel):
+    version: int
 
 class VisitTimeUpdate(BaseModel):
     house_id: int
+    collected_kg: Optional[float] = None
+
+class CheckInEvent(BaseModel):
+    idempotency_key: str
+    house_id: int
+    visited_at: str
+    collected_kg: Optional[float] = None
+
+class BulkCheckIn(BaseModel):
+    events: List[CheckInEvent]
+
+class CheckInResult(BaseModel):
+    idempotency_key: str
+    status: str
+
+class BulkCheckInResponse(BaseModel):
+    applied: int
+    duplicates: int
+    notifications_queued: int
+    results: List[CheckInResult]
 
 class PhoneNumberUpdate(BaseModel):
     house_id: int
@@ -112,157 +616,563 @@ class WasteRequestResponse(BaseModel):
     status: str
     created_at: str
 
+class VisitSkip(BaseModel):
+    house_id: int
+    date: Optional[str] = None
+
+class VisitSummaryResponse(BaseModel):
+    house_id: int
+    last_planned_date: Optional[str] = None
+    last_visited_at: Optional[str] = None
+    planned_count: int
+    visit_count: int
+    skipped_count: int
+    collected_count: int
+    last_collected_kg: Optional[float] = None
+    rolling_avg_kg: Optional[float] = None
+    updated_at: Optional[str] = None
+
+class PeriodTotals(BaseModel):
+    period: str
+    planned_stops: int
+    visits: int
+    skipped: int
+    collections: int
+    collected_kg: float
+    routes: int
+    km: float
+    km_per_route: Optional[float] = None
+
+class NeighborhoodTrend(BaseModel):
+    period: str
+    neighborhood_type: str
+    planned_stops: int
+    visits: int
+    skipped: int
+    collections: int
+    collected_kg: float
+
+class ModelReport(BaseModel):
+    version: str
+    role: str
+    batches: int
+    rows: int
+    mean_latency_ms: Optional[float] = None
+    p95_latency_ms: Optional[float] = None
+    # Predictions whose house was collected on the planned date, the error columns are over these
+    scored: int
+    mae: Optional[float] = None
+    rmse: Optional[float] = None
+    bias: Optional[float] = None
+
 class LastVisitedDateResponse(BaseModel):
     house_id: int
     last_visited_date: str
 
-# Lifespan event handler for database initialization
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    with get_db() as db:
-        cursor = db.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS houses (
-                house_id INTEGER PRIMARY KEY,
-                visited INTEGER DEFAULT 0
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS routes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                date TEXT,
-                optimal_route TEXT
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS route_distances (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                route_id INTEGER,
-                from_house_id INTEGER,
-                to_house_id INTEGER,
-                distance REAL,
-                FOREIGN KEY(route_id) REFERENCES routes(id)
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS visits (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                date TEXT,
-                house_id INTEGER,
-                FOREIGN KEY(house_id) REFERENCES houses(house_id)
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS house_visits (
-                house_id INTEGER PRIMARY KEY,
-                last_visited_date TEXT DEFAULT NULL,
-                phone_number TEXT DEFAULT '+919945100418'
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_queries (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                house_id INTEGER NOT NULL,
-                phone_number TEXT NOT NULL,
-                query TEXT NOT NULL,
-                status TEXT DEFAULT 'pending',
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                image BLOB
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS waste_requests (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                house_id INTEGER,
-                date TEXT,
-                description TEXT,
-                status TEXT DEFAULT 'pending',
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(house_id) REFERENCES houses(house_id)
-            )
-        """)
-        db.commit()
-    yield
+def check_planner(planner, num_trucks, overflow_probability=None):
+    if planner not in PLANNERS + [DAY_PLANNER]:
+        raise HTTPException(status_code=400, detail=f"Unknown planner {planner}, expected one of {PLANNERS + [DAY_PLANNER]}")
+    if num_trucks < 1 or (num_trucks > 1 and planner not in MULTI_TRUCK_PLANNERS):
+        raise HTTPException(status_code=400, detail=f"num_trucks must be 1, or more with the {MULTI_TRUCK_PLANNERS} planners")
+    if overflow_probability is not None and not 0 < overflow_probability < 1:
+        raise HTTPException(status_code=400, detail="overflow_probability must be between 0 and 1")
+
+# Per-truck routes for the selected houses. The multi_trip planner also returns each truck's trips. Houses
+# that fit on no truck (zones) or into no shift (multi_trip) are left out, mandatory ones only as a last resort
+def plan_trucks(selected_houses, predictions, column, options, distances, houses, mandatory=()):
+    loads = house_loads(predictions, selected_houses, column)
+    if options.planner != DAY_PLANNER:
+        truck_routes = plan_routes(
+            selected_houses, distances, planner=options.planner, loads=loads, num_trucks=options.num_trucks,
+            starts=options.search_starts, time_budget_s=options.search_budget_s, seed=options.search_seed,
+            capacity=options.truck_capacity, keep=mandatory
+        )
+        return truck_routes, None
+    missing = [h for h in selected_houses if int(h) not in houses.coordinates.index]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"The multi_trip planner needs coordinates, {len(missing)} houses have none")
+    shift = options.shift
+    days, _ = plan_day(
+        selected_houses, loads, distances, houses.coordinates, shift.depot, shift.disposal_sites,
+        options.num_trucks, options.truck_capacity, shift_start=shift.start, max_hours=shift.max_hours,
+        speed_profile=shift.speed_profile, service_minutes=shift.service_minutes,
+        unload_minutes=shift.unload_minutes, max_trips=shift.max_trips, mandatory=mandatory
+    )
+    # Back to the selection's own values, routes are stored the way the other planners store them
+    originals = {int(h): h for h in selected_houses}
+    trips = [
+        {"truck": truck, "trip": number, "route": [originals[h] for h in trip["houses"]], "load_kg": trip["load"],
+         "km": trip["km"], "start": format_clock(trip["start"]), "end": format_clock(trip["end"]),
+         "disposal_site": trip["disposal"]}
+        for truck, day in enumerate(days) for number, trip in enumerate(day)
+    ]
+    truck_routes = [[h for trip in trips if trip["truck"] == truck for h in trip["route"]] for truck in range(options.num_trucks)]
+    return truck_routes, trips
+
+# Weight the selection may fill: every truck full, on every trip of the shift for the multi_trip planner
+def day_capacity(options):
+    trips = options.shift.max_trips if options.planner == DAY_PLANNER else 1
+    return options.truck_capacity * options.num_trucks * trips
+
+# Quantile the planner packs trucks against, None for the mean prediction
+def packing_quantile(overflow_probability):
+    return None if overflow_probability is None else round(1 - overflow_probability, 6)
+
+def packing_column(overflow_probability):
+    q = packing_quantile(overflow_probability)
+    return "predicted_waste_weight" if q is None else quantile_column(q)
+
+# Predicted load of each selected house, in route order
+def house_loads(predictions, houses, column="predicted_waste_weight"):
+    weights = predictions.set_index("house_id")[column]
+    return weights.loc[[int(h) for h in houses]].to_numpy()
+
+# Houses with a pending extra pickup request for `date`, which every plan for that date must serve
+def pending_pickups(cursor, date):
+    cursor.execute("SELECT DISTINCT house_id FROM waste_requests WHERE date = ? AND status = 'pending' ORDER BY house_id", (date,))
+    return [int(row["house_id"]) for row in cursor.fetchall()]
+
+def parse_route(optimal_route):
+    return list(map(lambda x: int(float(x)), optimal_route.split(','))) if optimal_route else []
+
+# Whether the date's latest plan answers this request, instead of planning a new version
+def serves(version, details, plan_hash):
+    if details.replan:
+        return False
+    return version["inputs_hash"] in (plan_hash, None) or details.date <= datetime.today().strftime("%Y-%m-%d")
+
+def plan_response(version, plan_hash=None):
+    response = {"optimal_route": parse_route(version["optimal_route"]), "version": version["version"],
+                "inputs_hash": version["inputs_hash"]}
+    if plan_hash is not None:
+        response["stale"] = version["inputs_hash"] not in (plan_hash, None)
+    if version["truck_routes"] is not None:
+        response["truck_routes"] = version["truck_routes"]
+    if version["trips"] is not None:
+        response["trips"] = version["trips"]
+    return response
+
+# One truck's stops, or the whole route; plans without per-truck routes are truck 0's
+def version_route(version, truck=None):
+    if truck is None:
+        return parse_route(version["optimal_route"])
+    truck_routes = version["truck_routes"] or [parse_route(version["optimal_route"])]
+    return truck_routes[truck] if 0 <= truck < len(truck_routes) else []
 
-app.lifespan = lifespan
+# Version 1 of a date planned before plans were versioned, read back from its route tables
+def backfill_version(cursor, date, route):
+    cursor.execute("SELECT optimal_route FROM route_trucks WHERE route_id = ? ORDER BY truck", (route["id"],))
+    truck_routes = [parse_route(row["optimal_route"]) for row in cursor.fetchall()] or None
+    cursor.execute("""
+        SELECT truck, trip, optimal_route, load_kg, km, start_time, end_time, disposal_site
+        FROM route_trips WHERE route_id = ? ORDER BY truck, trip
+    """, (route["id"],))
+    trips = [
+        {"truck": row["truck"], "trip": row["trip"], "route": parse_route(row["optimal_route"]),
+         "load_kg": row["load_kg"], "km": row["km"], "start": row["start_time"], "end": row["end_time"],
+         "disposal_site": row["disposal_site"]}
+        for row in cursor.fetchall()
+    ] or None
+    save_version(cursor, date, None, route["optimal_route"], truck_routes, trips)
+    return latest_version(cursor, date)
+
+# Writes a plan as the date's route, replacing the one planned before (route_id) if any, and records it
+# as a new version. Only the houses the plans differ in get their visits added or removed; a dropped house's
+# 'planned' event stays in the log, which is append-only, and an 'unplanned' one takes it back. Doesn't commit
+def store_plan(cursor, date, route_id, plan_hash, optimal_route, legs, houses, previous_houses,
+               truck_routes=None, trips=None, restored_from=None):
+    if route_id is None:
+        cursor.execute("INSERT INTO routes (date, optimal_route) VALUES (?, ?)", (date, optimal_route))
+        route_id = cursor.lastrowid
+    else:
+        cursor.execute("UPDATE routes SET optimal_route = ? WHERE rowid = ?", (optimal_route, route_id))
+        for table in ("route_distances", "route_trucks", "route_trips"):
+            cursor.execute(f"DELETE FROM {table} WHERE route_id = ?", (route_id,))
+    cursor.executemany("""
+        INSERT INTO route_distances (route_id, from_house_id, to_house_id, distance)
+        VALUES (?, ?, ?, ?)
+    """, [(route_id, from_house_id, to_house_id, distance) for from_house_id, to_house_id, distance in legs])
+    if truck_routes is not None:
+        cursor.executemany(
+            "INSERT INTO route_trucks (route_id, truck, optimal_route) VALUES (?, ?, ?)",
+            [(route_id, truck, ",".join(map(str, route))) for truck, route in enumerate(truck_routes)]
+        )
+    if trips:
+        cursor.executemany("""
+            INSERT INTO route_trips (route_id, truck, trip, optimal_route, load_kg, km, start_time, end_time, disposal_site)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(route_id, trip["truck"], trip["trip"], ",".join(map(str, trip["route"])), trip["load_kg"], trip["km"],
+               trip["start"], trip["end"], trip["disposal_site"]) for trip in trips])
+
+    cursor.executemany("UPDATE houses SET visited = 1 WHERE house_id = ?", [(h,) for h in houses])
+    kept = {int(h) for h in houses}
+    dropped = [h for h in previous_houses if int(h) not in kept]
+    cursor.executemany("DELETE FROM visits WHERE date = ? AND house_id = ?", [(date, int(h)) for h in dropped])
+    log_visit_events(cursor, [(int(h), "unplanned", date, None, None, route_id) for h in dropped])
+    planned_before = {int(h) for h in previous_houses}
+    added = [h for h in houses if int(h) not in planned_before]
+    cursor.executemany("INSERT INTO visits (date, house_id) VALUES (?, ?)", [(date, h) for h in added])
+    log_visit_events(cursor, [(int(h), "planned", date, None, None, route_id) for h in added])
+    return save_version(cursor, date, plan_hash, optimal_route, truck_routes, trips, restored_from)
+
+# Takes the date's plan lease unless another worker holds an unexpired one
+def claim_plan_lease(cursor, date, owner):
+    now = time.time()
+    cursor.execute("SELECT expires_at FROM plan_leases WHERE date = ?", (date,))
+    lease = cursor.fetchone()
+    if lease and lease["expires_at"] > now:
+        return False
+    cursor.execute("INSERT OR REPLACE INTO plan_leases (date, owner, expires_at) VALUES (?, ?, ?)",
+                   (date, owner, now + PLAN_LEASE_S))
+    return True
+
+def release_plan_lease(cursor, date, owner):
+    cursor.execute("DELETE FROM plan_leases WHERE date = ? AND owner = ?", (date, owner))
+
+# The date's route row and its latest version, None for both when the date has no plan yet. Plans made
+# before versioning get their version 1 here, which writes
+def current_plan(cursor, date):
+    cursor.execute("SELECT rowid AS id, optimal_route FROM routes WHERE date = ?", (date,))
+    route = cursor.fetchone()
+    if route is None:
+        return None, None
+    return route, latest_version(cursor, date) or backfill_version(cursor, date, route)
 
 # Endpoints
-@app.post("/get-optimal-route", response_model=OptimalRouteResponse)
+# Plans are versioned per date: the latest version is served while its inputs hash matches the request's,
+# a different hash (or replan) makes a new version in place of it. Dates that have started (today and past
+# ones) and plans made before versioning, whose inputs are unknown, are only replanned on request: drivers
+# may already be out on today's route, so a completed pickup or a model promotion marks it stale instead
+@app.post("/get-optimal-route", response_model=OptimalRouteResponse, response_model_exclude_none=True)
 def get_optimal_route(details: DayDetails):
+    details = with_fleet(details)
+    check_planner(details.planner, details.num_trucks, details.overflow_probability)
+    live_model = resources.get("model")
+    live_model.get()
     with get_db() as db:
         cursor = db.cursor()
-        cursor.execute("SELECT optimal_route FROM routes WHERE date = ?", (details.date,))
-        existing_route = cursor.fetchone()
-        if existing_route:
-            return {"optimal_route": list(map(lambda x: int(float(x)), existing_route["optimal_route"].split(',')))}
-
-        cursor.execute("SELECT house_id FROM houses WHERE visited = 0")
-        unvisited_houses = cursor.fetchall()
+        pickups = pending_pickups(cursor, details.date)
+        plan_hash = inputs_hash({**details.model_dump(exclude=UNHASHED_FIELDS), "pickups": pickups}, live_model.version)
+        cursor.execute("SELECT rowid AS id FROM routes WHERE date = ?", (details.date,))
+        if cursor.fetchone():
+            current = latest_version(cursor, details.date)
+            if current and serves(current, details, plan_hash):
+                return plan_response(current, plan_hash)
+        # Single-flight across workers without holding the write lock while planning: the first request claims
+        # the date's lease in a short transaction, concurrent ones wait for it to go and then find its route.
+        # Check-ins and other writers only ever wait for the two short transactions
+        owner = uuid.uuid4().hex
+        while True:
+            cursor.execute("BEGIN IMMEDIATE")
+            existing_route, current = current_plan(cursor, details.date)
+            if current and serves(current, details, plan_hash):
+                db.commit()
+                return plan_response(current, plan_hash)
+            claimed = claim_plan_lease(cursor, details.date, owner)
+            db.commit()
+            if claimed:
+                break
+            time.sleep(PLAN_LEASE_POLL_S)
 
-        if not unvisited_houses:
-            cursor.execute("UPDATE houses SET visited = 0")
+        try:
+            response = plan_route(cursor, details, plan_hash, pickups, existing_route)
+            with span("db_write"):
+                cursor.execute("BEGIN IMMEDIATE")
+                # Read again, the lease may have expired and another worker stored a plan meanwhile
+                existing_route, _ = current_plan(cursor, details.date)
+                previous_houses = parse_route(existing_route["optimal_route"]) if existing_route else []
+                if response.pop("reset"):
+                    cursor.execute("UPDATE houses SET visited = 0")
+                # The houses of the plan being replaced are candidates again
+                cursor.executemany("UPDATE houses SET visited = 0 WHERE house_id = ?", [(h,) for h in previous_houses])
+                cursor.execute("""
+                    INSERT OR REPLACE INTO day_conditions (date, day_encoded, isholiday, weather_encoded)
+                    VALUES (?, ?, ?, ?)
+                """, (details.date, DAYS_OF_WEEK.index(details.day), details.is_holiday,
+                      WEATHER_CONDITIONS.index(details.weather)))
+                optimal_route = response["optimal_route"]
+                truck_routes = response.get("truck_routes")
+                response["version"] = store_plan(
+                    cursor, details.date, existing_route["id"] if existing_route else None, plan_hash,
+                    ",".join(map(str, optimal_route)), response.pop("legs"), optimal_route, previous_houses,
+                    truck_routes, response.get("trips")
+                )
+                release_plan_lease(cursor, details.date, owner)
+                # One commit, so the plan, its visits and its version are replaced together
+                db.commit()
+        except BaseException:
+            db.rollback()
+            release_plan_lease(cursor, details.date, owner)
             db.commit()
-            return get_optimal_route(details)
+            raise
+        return response
 
-        house_ids = [house["house_id"] for house in unvisited_houses]
-        today_data = df[df['house_id'].isin(house_ids)]
-        neighborhood_encoded = today_data['neighborhood_encoded'].values
-        previous_day_waste = today_data['previous_day_waste'].values
+# Plans the date outside any transaction, from the houses unvisited when the lease was claimed plus those of the
+# plan it replaces. Houses that didn't fit on a truck or into the shift stay unvisited for the next plan. With
+# every house visited a new cycle starts over all of them ("reset", for the store transaction to apply)
+def plan_route(cursor, details, plan_hash, pickups, existing_route):
+    previous_houses = set(parse_route(existing_route["optimal_route"])) if existing_route else set()
+    cursor.execute("SELECT house_id, visited FROM houses")
+    houses = cursor.fetchall()
+    candidates = [house["house_id"] for house in houses if not house["visited"] or house["house_id"] in previous_houses]
+    reset = not candidates
+    if reset:
+        candidates = [house["house_id"] for house in houses]
 
-        days_of_week = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-        weather_conditions = ["Sunny", "Rainy", "Cloudy"]
-        day_encoded = days_of_week.index(details.day)
-        weather_encoded = weather_conditions.index(details.weather)
+    # Requested pickups are planned even when the house was visited recently
+    candidates += sorted(set(pickups) - set(candidates))
+    with span("features"):
+        features = house_features(cursor, candidates)
 
+    quantile = packing_quantile(details.overflow_probability)
+    column = packing_column(details.overflow_probability)
+    with span("inference"):
         predictions = predict_waste_for_today(
-            house_ids=house_ids,
-            day_encoded=day_encoded,
+            day_encoded=DAYS_OF_WEEK.index(details.day),
             is_holiday=details.is_holiday,
-            neighborhood_encoded=neighborhood_encoded,
-            weather_encoded=weather_encoded,
-            previous_day_waste=previous_day_waste
+            weather_encoded=WEATHER_CONDITIONS.index(details.weather),
+            quantiles=[quantile] if quantile is not None else (),
+            date=details.date,
+            **features
         )
 
-        predictions.sort_values(by="predicted_waste_weight", ascending=False, inplace=True)
+    with span("selection"):
+        selected_houses = select_houses(predictions, day_capacity(details), column, mandatory=pickups)
 
-        selected_houses = []
-        current_weight = 0
-        for _, row in predictions.iterrows():
-            if current_weight + row["predicted_waste_weight"] <= details.truck_capacity:
-                selected_houses.append(row["house_id"])
-                current_weight += row["predicted_waste_weight"]
-            if current_weight >= details.truck_capacity:
-                break
+    with span("routing"):
+        truck_routes, trips = plan_trucks(
+            selected_houses, predictions, column, details, resources.get("distances"), resources.get("houses"),
+            mandatory=pickups
+        )
+        optimal_route = [house for route in truck_routes for house in route]
+        legs = [leg for route in truck_routes for leg in route_legs(route)]
 
-        optimal_route = sorted(selected_houses)
+    response = {"optimal_route": optimal_route, "inputs_hash": plan_hash, "legs": legs, "reset": reset}
+    if details.planner in MULTI_TRUCK_PLANNERS:
+        response["truck_routes"] = truck_routes
+    if trips is not None:
+        response["trips"] = trips
+    return response
 
-        cursor.execute("INSERT INTO routes (date, optimal_route) VALUES (?, ?)", (details.date, ",".join(map(str, optimal_route))))
+# Versions of a date's plan, oldest first
+@app.get("/routes/{date}/versions", response_model=List[RouteVersion])
+def get_route_versions(date: str):
+    with get_db() as db:
+        versions = list_versions(db.cursor(), date)
+    if not versions:
+        raise HTTPException(status_code=404, detail=f"No versioned plan for {date}")
+    return [
+        {**version, "stops": len(parse_route(version["optimal_route"]))}
+        for version in versions
+    ]
+
+# What changed between a client's cached version and the latest one (or `to`), for the whole route or one
+# truck's. Apply the edits from the last one: each replaces cached[start:end] with its houses
+@app.get("/routes/{date}/diff", response_model=RouteDiff)
+def get_route_diff(date: str, since: int, to: Optional[int] = None, truck: Optional[int] = None):
+    with get_db() as db:
+        cursor = db.cursor()
+        target = load_version(cursor, date, to) if to is not None else latest_version(cursor, date)
+        cached = load_version(cursor, date, since)
+    if target is None or cached is None:
+        raise HTTPException(status_code=404, detail=f"Unknown plan version for {date}, fetch the full plan instead")
+    diff = route_diff(version_route(cached, truck), version_route(target, truck))
+    return {"date": date, "from_version": cached["version"], "to_version": target["version"],
+            "inputs_hash": target["inputs_hash"], **diff}
+
+# Serve an earlier version again. It is recorded as a new version, so clients keep diffing forward, and the
+# houses' visited flags and visits move with it in one transaction
+@app.post("/routes/{date}/rollback", response_model=OptimalRouteResponse, response_model_exclude_none=True)
+def rollback_route(date: str, rollback: RouteRollback):
+    with get_db() as db:
+        cursor = db.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT rowid AS id, optimal_route FROM routes WHERE date = ?", (date,))
+        existing_route = cursor.fetchone()
+        target = load_version(cursor, date, rollback.version)
+        if existing_route is None or target is None:
+            db.rollback()
+            raise HTTPException(status_code=404, detail=f"Version {rollback.version} of the {date} plan not found")
+        previous_houses = parse_route(existing_route["optimal_route"])
+        cursor.executemany("UPDATE houses SET visited = 0 WHERE house_id = ?", [(h,) for h in previous_houses])
+        truck_routes = target["truck_routes"] or [parse_route(target["optimal_route"])]
+        legs = [leg for route in truck_routes for leg in route_legs(route)]
+        store_plan(
+            cursor, date, existing_route["id"], target["inputs_hash"], target["optimal_route"], legs,
+            parse_route(target["optimal_route"]), previous_houses, target["truck_routes"], target["trips"],
+            restored_from=target["version"]
+        )
         db.commit()
+        return plan_response(latest_version(cursor, date))
 
-        route_id = cursor.lastrowid
-        for i in range(len(optimal_route) - 1):
-            from_house_id = optimal_route[i]
-            to_house_id = optimal_route[i + 1]
-            from_house_id = int(from_house_id)
-            to_house_id = int(to_house_id)
-            distance = distance_matrix.iloc[from_house_id, to_house_id]
+# What-if planning: runs the planner for each scenario against the current state without writing anything.
+# Scenarios with the same day conditions share one prediction, only the fleet parameters differ
+@app.post("/simulate", response_model=List[ScenarioResult])
+def simulate(request: SimulationRequest):
+    request.scenarios = [with_fleet(scenario) for scenario in request.scenarios]
+    for scenario in request.scenarios:
+        if scenario.day not in DAYS_OF_WEEK or scenario.weather not in WEATHER_CONDITIONS:
+            raise HTTPException(status_code=400, detail=f"Unknown day or weather in scenario {scenario.name or scenario}")
+        check_planner(scenario.planner, scenario.num_trucks, scenario.overflow_probability)
+    if not request.scenarios:
+        return []
+
+    with get_db() as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT house_id FROM houses WHERE visited = 0")
+        house_ids = [row["house_id"] for row in cursor.fetchall()]
+        if not house_ids:
+            # /get-optimal-route would start a new cycle over every house
+            cursor.execute("SELECT house_id FROM houses")
+            house_ids = [row["house_id"] for row in cursor.fetchall()]
+        today = datetime.today().strftime("%Y-%m-%d")
+        pickups_by_date = {date: pending_pickups(cursor, date) for date in {s.date or today for s in request.scenarios}}
+        # Requested pickups are planned even when the house was visited recently
+        extra = sorted(set().union(*pickups_by_date.values()) - set(house_ids))
+        with span("features"):
+            features = house_features(cursor, house_ids + extra)
+
+    conditions = sorted({(s.day, s.is_holiday, s.weather) for s in request.scenarios})
+    # Every packing quantile any scenario asks for, all computed in the same pass over the trees
+    quantiles = sorted({packing_quantile(s.overflow_probability) for s in request.scenarios} - {None})
+    workers = min(SIMULATION_WORKERS, len(request.scenarios))
+
+    tenant_id = current_tenant()
+
+    # Pool threads don't inherit the request's tenant
+    def predict(condition):
+        day, is_holiday, weather = condition
+        with use_tenant(tenant_id):
+            return predict_waste_for_today(
+                day_encoded=DAYS_OF_WEEK.index(day),
+                is_holiday=is_holiday,
+                weather_encoded=WEATHER_CONDITIONS.index(weather),
+                quantiles=quantiles,
+                **features
+            )
+
+    distances = resources.get("distances")
+    houses = resources.get("houses")
+
+    def run(scenario):
+        predictions = predictions_by_condition[(scenario.day, scenario.is_holiday, scenario.weather)]
+        pickups = pickups_by_date[scenario.date or today]
+        if extra:
+            # Houses only another date's pickups brought in
+            predictions = predictions[~predictions["house_id"].isin(set(extra) - set(pickups))]
+        column = packing_column(scenario.overflow_probability)
+        selected_houses = select_houses(predictions, day_capacity(scenario), column, mandatory=pickups)
+        truck_routes, trips = plan_trucks(selected_houses, predictions, column, scenario, distances, houses,
+                                          mandatory=pickups)
+        truck_routes = [[int(h) for h in route] for route in truck_routes]
+        route_ids = [house for route in truck_routes for house in route]
+        loads = house_loads(predictions, route_ids)
+        if trips is not None:
+            km_driven = sum(trip["km"] for trip in trips)
+        else:
+            km_driven = sum(
+                float(distances.pairwise(route[:-1], route[1:]).sum()) for route in truck_routes if len(route) > 1
+            )
+        return {
+            "name": scenario.name,
+            "route": route_ids,
+            "truck_routes": truck_routes,
+            "kg_collected": float(loads.sum()),
+            "km_driven": km_driven,
+            "houses_visited": len(route_ids),
+            "houses_skipped": len(predictions) - len(route_ids),
+        }
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="simulate") as pool:
+        with span("inference"):
+            predictions_by_condition = dict(zip(conditions, pool.map(predict, conditions)))
+        with span("scenarios"):
+            return list(pool.map(run, request.scenarios))
+
+# Register a house; it is routed by its coordinates, the distance matrix stays as it is
+@app.post("/houses", response_model=HouseResponse)
+def add_house(house: HouseCreate):
+    if house.neighborhood_type not in NEIGHBORHOOD_TYPES:
+        raise HTTPException(status_code=400, detail=f"neighborhood_type must be one of {NEIGHBORHOOD_TYPES}")
+    houses = resources.get("houses")
+    distances = resources.get("distances")
+    if isinstance(distances, MatrixDistances) and not distances.fallback_covers_matrix():
+        raise HTTPException(status_code=409, detail="Houses can only be added once every house in the distance matrix "
+                                                    "has coordinates, load them with house_registry.py")
+    with get_db() as db:
+        cursor = db.cursor()
+        # Taking the write lock first makes the id and the duplicate check hold until the commit, so concurrent
+        # requests get different ids, and the second of two for the same id gets the 409
+        cursor.execute("BEGIN IMMEDIATE")
+        house_id = houses.next_house_id(cursor) if house.house_id is None else house.house_id
+        cursor.execute("SELECT 1 FROM house_registry WHERE house_id = ?", (house_id,))
+        if cursor.fetchone():
+            db.rollback()
+            raise HTTPException(status_code=409, detail=f"House {house_id} already exists")
+        cursor.execute("INSERT OR IGNORE INTO houses (house_id) VALUES (?)", (house_id,))
+        if house.phone_number:
             cursor.execute("""
-                INSERT INTO route_distances (route_id, from_house_id, to_house_id, distance)
-                VALUES (?, ?, ?, ?)
-            """, (route_id, from_house_id, to_house_id, distance))
+                INSERT INTO house_visits (house_id, phone_number)
+                VALUES (?, ?)
+                ON CONFLICT(house_id)
+                DO UPDATE SET phone_number=excluded.phone_number
+            """, (house_id, house.phone_number))
+        houses.add(cursor, house_id, house.lat, house.lon, house.neighborhood_type, house.ward)
         db.commit()
+    return {"house_id": house_id, "lat": house.lat, "lon": house.lon,
+            "neighborhood_type": house.neighborhood_type, "ward": house.ward}
 
-        cursor.executemany("UPDATE houses SET visited = 1 WHERE house_id = ?", [(h,) for h in selected_houses])
-        db.commit()
+@app.get("/houses/within", response_model=List[NearbyHouse])
+def get_houses_within(lat: float, lon: float, radius_km: float):
+    if radius_km <= 0:
+        raise HTTPException(status_code=400, detail="radius_km must be positive")
+    houses = resources.get("houses")
+    with get_db() as db:
+        houses.refresh(db.cursor())
+    return [{"house_id": house_id, "distance_km": km} for house_id, km in houses.within_km(lat, lon, radius_km)]
 
-        visit_date = details.date
-        cursor.executemany("INSERT INTO visits (date, house_id) VALUES (?, ?)", [(visit_date, h) for h in selected_houses])
-        db.commit()
+@app.get("/houses/zones", response_model=List[ServiceZone])
+def get_service_zones(zones: int = 10, seed: int = 0):
+    if zones < 1:
+        raise HTTPException(status_code=400, detail="zones must be at least 1")
+    houses = resources.get("houses")
+    with get_db() as db:
+        houses.refresh(db.cursor())
+    assignment, centers = houses.cluster_zones(zones, seed=seed)
+    members = assignment.groupby(assignment).groups
+    return [
+        {"zone": int(zone), "center_lat": float(centers.loc[zone, "lat"]), "center_lon": float(centers.loc[zone, "lon"]),
+         "house_ids": [int(h) for h in house_ids]}
+        for zone, house_ids in members.items()
+    ]
+
+# Liveness: the process is up and serving, whether or not artifacts are loaded
+@app.get("/healthz")
+def healthz():
+    return {"status": "ok"}
 
-        return {"optimal_route": optimal_route}
+# Readiness: every artifact is loaded, so requests won't pay a cold start
+@app.get("/readyz")
+def readyz():
+    body = {"ready": resources.ready(), "resources": resources.status()}
+    if not body["ready"]:
+        return JSONResponse(status_code=503, content=body)
+    return body
 
+# Production latency and error of the served model and of the candidates scored in shadow
+@app.get("/models", response_model=List[ModelReport])
+def get_models():
+    with get_db() as db:
+        return model_report(db.cursor(), tenants.state().models.roles())
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+# ?format=rows|columns returns the same data through the fast path, see responses.py
 @app.get("/get-visit-history-all", response_model=List[Dict])
-def get_visit_history(date: Optional[str] = None):
+def get_visit_history(request: Request, date: Optional[str] = None, format: Optional[str] = None):
+    check_format(format)
     with get_db() as db:
         cursor = db.cursor()
         if date:
@@ -278,6 +1188,9 @@ def get_visit_history(date: Optional[str] = None):
             """)
         
         routes = cursor.fetchall()
+        if format:
+            rows = [(row[0], [int(float(house_id)) for house_id in row[1].split(',')]) for row in routes]
+            return fast_response(request, ["date", "house_ids"], rows, format)
         return [{"date": row["date"], 
                  "house_ids": [int(float(house_id)) for house_id in row["optimal_route"].split(',')]} 
                 for row in routes]
@@ -325,17 +1238,86 @@ def get_visit_history(date: Optional[str] = None):
         return visit_history
 
 @app.get("/get-last-visited-date", response_model=List[LastVisitedDateResponse])
-def get_last_visited_date():
+def get_last_visited_date(request: Request, format: Optional[str] = None):
+    check_format(format)
     with get_db() as db:
         cursor = db.cursor()
         cursor.execute("""
-            SELECT house_id, MAX(date) AS last_visited_date
-            FROM visits
-            GROUP BY house_id
+            SELECT house_id, last_planned_date AS last_visited_date
+            FROM house_visit_summary
+            WHERE last_planned_date IS NOT NULL
+            ORDER BY house_id
         """)
         last_visited_dates = cursor.fetchall()
+        if format:
+            return fast_response(request, ["house_id", "last_visited_date"], last_visited_dates, format)
         return [{"house_id": row["house_id"], "last_visited_date": row["last_visited_date"]} for row in last_visited_dates]
 
+def check_analytics_period(period):
+    if period not in analytics.PERIODS:
+        raise HTTPException(status_code=400, detail=f"period must be one of {list(analytics.PERIODS)}")
+
+# Stops, visits, kg collected, routes and km per day or week, read from the rollup tables only
+@app.get("/analytics/totals", response_model=List[PeriodTotals])
+def get_analytics_totals(period: str = "daily", start: Optional[str] = None, end: Optional[str] = None):
+    check_analytics_period(period)
+    with get_db() as db:
+        return analytics.period_totals(db.cursor(), period, start, end)
+
+@app.get("/analytics/daily", response_model=List[PeriodTotals])
+def get_analytics_daily(start: Optional[str] = None, end: Optional[str] = None):
+    return get_analytics_totals("daily", start, end)
+
+@app.get("/analytics/weekly", response_model=List[PeriodTotals])
+def get_analytics_weekly(start: Optional[str] = None, end: Optional[str] = None):
+    return get_analytics_totals("weekly", start, end)
+
+@app.get("/analytics/neighborhoods", response_model=List[NeighborhoodTrend])
+def get_analytics_neighborhoods(period: str = "weekly", start: Optional[str] = None, end: Optional[str] = None):
+    check_analytics_period(period)
+    # Loading the dataset records its neighborhoods, for houses missing from the registry
+    resources.get("dataset")
+    with get_db() as db:
+        return analytics.neighborhood_trends(db.cursor(), period, start, end)
+
+# Whole tables as chunked CSV or Parquet, read with fetchmany so memory stays flat however much is exported
+@app.get("/export/{table}")
+def export_table(table: str, format: str = "csv", start: Optional[str] = None, end: Optional[str] = None):
+    if table not in export.EXPORTS:
+        raise HTTPException(status_code=404, detail=f"Unknown export {table}, expected one of {sorted(export.EXPORTS)}")
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {sorted(export.FORMATS)}")
+    if format == "parquet" and export.pq is None:
+        raise HTTPException(status_code=501, detail="Parquet export needs pyarrow")
+    filename = f"{table}.{format}"
+    return StreamingResponse(
+        export.stream_export(tenants.config().db_path, table, format, start, end),
+        media_type=export.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+# Planned and actual visits side by side, read from the per-house summary rows
+@app.get("/visit-summary", response_model=List[VisitSummaryResponse])
+def get_visit_summary(house_id: Optional[int] = None):
+    with get_db() as db:
+        cursor = db.cursor()
+        if house_id is not None:
+            cursor.execute("SELECT * FROM house_visit_summary WHERE house_id = ?", (house_id,))
+        else:
+            cursor.execute("SELECT * FROM house_visit_summary ORDER BY house_id")
+        return [dict(row) for row in cursor.fetchall()]
+
+# A planned house the truck could not collect from
+@app.post("/skip-visit")
+def skip_visit(skip: VisitSkip):
+    date = skip.date or datetime.now().strftime("%Y-%m-%d")
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with get_db() as db:
+        cursor = db.cursor()
+        log_visit_events(cursor, [(skip.house_id, "skipped", date, now, None, None)])
+        db.commit()
+    return {"message": f"Visit to house {skip.house_id} on {date} marked as skipped"}
+
 @app.post("/set-phone-number")
 def set_phone_number(update: PhoneNumberUpdate):
     with get_db() as db:
@@ -351,10 +1333,6 @@ def set_phone_number(update: PhoneNumberUpdate):
         db.commit()
         return {"message": f"Phone number set for house {house_id}"}
 
-account_sid = os.getenv('TWILIO_ACCOUNT_SID')
-auth_token = os.getenv('TWILIO_AUTH_TOKEN')
-client = Client(account_sid, auth_token)
-
 @app.post("/update-visit-time")
 def update_visit_time(update: VisitTimeUpdate):
     with get_db() as db:
@@ -367,20 +1345,106 @@ def update_visit_time(update: VisitTimeUpdate):
             ON CONFLICT(house_id) 
             DO UPDATE SET last_visited_date=excluded.last_visited_date
         """, (house_id, now))
+        if update.collected_kg is not None:
+            record_collected_weight(cursor, house_id, now, update.collected_kg)
+        log_visit_events(cursor, visit_events_for(house_id, now, update.collected_kg))
         db.commit()
         cursor.execute("SELECT phone_number FROM house_visits WHERE house_id = ?", (house_id,))
         row = cursor.fetchone()
         if row and row["phone_number"]:
             try:
-                client.messages.create(
-                    messaging_service_sid=os.getenv('TWILIO_MESSAGING_SERVICE_SID'),
-                    body=f"House {house_id} was visited at {now}",
-                    to=row["phone_number"]
-                )
+                with span("sms_send"):
+                    resources.get("sms_client").messages.create(
+                        messaging_service_sid=os.getenv('TWILIO_MESSAGING_SERVICE_SID'),
+                        body=f"House {house_id} was visited at {now}",
+                        to=row["phone_number"]
+                    )
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"Failed to send SMS: {e}")
         return {"message": f"Visit time updated for house {house_id} at {now}"}
 
+# Visit timestamps in the format update-visit-time writes, ISO 8601 is accepted too
+def parse_visited_at(value):
+    visited_at = datetime.fromisoformat(value)
+    if visited_at.tzinfo is not None:
+        visited_at = visited_at.astimezone().replace(tzinfo=None)
+    return visited_at.strftime("%Y-%m-%d %H:%M:%S")
+
+# Batch of driver check-ins, e.g. synced after a truck regains coverage. Applied in one transaction;
+# events whose idempotency key was seen before (in this batch or an earlier one) are reported as duplicates
+@app.post("/bulk-check-in", response_model=BulkCheckInResponse)
+def bulk_check_in(batch: BulkCheckIn):
+    if len(batch.events) > MAX_CHECKIN_EVENTS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_CHECKIN_EVENTS} events per batch")
+    events = {}
+    for event in batch.events:
+        try:
+            visited_at = parse_visited_at(event.visited_at)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid visited_at {event.visited_at!r} for event {event.idempotency_key}")
+        events.setdefault(event.idempotency_key, (event.house_id, visited_at, event.collected_kg))
+
+    with get_db() as db:
+        cursor = db.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        seen = set()
+        for chunk in sql_chunks(events):
+            cursor.execute(f"""
+                SELECT idempotency_key FROM checkin_events
+                WHERE idempotency_key IN ({','.join('?' * len(chunk))})
+            """, chunk)
+            seen.update(row[0] for row in cursor.fetchall())
+        new_events = {key: event for key, event in events.items() if key not in seen}
+
+        cursor.executemany("""
+            INSERT INTO checkin_events (idempotency_key, house_id, visited_at, collected_kg)
+            VALUES (?, ?, ?, ?)
+        """, [(key, *event) for key, event in new_events.items()])
+        # Offline events can arrive out of order, the latest visit wins
+        cursor.executemany("""
+            INSERT INTO house_visits (house_id, last_visited_date)
+            VALUES (?, ?)
+            ON CONFLICT(house_id)
+            DO UPDATE SET last_visited_date=MAX(COALESCE(last_visited_date, ''), excluded.last_visited_date)
+        """, [(house_id, visited_at) for house_id, visited_at, _ in new_events.values()])
+        weights = [event for event in new_events.values() if event[2] is not None]
+        if weights:
+            record_collected_weights(cursor, weights)
+        log_visit_events(cursor, [
+            event for house_id, visited_at, collected_kg in new_events.values()
+            for event in visit_events_for(house_id, visited_at, collected_kg)
+        ])
+
+        phone_numbers = {}
+        for chunk in sql_chunks({house_id for house_id, _, _ in new_events.values()}):
+            cursor.execute(f"""
+                SELECT house_id, phone_number FROM house_visits
+                WHERE phone_number IS NOT NULL AND house_id IN ({','.join('?' * len(chunk))})
+            """, chunk)
+            phone_numbers.update({row[0]: row[1] for row in cursor.fetchall()})
+        notifications = [
+            (house_id, phone_numbers[house_id], f"House {house_id} was visited at {visited_at}")
+            for house_id, visited_at, _ in new_events.values() if house_id in phone_numbers
+        ]
+        enqueue_many(cursor, notifications)
+        db.commit()
+
+    if notifications:
+        notifier_for(current_tenant()).wake()
+    results = []
+    applied = set()
+    for event in batch.events:
+        key = event.idempotency_key
+        status = "applied" if key in new_events and key not in applied else "duplicate"
+        applied.add(key)
+        results.append({"idempotency_key": key, "status": status})
+    return {
+        "applied": len(new_events),
+        "duplicates": len(batch.events) - len(new_events),
+        "notifications_queued": len(notifications),
+        "results": results,
+    }
+
 @app.get("/get-distance")
 def get_distance(house1: int, house2: int):
     with get_db() as db:
@@ -455,6 +1519,13 @@ async def add_query(
     query: str = Form(...),
     image: Optional[UploadFile] = File(None),
 ):
+    # Read and validate image data if provided, in capped chunks and before a connection is held
+    image_data = None
+    if image:
+        if image.content_type not in ["image/jpeg", "image/png"]:
+            raise HTTPException(status_code=400, detail="Only JPEG or PNG images are supported")
+        image_data = await read_upload(image, MAX_UPLOAD_BYTES)
+
     with get_db() as db:
         cursor = db.cursor()
         
@@ -462,13 +1533,6 @@ async def add_query(
         cleaned_phone_number = clean_text(phone_number)
         cleaned_query = clean_text(query)
         
-        # Read and validate image data if provided
-        image_data = None
-        if image:
-            if image.content_type not in ["image/jpeg", "image/png"]:
-                raise HTTPException(status_code=400, detail="Only JPEG or PNG images are supported")
-            image_data = await image.read()
-        
         # Insert query with image data
         cursor.execute("""
             INSERT INTO user_queries (house_id, phone_number, query, image)
@@ -503,11 +1567,20 @@ async def add_query(
 
 # Endpoint to get all queries
 @app.get("/get-queries", response_model=List[QueryResponse])
-def get_queries():
+def get_queries(request: Request, format: Optional[str] = None):
+    check_format(format)
     with get_db() as db:
         cursor = db.cursor()
         cursor.execute("SELECT id, house_id, phone_number, query, status, created_at, image FROM user_queries")
         queries = cursor.fetchall()
+        if format:
+            rows = [
+                (query[0], query[1], clean_text(query[2]), clean_text(query[3]), query[4], clean_text(query[5]),
+                 base64.b64encode(query[6]).decode('utf-8') if query[6] else None)
+                for query in queries
+            ]
+            columns = ["id", "house_id", "phone_number", "query", "status", "created_at", "image"]
+            return fast_response(request, columns, rows, format)
         
         cleaned_queries = []
         for query in queries:
@@ -0,0 +1,226 @@
+import contextvars
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.95, 0.99)
+# Quantiles are computed over the most recent observations of each series
+WINDOW_SIZE = 1024
+
+
+class LatencySummary:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.window = deque(maxlen=WINDOW_SIZE)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.window.append(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            samples = sorted(self.window)
+            count, total = self.count, self.total
+        quantiles = {}
+        for q in QUANTILES:
+            quantiles[q] = samples[min(len(samples) - 1, int(q * len(samples)))] if samples else 0.0
+        return count, total, quantiles
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._series = {}
+        self._counters = Counter()
+        self._lock = threading.Lock()
+
+    def increment(self, name, labels):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += 1
+
+    def observe(self, name, labels, seconds):
+        key = (name, tuple(sorted(labels.items())))
+        summary = self._series.get(key)
+        if summary is None:
+            with self._lock:
+                summary = self._series.setdefault(key, LatencySummary())
+        summary.observe(seconds)
+
+    # Prometheus text exposition format
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            series_items = sorted(self._series.items())
+        lines = []
+        counter_names = set()
+        for (name, labels), value in counters:
+            if name not in counter_names:
+                counter_names.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        by_name = {}
+        for (name, labels), summary in series_items:
+            by_name.setdefault(name, []).append((labels, summary))
+        for name, series in by_name.items():
+            lines.append(f"# TYPE {name} summary")
+            for labels, summary in series:
+                count, total, quantiles = summary.snapshot()
+                for q, value in quantiles.items():
+                    lines.append(f"{name}{_format_labels(labels + (('quantile', str(q)),))} {value:.6f}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total:.6f}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = MetricsRegistry()
+
+
+# State of the request being served, visible to spans in the endpoint's worker thread
+class RequestContext:
+    def __init__(self, scope, profiled=False):
+        self.scope = scope
+        self.profiled = profiled
+        self.thread_ids = {threading.get_ident()}
+        self.stacks = Counter()
+
+    @property
+    def endpoint(self):
+        route = self.scope.get("route")
+        return getattr(route, "path", "unmatched")
+
+
+_current_request = contextvars.ContextVar("current_request", default=None)
+
+
+# Time a named stage of the current request
+@contextmanager
+def span(stage):
+    ctx = _current_request.get()
+    if ctx is not None and ctx.profiled:
+        ctx.thread_ids.add(threading.get_ident())
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        endpoint = ctx.endpoint if ctx is not None else "none"
+        registry.observe("stage_duration_seconds", {"endpoint": endpoint, "stage": stage}, time.perf_counter() - started)
+
+
+# Opt-in sampling profiler: stacks of sampled requests are collected every few
+# milliseconds and written out in folded (flamegraph) format when the request was slow
+class SlowRequestProfiler:
+    def __init__(self, slow_ms, sample_rate=1.0, interval_s=0.005, output_dir="profiles"):
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.interval_s = interval_s
+        self.output_dir = output_dir
+        self._active = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def should_profile(self):
+        return random.random() < self.sample_rate
+
+    def start(self, ctx):
+        with self._lock:
+            self._active.add(ctx)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+                self._thread.start()
+
+    def finish(self, ctx, elapsed_s):
+        with self._lock:
+            self._active.discard(ctx)
+        if elapsed_s * 1000 >= self.slow_ms and ctx.stacks:
+            self._write(ctx, elapsed_s)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval_s)
+            with self._lock:
+                active = list(self._active)
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for ctx in active:
+                for thread_id in list(ctx.thread_ids):
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        ctx.stacks[_fold(frame)] += 1
+
+    def _write(self, ctx, elapsed_s):
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = ctx.endpoint.strip("/").replace("/", "_") or "root"
+        path = os.path.join(self.output_dir, f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{name}.folded")
+        with open(path, "w") as f:
+            for stack, samples in ctx.stacks.most_common():
+                f.write(f"{stack} {samples}\n")
+        logger.warning(f"Slow request {ctx.endpoint} took {elapsed_s * 1000:.0f} ms, profile written to {path}")
+
+
+def _fold(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+def profiler_from_env():
+    slow_ms = os.getenv("PROFILE_SLOW_REQUESTS_MS")
+    if not slow_ms:
+        return None
+    return SlowRequestProfiler(
+        slow_ms=float(slow_ms),
+        sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "1.0")),
+        output_dir=os.getenv("PROFILE_OUTPUT_DIR", "profiles"),
+    )
+
+
+profiler = profiler_from_env()
+
+
+# Body of the timing middleware: times the request and attributes it to its route template
+async def time_request(request, call_next):
+    profiled = profiler is not None and profiler.should_profile()
+    ctx = RequestContext(request.scope, profiled=profiled)
+    token = _current_request.set(ctx)
+    if profiled:
+        profiler.start(ctx)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        _current_request.reset(token)
+        labels = {"method": request.method, "endpoint": ctx.endpoint}
+        registry.observe("http_request_duration_seconds", labels, elapsed)
+        registry.increment("http_requests_total", {**labels, "status": status})
+        if profiled:
+            profiler.finish(ctx, elapsed)
@@ -0,0 +1,232 @@
+"""Versioned models: the served one plus candidates scored in shadow.
+
+The served (primary) model is the one `current.json` points at. Candidates are
+listed in `candidates.json`; every batch the primary predicts for a planned
+date is handed to a background thread pool where each candidate predicts the
+same batch. Latency and predictions of all of them are logged, and once the
+houses are collected each model's error against the actual weights is
+reported, so a model is chosen by how it does in production.
+
+Usage (from the backend directory):
+
+    python training.py --seed-csv ../enhanced_dataset.csv --estimator knn --candidate
+    python model_registry.py list
+    python model_registry.py report --db waste_management.db
+    python model_registry.py promote 20250101120000
+    python model_registry.py retire 20250101120000
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import joblib
+import numpy as np
+
+from metrics import registry as metrics_registry
+from training import (CANDIDATES_FILE, CURRENT_POINTER, FEATURE_COLUMNS, MODELS_DIR, _write_json_atomic,
+                      read_candidates, write_candidates)
+
+logger = logging.getLogger(__name__)
+
+SHADOW_WORKERS = int(os.getenv("SHADOW_WORKERS", "2"))
+
+
+class ModelRegistry:
+    def __init__(self, live_model, connect, models_dir=MODELS_DIR, workers=SHADOW_WORKERS):
+        self.live_model = live_model
+        self.connect = connect
+        self.models_dir = models_dir
+        self.workers = workers
+        self._candidates = []
+        self._candidates_mtime = None
+        self._models = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="shadow")
+            return self._executor
+
+    # Candidate metadata, re-read whenever candidates.json changes
+    def candidates(self):
+        try:
+            mtime = os.stat(os.path.join(self.models_dir, CANDIDATES_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime != self._candidates_mtime:
+            with self._lock:
+                self._candidates = read_candidates(self.models_dir) if mtime is not None else []
+                self._candidates_mtime = mtime
+        return self._candidates
+
+    def _load(self, metadata):
+        version = metadata["version"]
+        model = self._models.get(version)
+        if model is None:
+            with self._lock:
+                model = self._models.get(version)
+                if model is None:
+                    model = self._models[version] = joblib.load(os.path.join(self.models_dir, metadata["path"]))
+        return model
+
+    # Called once the primary has predicted a batch for `date`: logs it in the background and lets every
+    # candidate score the same batch there, so the request never waits on either
+    def observe(self, date, X, predictions, seconds):
+        version = self.live_model.version
+        metrics_registry.observe("model_inference_seconds", {"model": version, "role": "primary"}, seconds)
+        if self.workers <= 0:
+            return
+        # The caller keeps using its frame, the pool gets its own copy of the features
+        batch = X[FEATURE_COLUMNS].copy()
+        pool = self._pool()
+        pool.submit(self._record, version, "primary", date, batch["house_id"], predictions, seconds)
+        for metadata in self.candidates():
+            if metadata["version"] != version:
+                pool.submit(self._shadow, metadata, date, batch)
+
+    def _shadow(self, metadata, date, batch):
+        version = metadata["version"]
+        try:
+            model = self._load(metadata)
+            started = time.perf_counter()
+            predictions = model.predict(batch)
+            seconds = time.perf_counter() - started
+        except Exception:
+            logger.exception(f"Candidate model {version} failed to score a batch")
+            return
+        metrics_registry.observe("model_inference_seconds", {"model": version, "role": "shadow"}, seconds)
+        self._record(version, "shadow", date, batch["house_id"], predictions, seconds)
+
+    def _record(self, version, role, date, house_ids, predictions, seconds):
+        try:
+            with self.connect() as db:
+                cursor = db.cursor()
+                cursor.execute(
+                    "INSERT INTO model_runs (model_version, role, date, rows, seconds) VALUES (?, ?, ?, ?, ?)",
+                    (version, role, date, len(predictions), seconds)
+                )
+                cursor.executemany("""
+                    INSERT OR REPLACE INTO model_predictions (model_version, date, house_id, predicted_kg)
+                    VALUES (?, ?, ?, ?)
+                """, zip([version] * len(predictions), [date] * len(predictions),
+                         map(int, house_ids), map(float, predictions)))
+                db.commit()
+        except Exception:
+            logger.exception(f"Failed to record a batch of model {version}")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def roles(self):
+        roles = {metadata["version"]: "candidate" for metadata in self.candidates()}
+        if self.live_model.version is not None:
+            roles[self.live_model.version] = "primary"
+        return roles
+
+
+# Latency and error per model version; error only counts predictions whose house has been collected that day
+def model_report(cursor, roles=None):
+    roles = roles or {}
+    cursor.execute("SELECT model_version, seconds, rows FROM model_runs ORDER BY model_version")
+    runs = {}
+    for version, seconds, rows in cursor.fetchall():
+        runs.setdefault(version, ([], []))
+        runs[version][0].append(seconds)
+        runs[version][1].append(rows)
+    cursor.execute("""
+        SELECT mp.model_version, COUNT(*),
+               AVG(ABS(mp.predicted_kg - cw.collected_kg)),
+               AVG((mp.predicted_kg - cw.collected_kg) * (mp.predicted_kg - cw.collected_kg)),
+               AVG(mp.predicted_kg - cw.collected_kg)
+        FROM model_predictions mp
+        JOIN collected_weights cw ON cw.house_id = mp.house_id AND cw.date = mp.date
+        GROUP BY mp.model_version
+    """)
+    errors = {row[0]: row[1:] for row in cursor.fetchall()}
+
+    report = []
+    for version in sorted(set(runs) | set(errors) | set(roles)):
+        seconds, rows = runs.get(version, ([], []))
+        scored, mae, mse, bias = errors.get(version, (0, None, None, None))
+        report.append({
+            "version": version,
+            "role": roles.get(version, "retired"),
+            "batches": len(seconds),
+            "rows": int(sum(rows)),
+            "mean_latency_ms": float(np.mean(seconds) * 1000) if seconds else None,
+            "p95_latency_ms": float(np.quantile(seconds, 0.95) * 1000) if seconds else None,
+            "scored": scored,
+            "mae": mae,
+            "rmse": math.sqrt(mse) if mse is not None else None,
+            "bias": bias,
+        })
+    return report
+
+
+# Serve a candidate: point current.json at it and drop it from the candidates
+def promote(version, models_dir=MODELS_DIR):
+    candidates = read_candidates(models_dir)
+    matching = [metadata for metadata in candidates if metadata["version"] == version]
+    if not matching:
+        raise ValueError(f"{version} is not a candidate")
+    _write_json_atomic(os.path.join(models_dir, CURRENT_POINTER), matching[0])
+    write_candidates([metadata for metadata in candidates if metadata["version"] != version], models_dir)
+
+
+# Stop shadow scoring a candidate, its files stay in place
+def retire(version, models_dir=MODELS_DIR):
+    candidates = read_candidates(models_dir)
+    if not any(metadata["version"] == version for metadata in candidates):
+        raise ValueError(f"{version} is not a candidate")
+    write_candidates([metadata for metadata in candidates if metadata["version"] != version], models_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage served and candidate models")
+    parser.add_argument("command", choices=["list", "report", "promote", "retire"])
+    parser.add_argument("version", nargs="?")
+    parser.add_argument("--models-dir", default=MODELS_DIR)
+    parser.add_argument("--db", default="waste_management.db")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command in ("promote", "retire"):
+        if not args.version:
+            parser.error(f"{args.command} needs a version")
+        if args.command == "promote":
+            promote(args.version, args.models_dir)
+            logger.info(f"Serving {args.version}, workers pick it up on their next prediction")
+        else:
+            retire(args.version, args.models_dir)
+            logger.info(f"Stopped shadow scoring {args.version}")
+        return
+
+    roles = {metadata["version"]: "candidate" for metadata in read_candidates(args.models_dir)}
+    try:
+        with open(os.path.join(args.models_dir, CURRENT_POINTER)) as f:
+            roles[json.load(f)["version"]] = "primary"
+    except FileNotFoundError:
+        roles["fallback"] = "primary"
+    if args.command == "list":
+        for version, role in sorted(roles.items()):
+            print(f"{version}\t{role}")
+        return
+    conn = sqlite3.connect(args.db)
+    try:
+        for row in model_report(conn.cursor(), roles):
+            print(json.dumps(row))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
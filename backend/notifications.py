@@ -0,0 +1,126 @@
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Failed sends are retried on later passes until this many attempts were made
+MAX_ATTEMPTS = 5
+# Pending rows are also picked up on a timer, e.g. ones queued by other worker processes
+POLL_INTERVAL_S = 30.0
+BATCH_SIZE = 100
+# Rows still 'sending' this long after they were claimed belong to a sender that died, they are queued again.
+# A message that went out before its sender died may then be sent twice
+CLAIM_TIMEOUT_S = 600.0
+# Recording the outcome of a batch is retried this many times, with this backoff, before it is left to the timeout
+OUTCOME_RETRIES = 3
+OUTCOME_BACKOFF_S = 1.0
+
+
+def enqueue_many(cursor, notifications):
+    cursor.executemany(
+        "INSERT INTO notification_queue (house_id, phone_number, body) VALUES (?, ?, ?)",
+        notifications,
+    )
+
+
+# Sends queued SMS from a background thread, so requests only pay for an INSERT
+class NotificationSender:
+    def __init__(self, connect, get_client, messaging_service_sid=None, poll_interval_s=POLL_INTERVAL_S, prepare=None):
+        self.connect = connect
+        # Run once on the sender's thread before the first pass, e.g. to create the queue table
+        self.prepare = prepare
+        self.get_client = get_client
+        self.messaging_service_sid = messaging_service_sid
+        self.poll_interval_s = poll_interval_s
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="notification-sender", daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        self.start()
+        self._wake.set()
+
+    def _run(self):
+        if self.prepare is not None:
+            try:
+                self.prepare()
+            except Exception:
+                logger.exception("Preparing the notification queue failed")
+        while True:
+            self._wake.wait(self.poll_interval_s)
+            self._wake.clear()
+            try:
+                while self.send_pending() == BATCH_SIZE:
+                    pass
+            except Exception:
+                logger.exception("Sending queued notifications failed")
+
+    # Claim a batch of pending rows (so no other worker sends them too), send them and record the outcome.
+    # Claims that timed out count as a failed attempt and are queued again first
+    def send_pending(self, limit=BATCH_SIZE):
+        now = time.time()
+        with self.connect() as db:
+            cursor = db.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("""
+                UPDATE notification_queue
+                SET status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END,
+                    attempts = attempts + 1, error = 'claim expired', claimed_at = NULL
+                WHERE status = 'sending' AND (claimed_at IS NULL OR claimed_at < ?)
+            """, (MAX_ATTEMPTS, now - CLAIM_TIMEOUT_S))
+            cursor.execute("""
+                SELECT id, phone_number, body FROM notification_queue
+                WHERE status = 'pending'
+                ORDER BY id LIMIT ?
+            """, (limit,))
+            rows = cursor.fetchall()
+            cursor.executemany("UPDATE notification_queue SET status = 'sending', claimed_at = ? WHERE id = ?",
+                               [(now, row[0]) for row in rows])
+            db.commit()
+        if not rows:
+            return 0
+
+        sent, failed = [], []
+        for notification_id, phone_number, body in rows:
+            try:
+                self.get_client().messages.create(messaging_service_sid=self.messaging_service_sid, body=body, to=phone_number)
+                sent.append((notification_id,))
+            except Exception as e:
+                logger.warning(f"Failed to send notification {notification_id}: {e}")
+                failed.append((repr(e), notification_id))
+
+        for attempt in range(OUTCOME_RETRIES):
+            try:
+                self._record_outcome(sent, failed)
+                break
+            except sqlite3.OperationalError as e:
+                if attempt == OUTCOME_RETRIES - 1:
+                    logger.error(f"Failed to record the outcome of {len(rows)} notifications, "
+                                 f"they are queued again in {CLAIM_TIMEOUT_S:.0f}s: {e}")
+                else:
+                    time.sleep(OUTCOME_BACKOFF_S * (attempt + 1))
+        return len(rows)
+
+    def _record_outcome(self, sent, failed):
+        with self.connect() as db:
+            cursor = db.cursor()
+            cursor.executemany("""
+                UPDATE notification_queue
+                SET status = 'sent', attempts = attempts + 1, sent_at = CURRENT_TIMESTAMP, claimed_at = NULL
+                WHERE id = ?
+            """, sent)
+            cursor.executemany("""
+                UPDATE notification_queue
+                SET status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END,
+                    attempts = attempts + 1, error = ?, claimed_at = NULL
+                WHERE id = ?
+            """, [(MAX_ATTEMPTS, error, notification_id) for error, notification_id in failed])
+            db.commit()
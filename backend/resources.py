@@ -0,0 +1,74 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+# Named artifacts loaded once, on first use or by a parallel preload
+class ResourceRegistry:
+    def __init__(self):
+        self._loaders = {}
+        self._values = {}
+        self._errors = {}
+        self._load_seconds = {}
+        self._locks = {}
+
+    def register(self, name, loader):
+        self._loaders[name] = loader
+        self._locks[name] = threading.Lock()
+
+    # Replace a resource with a ready value, e.g. a fake SMS client in load tests
+    def set(self, name, value):
+        self._values[name] = value
+        self._errors.pop(name, None)
+
+    def get(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            pass
+        with self._locks[name]:
+            if name not in self._values:
+                started = time.perf_counter()
+                try:
+                    self._values[name] = self._loaders[name]()
+                except Exception as e:
+                    self._errors[name] = repr(e)
+                    raise
+                self._errors.pop(name, None)
+                self._load_seconds[name] = round(time.perf_counter() - started, 3)
+                logger.info(f"Loaded {name} in {self._load_seconds[name]}s")
+        return self._values[name]
+
+    def preload(self, names=None, max_workers=None):
+        names = list(names or self._loaders)
+
+        def load(name):
+            try:
+                self.get(name)
+            except Exception:
+                logger.exception(f"Failed to load {name}")
+
+        with ThreadPoolExecutor(max_workers=max_workers or len(names) or 1, thread_name_prefix="preload") as pool:
+            list(pool.map(load, names))
+
+    def preload_in_background(self, names=None):
+        thread = threading.Thread(target=self.preload, args=(names,), name="resource-preload", daemon=True)
+        thread.start()
+        return thread
+
+    def ready(self):
+        return all(name in self._values for name in self._loaders)
+
+    def status(self):
+        status = {}
+        for name in self._loaders:
+            if name in self._values:
+                status[name] = {"state": "loaded", "seconds": self._load_seconds.get(name)}
+            elif name in self._errors:
+                status[name] = {"state": "failed", "error": self._errors[name]}
+            else:
+                status[name] = {"state": "pending"}
+        return status
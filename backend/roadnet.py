@@ -0,0 +1,287 @@
+"""Road-network distance matrix from a local OpenStreetMap extract.
+
+Reads the drivable roads of a GeoJSON or PBF extract, snaps every house to its
+nearest road node and runs Dijkstra from each snapped node, spread over worker
+processes. The result is the memory-mappable .npy layout of distances.py, in km.
+Usage (from the backend directory):
+
+    osmium extract --bbox 73.80,18.47,73.91,18.57 india-latest.osm.pbf -o pune.osm.pbf
+    python roadnet.py --roads pune.osm.pbf --houses houses.csv --out road_matrix.npy --workers 8
+    export DISTANCE_MATRIX_PATH=road_matrix.npy
+
+GeoJSON input needs LineString/MultiLineString features with the OSM "highway"
+(and optionally "oneway") tags as properties, e.g. from `osmium export`. PBF
+input needs pyosmium. Shortest paths use scipy's csgraph Dijkstra when scipy is
+installed, a pure-Python heap otherwise. One-way streets are respected, so the
+matrix is not necessarily symmetric. Houses whose snapped node can't reach
+another house's node get the straight-line distance times the road factor.
+"""
+import argparse
+import heapq
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+from distances import EARTH_RADIUS_KM, ROAD_FACTOR, MatrixDistances, haversine_km
+
+try:
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import connected_components, dijkstra
+except ImportError:
+    csr_matrix = connected_components = dijkstra = None
+
+try:
+    import osmium
+except ImportError:
+    osmium = None
+
+logger = logging.getLogger(__name__)
+
+# OSM highway values a collection truck can drive on
+DRIVABLE = {
+    "motorway", "trunk", "primary", "secondary", "tertiary", "unclassified", "residential", "living_street",
+    "service", "road", "motorway_link", "trunk_link", "primary_link", "secondary_link", "tertiary_link",
+}
+ONEWAY_FORWARD = {"yes", "true", "1"}
+ONEWAY_BACKWARD = {"-1", "reverse"}
+# Memory per worker for a Dijkstra batch, whose rows over the whole graph are held at once
+BATCH_MEMORY_BYTES = 64 * 1024 * 1024
+
+
+# Road graph: node coordinates plus directed edges (from, to, km)
+class RoadGraph:
+    def __init__(self):
+        self.lat = []
+        self.lon = []
+        self.sources = []
+        self.targets = []
+        self.lengths = []
+        self._nodes = {}
+
+    def node(self, key, lat, lon):
+        index = self._nodes.get(key)
+        if index is None:
+            index = self._nodes[key] = len(self.lat)
+            self.lat.append(lat)
+            self.lon.append(lon)
+        return index
+
+    # A way as a list of (key, lat, lon) points, split into one edge per segment
+    def add_way(self, points, oneway=None):
+        if oneway in ONEWAY_BACKWARD:
+            points = points[::-1]
+        nodes = [self.node(key, lat, lon) for key, lat, lon in points]
+        lat, lon = np.array([p[1] for p in points]), np.array([p[2] for p in points])
+        # Distinct nodes at the same spot; csgraph would read a zero as a missing edge
+        lengths = np.maximum(haversine_km(lat[:-1], lon[:-1], lat[1:], lon[1:]), 1e-9)
+        two_way = oneway not in ONEWAY_FORWARD and oneway not in ONEWAY_BACKWARD
+        for a, b, km in zip(nodes[:-1], nodes[1:], lengths):
+            self.sources.append(a)
+            self.targets.append(b)
+            self.lengths.append(km)
+            if two_way:
+                self.sources.append(b)
+                self.targets.append(a)
+                self.lengths.append(km)
+
+    def __len__(self):
+        return len(self.lat)
+
+    # Edge arrays with parallel edges collapsed to the shortest one
+    def edges(self):
+        sources = np.asarray(self.sources, dtype=np.int64)
+        targets = np.asarray(self.targets, dtype=np.int64)
+        lengths = np.asarray(self.lengths, dtype=np.float64)
+        order = np.lexsort((lengths, targets, sources))
+        sources, targets, lengths = sources[order], targets[order], lengths[order]
+        first = np.ones(len(sources), dtype=bool)
+        first[1:] = (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+        keep = first & (sources != targets)
+        return sources[keep], targets[keep], lengths[keep]
+
+
+def _oneway(tags):
+    value = tags.get("oneway")
+    if value is None and tags.get("junction") == "roundabout":
+        return "yes"
+    return str(value).lower() if value is not None else None
+
+
+# GeoJSON ways share nodes where their coordinates are equal
+def read_geojson(path, graph=None):
+    graph = graph or RoadGraph()
+    with open(path) as f:
+        collection = json.load(f)
+    for feature in collection.get("features", []):
+        tags = feature.get("properties") or {}
+        if tags.get("highway") not in DRIVABLE:
+            continue
+        geometry = feature.get("geometry") or {}
+        if geometry.get("type") == "LineString":
+            lines = [geometry["coordinates"]]
+        elif geometry.get("type") == "MultiLineString":
+            lines = geometry["coordinates"]
+        else:
+            continue
+        for line in lines:
+            if len(line) > 1:
+                points = [((round(lon, 7), round(lat, 7)), lat, lon) for lon, lat, *_ in line]
+                graph.add_way(points, _oneway(tags))
+    return graph
+
+
+if osmium is not None:
+    class _WayHandler(osmium.SimpleHandler):
+        def __init__(self, graph):
+            super().__init__()
+            self.graph = graph
+
+        def way(self, way):
+            if way.tags.get("highway") not in DRIVABLE:
+                return
+            points = [(node.ref, node.location.lat, node.location.lon) for node in way.nodes if node.location.valid()]
+            if len(points) > 1:
+                self.graph.add_way(points, _oneway(dict(way.tags)))
+
+
+def read_pbf(path, graph=None):
+    if osmium is None:
+        raise RuntimeError("Reading PBF needs pyosmium; or convert with `osmium export extract.pbf -o roads.geojson`")
+    graph = graph or RoadGraph()
+    _WayHandler(graph).apply_file(path, locations=True)
+    return graph
+
+
+def read_roads(path):
+    if path.endswith(".pbf"):
+        return read_pbf(path)
+    return read_geojson(path)
+
+
+# Nearest node of the largest connected part of the network per house, and the straight-line km to it.
+# Fragments (parking aisles, private roads cut off by the extract's edge) would leave houses unreachable
+def snap_houses(graph, sources, targets, lat, lon):
+    candidates = np.arange(len(graph))
+    if connected_components is not None:
+        adjacency = csr_matrix((np.ones(len(sources)), (sources, targets)), shape=(len(graph), len(graph)))
+        _, labels = connected_components(adjacency, directed=True, connection="strong")
+        candidates = np.flatnonzero(labels == np.bincount(labels).argmax())
+    node_lat, node_lon = np.asarray(graph.lat)[candidates], np.asarray(graph.lon)[candidates]
+    tree = BallTree(np.radians(np.column_stack([node_lat, node_lon])), metric="haversine")
+    distance, nearest = tree.query(np.radians(np.column_stack([lat, lon])), k=1)
+    return candidates[nearest[:, 0]], distance[:, 0] * EARTH_RADIUS_KM
+
+
+# Set in every worker process by the pool initializer, so the graph is sent to each worker once
+_graph = None
+
+
+def _init_worker(num_nodes, sources, targets, lengths, destinations):
+    global _graph
+    if csr_matrix is not None:
+        matrix = csr_matrix((lengths, (sources, targets)), shape=(num_nodes, num_nodes))
+    else:
+        matrix = [[] for _ in range(num_nodes)]
+        for a, b, km in zip(sources.tolist(), targets.tolist(), lengths.tolist()):
+            matrix[a].append((b, km))
+    _graph = (matrix, destinations)
+
+
+def _heap_dijkstra(adjacency, source):
+    distance = {source: 0.0}
+    heap = [(0.0, source)]
+    while heap:
+        d, node = heapq.heappop(heap)
+        if d > distance[node]:
+            continue
+        for neighbor, km in adjacency[node]:
+            candidate = d + km
+            if candidate < distance.get(neighbor, np.inf):
+                distance[neighbor] = candidate
+                heapq.heappush(heap, (candidate, neighbor))
+    return distance
+
+
+# Shortest km from each node in `batch` to every destination node
+def _shortest_paths(batch):
+    matrix, destinations = _graph
+    if dijkstra is not None:
+        return dijkstra(matrix, directed=True, indices=batch)[:, destinations]
+    rows = np.full((len(batch), len(destinations)), np.inf)
+    for row, source in enumerate(batch):
+        distance = _heap_dijkstra(matrix, int(source))
+        rows[row] = [distance.get(int(node), np.inf) for node in destinations]
+    return rows
+
+
+# House-to-house road km, written row batch by row batch into a memory-mapped .npy, so a 10k-house
+# matrix (400 MB as float32) never needs a second copy in memory. Houses on the same node share a row
+# of Dijkstra; the snap distance of both ends is added on top
+def build_matrix(graph, house_ids, lat, lon, out, workers=None, road_factor=ROAD_FACTOR):
+    started = time.perf_counter()
+    sources, targets, lengths = graph.edges()
+    nodes, snap_km = snap_houses(graph, sources, targets, lat, lon)
+    unique_nodes, house_node = np.unique(nodes, return_inverse=True)
+    logger.info(f"Snapped {len(house_ids)} houses to {len(unique_nodes)} of {len(graph)} road nodes "
+                f"({len(lengths)} edges), median snap {np.median(snap_km) * 1000:.0f} m")
+
+    matrix = np.lib.format.open_memmap(out, mode="w+", dtype=np.float32, shape=(len(house_ids), len(house_ids)))
+    batch_size = max(1, min(256, BATCH_MEMORY_BYTES // (8 * max(len(graph), 1))))
+    batches = [unique_nodes[i:i + batch_size] for i in range(0, len(unique_nodes), batch_size)]
+    by_node = np.argsort(house_node, kind="stable")
+    houses_of = np.split(by_node, np.cumsum(np.bincount(house_node, minlength=len(unique_nodes)))[:-1])
+    unreachable = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(len(graph), sources, targets, lengths, unique_nodes)) as pool:
+        for number, (batch, rows) in enumerate(zip(batches, pool.map(_shortest_paths, batches))):
+            first = number * batch_size
+            for offset in range(len(batch)):
+                houses = houses_of[first + offset]
+                km = rows[offset][house_node][None, :] + snap_km[houses][:, None] + snap_km[None, :]
+                missing = ~np.isfinite(km)
+                if missing.any():
+                    unreachable += int(missing.sum())
+                    straight = haversine_km(lat[houses][:, None], lon[houses][:, None], lat[None, :], lon[None, :])
+                    km[missing] = (straight * road_factor)[missing]
+                km[np.arange(len(houses)), houses] = 0.0
+                matrix[houses] = km
+            if number % 10 == 9:
+                logger.info(f"{first + len(batch)} of {len(unique_nodes)} source nodes done")
+    matrix.flush()
+    np.save(f"{out}.ids.npy", np.asarray(house_ids, dtype=np.int64))
+    if unreachable:
+        logger.warning(f"{unreachable} house pairs have no road path, they use straight-line km x {road_factor}")
+    logger.info(f"Built a {len(house_ids)}x{len(house_ids)} road matrix in {time.perf_counter() - started:.1f}s")
+    return MatrixDistances.from_npy(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a road-network distance matrix from an OSM extract")
+    parser.add_argument("--roads", required=True, help="OSM extract, .geojson or .pbf")
+    parser.add_argument("--houses", default="houses.csv", help="CSV with house_id, lat and lon")
+    parser.add_argument("--out", default="road_matrix.npy")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if dijkstra is None:
+        logger.warning("scipy is not installed, using the much slower pure-Python Dijkstra")
+    started = time.perf_counter()
+    graph = read_roads(args.roads)
+    if not len(graph):
+        parser.error(f"No drivable roads in {args.roads}")
+    logger.info(f"Read {len(graph)} road nodes from {args.roads} in {time.perf_counter() - started:.1f}s")
+    houses = pd.read_csv(args.houses, usecols=["house_id", "lat", "lon"])
+    build_matrix(graph, houses["house_id"].to_numpy(), houses["lat"].to_numpy(dtype=np.float64),
+                 houses["lon"].to_numpy(dtype=np.float64), args.out, workers=args.workers)
+    print(f"export DISTANCE_MATRIX_PATH={args.out}")
+
+
+if __name__ == "__main__":
+    main()
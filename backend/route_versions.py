@@ -0,0 +1,83 @@
+import hashlib
+import json
+from difflib import SequenceMatcher
+
+# Request fields that don't change the plan for a date
+UNHASHED_FIELDS = {"date", "replan"}
+
+
+# Stable hash of everything a plan is made from: the request, after fleet defaults, and the served model
+def inputs_hash(inputs, model_version):
+    payload = json.dumps({"inputs": inputs, "model_version": model_version}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+# Edits that turn route `old` into route `new`: [start, end, houses] replaces old[start:end] with houses.
+# Edits are in route order and don't overlap, so applying them from the last one keeps the indexes valid
+def route_diff(old, new):
+    matcher = SequenceMatcher(None, old, new, autojunk=False)
+    edits = [[i1, i2, new[j1:j2]] for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != "equal"]
+    old_houses, new_houses = set(old), set(new)
+    edited = {house for _, _, houses in edits for house in houses}
+    return {
+        "added": [house for house in new if house not in old_houses],
+        "removed": [house for house in old if house not in new_houses],
+        # Kept houses that come back in an edit, i.e. at another place in the order
+        "moved": [house for house in new if house in old_houses and house in edited],
+        "edits": edits,
+    }
+
+
+# What a client does with a diff to update its cached route, plan_check verifies it gives the new version
+def apply_edits(route, edits):
+    route = list(route)
+    for start, end, houses in reversed(edits):
+        route[start:end] = houses
+    return route
+
+
+def _version(row):
+    if row is None:
+        return None
+    return {
+        "version": row["version"],
+        "inputs_hash": row["inputs_hash"],
+        "optimal_route": row["optimal_route"],
+        "truck_routes": json.loads(row["truck_routes"]) if row["truck_routes"] else None,
+        "trips": json.loads(row["trips"]) if row["trips"] else None,
+        "restored_from": row["restored_from"],
+        "created_at": row["created_at"],
+    }
+
+
+_COLUMNS = "version, inputs_hash, optimal_route, truck_routes, trips, restored_from, created_at"
+
+
+def latest_version(cursor, date):
+    cursor.execute(f"SELECT {_COLUMNS} FROM route_versions WHERE date = ? ORDER BY version DESC LIMIT 1", (date,))
+    return _version(cursor.fetchone())
+
+
+def load_version(cursor, date, version):
+    cursor.execute(f"SELECT {_COLUMNS} FROM route_versions WHERE date = ? AND version = ?", (date, version))
+    return _version(cursor.fetchone())
+
+
+def list_versions(cursor, date):
+    cursor.execute(f"SELECT {_COLUMNS} FROM route_versions WHERE date = ? ORDER BY version", (date,))
+    return [_version(row) for row in cursor.fetchall()]
+
+
+# Records a plan as the date's next version. optimal_route is the text stored in routes, truck routes and
+# trips are kept as JSON with integer house ids
+def save_version(cursor, date, inputs_hash, optimal_route, truck_routes=None, trips=None, restored_from=None):
+    cursor.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM route_versions WHERE date = ?", (date,))
+    version = cursor.fetchone()[0]
+    cursor.execute("""
+        INSERT INTO route_versions (date, version, inputs_hash, optimal_route, truck_routes, trips, restored_from)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (date, version, inputs_hash, optimal_route,
+          json.dumps([[int(h) for h in route] for route in truck_routes]) if truck_routes is not None else None,
+          json.dumps([{**trip, "route": [int(h) for h in trip["route"]]} for trip in trips]) if trips is not None else None,
+          restored_from))
+    return version
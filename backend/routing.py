@@ -0,0 +1,293 @@
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PLANNERS = ["sorted", "multi_start", "zones"]
+SEARCH_WORKERS = int(os.getenv("ROUTE_SEARCH_WORKERS", os.cpu_count() or 1))
+SEARCH_STARTS = int(os.getenv("ROUTE_SEARCH_STARTS", 2 * SEARCH_WORKERS))
+SEARCH_BUDGET_S = float(os.getenv("ROUTE_SEARCH_BUDGET_S", "5"))
+# Each construction step picks one of this many nearest unvisited houses
+CANDIDATES = 3
+# The zones planner splits each truck's houses until no zone has more stops than this
+ZONE_MAX_STOPS = int(os.getenv("ROUTE_ZONE_MAX_STOPS", "200"))
+
+_executor = None
+
+
+# Length of an open route through the matrix positions in `tour`
+def route_length(matrix, tour):
+    tour = np.asarray(tour)
+    return float(matrix[tour[:-1], tour[1:]].sum())
+
+
+# Randomized nearest neighbour: start at a random house, then repeatedly move to one of the closest unvisited houses
+def randomized_nearest_neighbor(matrix, rng):
+    n = len(matrix)
+    unvisited = np.ones(n, dtype=bool)
+    current = int(rng.integers(n))
+    tour = [current]
+    unvisited[current] = False
+    for _ in range(n - 1):
+        candidates = np.flatnonzero(unvisited)
+        distances = matrix[current, candidates]
+        k = min(CANDIDATES, len(candidates))
+        nearest = candidates[np.argpartition(distances, k - 1)[:k]]
+        current = int(nearest[rng.integers(k)])
+        tour.append(current)
+        unvisited[current] = False
+    return np.array(tour, dtype=np.int64)
+
+
+# 2-opt on an open route: reverse tour[i:j + 1] whenever that shortens the route, until no reversal does.
+# All reversals starting at i are scored in one vectorized step. Fixed ends (a depot, a disposal site) stay put.
+# Past `deadline` (a time.time() value) it stops after the current pass, with the route improved so far
+def two_opt(matrix, tour, fixed_start=False, fixed_end=False, deadline=None):
+    tour = np.array(tour, dtype=np.int64)
+    n = len(tour)
+    if n < 3:
+        return tour
+    last = n - 1 if fixed_end else n
+    improved = True
+    while improved and (deadline is None or time.time() < deadline):
+        improved = False
+        for i in range(1 if fixed_start else 0, last - 1):
+            j = np.arange(i + 1, last)
+            nxt = np.minimum(j + 1, n - 1)
+            # Edges (i-1, i) and (j, j+1) are replaced by (i-1, j) and (i, j+1); a missing end edge costs nothing
+            before = np.zeros(len(j))
+            after = np.zeros(len(j))
+            if i > 0:
+                before += matrix[tour[i - 1], tour[i]]
+                after += matrix[tour[i - 1], tour[j]]
+            has_next = j < n - 1
+            before += np.where(has_next, matrix[tour[j], tour[nxt]], 0.0)
+            after += np.where(has_next, matrix[tour[i], tour[nxt]], 0.0)
+            delta = after - before
+            best = int(np.argmin(delta))
+            if delta[best] < -1e-9:
+                tour[i:j[best] + 1] = tour[i:j[best] + 1][::-1].copy()
+                improved = True
+    return tour
+
+
+# One start of the search. Seed 0 improves the given initial order, every other seed a randomized construction,
+# so the result depends on the seed only. None when `deadline` passes before the search finishes
+def search_from_seed(matrix, seed, initial=None, deadline=None):
+    if seed == 0 and initial is not None:
+        tour = np.asarray(initial, dtype=np.int64)
+    else:
+        tour = randomized_nearest_neighbor(matrix, np.random.default_rng(seed))
+    tour = two_opt(matrix, tour, deadline=deadline)
+    if deadline is not None and time.time() >= deadline:
+        return None
+    return route_length(matrix, tour), seed, tour
+
+
+# Runs in a pool process: reads the matrix from shared memory instead of receiving a pickled copy. Gives up
+# at the deadline itself, a running pool task can't be cancelled from outside and would hold its worker
+def _search_shared(shm_name, shape, dtype, seed, initial, deadline):
+    if time.time() >= deadline:
+        return None
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        matrix = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        result = search_from_seed(matrix, seed, initial, deadline)
+        del matrix
+        return result
+    finally:
+        shm.close()
+
+
+def get_executor(workers=None):
+    global _executor
+    if _executor is None:
+        # forkserver: the API process runs threads, forking it directly is not safe
+        _executor = ProcessPoolExecutor(max_workers=workers or SEARCH_WORKERS, mp_context=get_context("forkserver"))
+    return _executor
+
+
+# Run `starts` seeded searches across the process pool and keep the shortest route. At most `workers`
+# searches are in the pool at a time, so the pool stays free for other planners' jobs. Seeds that have not
+# finished within `time_budget_s` are dropped; the winner is the shortest route, ties going to the lowest
+# seed, so the result is deterministic when every start finishes. Returns positions into `matrix`
+def multi_start_route(matrix, starts=None, time_budget_s=None, seed=0, initial=None, workers=None):
+    matrix = np.ascontiguousarray(matrix, dtype=np.float64)
+    n = len(matrix)
+    if initial is None:
+        initial = np.arange(n)
+    if n < 4:
+        return np.asarray(initial, dtype=np.int64)
+    starts = starts or SEARCH_STARTS
+    time_budget_s = SEARCH_BUDGET_S if time_budget_s is None else time_budget_s
+    # Wall clock, the pool processes compare against it too
+    deadline = time.time() + time_budget_s
+
+    shm = shared_memory.SharedMemory(create=True, size=matrix.nbytes)
+    pending = set()
+    try:
+        np.ndarray(matrix.shape, dtype=matrix.dtype, buffer=shm.buf)[:] = matrix
+        executor = get_executor(workers)
+        seeds = [0] + [seed + k for k in range(1, starts)]
+        queued = list(seeds)
+        results = []
+        while queued or pending:
+            while queued and len(pending) < (workers or SEARCH_WORKERS):
+                s = queued.pop(0)
+                pending.add(executor.submit(_search_shared, shm.name, matrix.shape, matrix.dtype.str, s,
+                                            initial if s == 0 else None, deadline))
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            results.extend(result for result in (future.result() for future in done) if result is not None)
+        if len(results) < len(seeds):
+            logger.info(f"Route search budget of {time_budget_s}s used, {len(results)} of {len(seeds)} starts finished")
+    finally:
+        # Searches still running stop at the deadline; the shared matrix goes once none of them can open it
+        for future in pending:
+            future.cancel()
+        for future in wait(pending).done:
+            if not future.cancelled() and future.exception() is not None:
+                logger.warning(f"Route search start failed: {future.exception()}")
+        shm.close()
+        shm.unlink()
+
+    if not results:
+        return np.asarray(initial, dtype=np.int64)
+    return min(results, key=lambda result: (result[0], result[1]))[2]
+
+
+# Recursive bisection into `parts` groups of about equal load. Each cut separates two far-apart houses:
+# houses are ordered by how much closer they are to one than to the other, and split at the load-weighted
+# point that gives each side its share of the parts. Works on any distances, so on the matrix as well as on
+# coordinates, and costs O(n) per level. Returns index arrays into house_ids, neighbouring groups adjacent
+def bisect_zones(house_ids, loads, distances, parts):
+    house_ids = np.asarray(house_ids, dtype=np.int64)
+    loads = np.asarray(loads, dtype=np.float64)
+
+    def split(positions, parts):
+        if parts <= 1 or len(positions) <= 1:
+            return [positions]
+        ids = house_ids[positions]
+        # Two sweeps of "farthest house from" find a far-apart pair
+        a = ids[int(np.argmax(distances.pairwise(np.repeat(ids[0], len(ids)), ids)))]
+        to_a = distances.pairwise(np.repeat(a, len(ids)), ids)
+        b = ids[int(np.argmax(to_a))]
+        to_b = distances.pairwise(np.repeat(b, len(ids)), ids)
+        order = np.argsort(to_a - to_b, kind="stable")
+        left_parts = parts // 2
+        cumulative = np.cumsum(loads[positions][order])
+        cut = int(np.searchsorted(cumulative, cumulative[-1] * left_parts / parts)) + 1
+        cut = min(max(cut, 1), len(positions) - 1)
+        return split(positions[order[:cut]], left_parts) + split(positions[order[cut:]], parts - left_parts)
+
+    return split(np.arange(len(house_ids)), parts)
+
+
+# Trucks loaded over `capacity` hand houses to trucks with room: each time the overflowing truck's house
+# nearest to another truck that it fits into moves there. Only when none fits anywhere is a house dropped:
+# the lightest one that clears the overflow on its own, else the heaviest, never one in `keep` unless
+# nothing else is left. Works on and returns index arrays into house_ids, plus the dropped ones
+def fit_capacity(groups, house_ids, loads, distances, capacity, keep=(), sample=256):
+    groups = [list(group) for group in groups]
+    keep = {int(h) for h in keep}
+    dropped = []
+    for g, group in enumerate(groups):
+        while group and loads[group].sum() > capacity + 1e-9:
+            best = None
+            for t, other in enumerate(groups):
+                spare = capacity - loads[other].sum()
+                movable = [p for p in group if loads[p] <= spare]
+                if t == g or not movable:
+                    continue
+                if not other:
+                    best = best or (0.0, movable[0], t)
+                    continue
+                # Nearest member of the other truck, from a strided sample of both sides
+                movable = movable[::-(-len(movable) // sample)]
+                members = house_ids[other[::-(-len(other) // sample)]]
+                gap = distances.pairwise(np.repeat(house_ids[movable], len(members)), np.tile(members, len(movable)))
+                gap = gap.reshape(len(movable), len(members)).min(axis=1)
+                i = int(np.argmin(gap))
+                if best is None or gap[i] < best[0]:
+                    best = (float(gap[i]), movable[i], t)
+            if best is None:
+                droppable = [p for p in group if int(house_ids[p]) not in keep] or group
+                overflow = loads[group].sum() - capacity
+                clearing = [p for p in droppable if loads[p] >= overflow]
+                position = min(clearing, key=lambda p: loads[p]) if clearing else max(droppable, key=lambda p: loads[p])
+                group.remove(position)
+                dropped.append(position)
+            else:
+                _, position, t = best
+                group.remove(position)
+                groups[t].append(position)
+    return [np.array(group, dtype=np.int64) for group in groups], np.array(dropped, dtype=np.int64)
+
+
+# Nearest neighbour followed by 2-opt, for one zone
+def _solve_zone(matrix):
+    return search_from_seed(matrix, seed=1)[2]
+
+
+# Balanced per-truck routes: the selected houses are split into one group per truck, each group into zones
+# of at most max_stops houses, zones are solved independently (in the process pool when there are several)
+# and each truck's zones are joined in bisection order, every zone entered from its end nearer the last stop.
+# With a capacity, no truck is loaded over it; houses that fit on no truck are left out of the routes
+def zone_routes(selected_houses, loads, distances, num_trucks=1, max_stops=None, workers=None, capacity=None, keep=()):
+    max_stops = max_stops or ZONE_MAX_STOPS
+    house_ids = np.array([int(h) for h in selected_houses], dtype=np.int64)
+    loads = np.asarray(loads, dtype=np.float64)
+    groups = bisect_zones(house_ids, loads, distances, num_trucks)
+    if capacity is not None:
+        groups, _ = fit_capacity(groups, house_ids, loads, distances, capacity, keep)
+    zones = []
+    for truck, truck_positions in enumerate(groups):
+        if not len(truck_positions):
+            continue
+        parts = -(-len(truck_positions) // max_stops)
+        for zone in bisect_zones(house_ids[truck_positions], loads[truck_positions], distances, parts):
+            zones.append((truck, truck_positions[zone]))
+
+    matrices = [distances.submatrix(house_ids[positions]) for _, positions in zones]
+    if len(zones) > 1:
+        tours = list(get_executor(workers).map(_solve_zone, matrices))
+    else:
+        tours = [_solve_zone(matrix) for matrix in matrices]
+
+    routes = [[] for _ in range(num_trucks)]
+    for (truck, positions), tour in zip(zones, tours):
+        zone_route = [int(p) for p in positions[tour]]
+        route = routes[truck]
+        if route and len(zone_route) > 1:
+            last = house_ids[route[-1]]
+            if distances.distance(last, house_ids[zone_route[-1]]) < distances.distance(last, house_ids[zone_route[0]]):
+                zone_route.reverse()
+        route.extend(zone_route)
+    return [[selected_houses[p] for p in route] for route in routes]
+
+
+# Order the selected houses into one route per truck with the requested planner. Only the zones planner
+# splits the work between trucks, the others plan a single route. Zones stay within a per-truck capacity
+# when one is given, see fit_capacity; `keep` are the houses to drop last
+def plan_routes(selected_houses, distances, planner="sorted", loads=None, num_trucks=1,
+                starts=None, time_budget_s=None, seed=0, capacity=None, keep=()):
+    optimal_route = sorted(selected_houses)
+    if planner == "zones":
+        if not optimal_route:
+            return [[] for _ in range(num_trucks)]
+        loads = np.ones(len(selected_houses)) if loads is None else loads
+        return zone_routes(selected_houses, loads, distances, num_trucks=num_trucks, capacity=capacity, keep=keep)
+    if planner == "sorted" or len(optimal_route) < 4:
+        return [optimal_route]
+    if planner == "multi_start":
+        matrix = distances.submatrix([int(h) for h in optimal_route])
+        tour = multi_start_route(matrix, starts=starts, time_budget_s=time_budget_s, seed=seed)
+        return [[optimal_route[i] for i in tour]]
+    raise ValueError(f"Unknown planner {planner}")
@@ -0,0 +1,325 @@
+import sqlite3
+
+from analytics import create_analytics_tables, ensure_rollups
+
+# 'unplanned' takes back a 'planned' event, for a house a replan or rollback dropped from that date's plan
+EVENT_TYPES = ("planned", "unplanned", "visited", "skipped", "collected")
+# Weight of the newest collected weight in a house's rolling average
+ROLLING_KG_ALPHA = 0.3
+
+
+# Tables used by the API, also used by the offline tools to initialise a database
+def create_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS houses (
+            house_id INTEGER PRIMARY KEY,
+            visited INTEGER DEFAULT 0
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS routes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT,
+            optimal_route TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS route_distances (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            route_id INTEGER,
+            from_house_id INTEGER,
+            to_house_id INTEGER,
+            distance REAL,
+            FOREIGN KEY(route_id) REFERENCES routes(id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS visits (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT,
+            house_id INTEGER,
+            FOREIGN KEY(house_id) REFERENCES houses(house_id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS house_visits (
+            house_id INTEGER PRIMARY KEY,
+            last_visited_date TEXT DEFAULT NULL,
+            phone_number TEXT DEFAULT '+919945100418'
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_queries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            house_id INTEGER NOT NULL,
+            phone_number TEXT NOT NULL,
+            query TEXT NOT NULL,
+            status TEXT DEFAULT 'pending',
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            image BLOB
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS waste_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            house_id INTEGER,
+            date TEXT,
+            description TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(house_id) REFERENCES houses(house_id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS day_conditions (
+            date TEXT PRIMARY KEY,
+            day_encoded INTEGER,
+            isholiday INTEGER,
+            weather_encoded INTEGER
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS collected_weights (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            house_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            collected_kg REAL NOT NULL,
+            day_encoded INTEGER,
+            isholiday INTEGER,
+            neighborhood_encoded INTEGER,
+            weather_encoded INTEGER,
+            previous_day_waste REAL,
+            recorded_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_collected_weights_house ON collected_weights (house_id, id)")
+    # Driver check-ins, keyed by the idempotency key the client generated for each one
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS checkin_events (
+            idempotency_key TEXT PRIMARY KEY,
+            house_id INTEGER NOT NULL,
+            visited_at TEXT NOT NULL,
+            collected_kg REAL,
+            received_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS notification_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            house_id INTEGER,
+            phone_number TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            error TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            sent_at TEXT,
+            claimed_at REAL
+        )
+    """)
+    add_missing_column(cursor, "notification_queue", "claimed_at", "REAL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_notification_queue_status ON notification_queue (status, id)")
+    # Per-truck split of a route planned for several trucks, routes.optimal_route holds them concatenated
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS route_trucks (
+            route_id INTEGER NOT NULL,
+            truck INTEGER NOT NULL,
+            optimal_route TEXT,
+            PRIMARY KEY (route_id, truck),
+            FOREIGN KEY(route_id) REFERENCES routes(id)
+        )
+    """)
+    # Trips of each truck's working day, for routes planned with the multi_trip planner
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS route_trips (
+            route_id INTEGER NOT NULL,
+            truck INTEGER NOT NULL,
+            trip INTEGER NOT NULL,
+            optimal_route TEXT,
+            load_kg REAL,
+            km REAL,
+            start_time TEXT,
+            end_time TEXT,
+            disposal_site INTEGER,
+            PRIMARY KEY (route_id, truck, trip),
+            FOREIGN KEY(route_id) REFERENCES routes(id)
+        )
+    """)
+    # Every plan made for a date. routes holds the latest one, the earlier ones are kept for diffs and rollback
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS route_versions (
+            date TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            inputs_hash TEXT,
+            optimal_route TEXT,
+            truck_routes TEXT,
+            trips TEXT,
+            restored_from INTEGER,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (date, version)
+        )
+    """)
+    # A worker planning a date holds its lease, so other workers wait for that plan instead of making their
+    # own. Claimed and released in short transactions, a lease left by a crashed worker expires
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS plan_leases (
+            date TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+    # Location and attributes of every house
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS house_registry (
+            house_id INTEGER PRIMARY KEY,
+            lat REAL,
+            lon REAL,
+            neighborhood_type TEXT,
+            ward TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Append-only log of everything that happens to a house on a collection day
+    migrate_visit_events(cursor)
+    cursor.execute(VISIT_EVENTS_TABLE.format(name="visit_events"))
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_visit_events_house ON visit_events (house_id, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_visit_events_date ON visit_events (date)")
+    # One row per house, kept current by the trigger below, so summaries never scan the log
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS house_visit_summary (
+            house_id INTEGER PRIMARY KEY,
+            last_planned_date TEXT,
+            last_visited_at TEXT,
+            planned_count INTEGER DEFAULT 0,
+            visit_count INTEGER DEFAULT 0,
+            skipped_count INTEGER DEFAULT 0,
+            collected_count INTEGER DEFAULT 0,
+            last_collected_kg REAL,
+            rolling_avg_kg REAL,
+            updated_at TEXT
+        )
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS visit_events_summary AFTER INSERT ON visit_events
+        BEGIN
+            INSERT OR IGNORE INTO house_visit_summary (house_id) VALUES (NEW.house_id);
+            UPDATE house_visit_summary SET
+                last_planned_date = CASE WHEN NEW.event_type = 'planned'
+                    THEN MAX(COALESCE(last_planned_date, ''), NEW.date)
+                    WHEN NEW.event_type = 'unplanned' THEN (
+                        SELECT MAX(date) FROM (
+                            SELECT date FROM visit_events WHERE house_id = NEW.house_id
+                            AND event_type IN ('planned', 'unplanned') GROUP BY date
+                            HAVING SUM(event_type = 'planned') > SUM(event_type = 'unplanned')))
+                    ELSE last_planned_date END,
+                last_visited_at = CASE WHEN NEW.event_type = 'visited'
+                    THEN MAX(COALESCE(last_visited_at, ''), COALESCE(NEW.occurred_at, NEW.date)) ELSE last_visited_at END,
+                planned_count = planned_count + (NEW.event_type = 'planned') - (NEW.event_type = 'unplanned'),
+                visit_count = visit_count + (NEW.event_type = 'visited'),
+                skipped_count = skipped_count + (NEW.event_type = 'skipped'),
+                collected_count = collected_count + (NEW.event_type = 'collected'),
+                last_collected_kg = CASE WHEN NEW.event_type = 'collected' THEN NEW.collected_kg ELSE last_collected_kg END,
+                rolling_avg_kg = CASE WHEN NEW.event_type != 'collected' THEN rolling_avg_kg
+                    WHEN rolling_avg_kg IS NULL THEN NEW.collected_kg
+                    ELSE rolling_avg_kg + {ROLLING_KG_ALPHA} * (NEW.collected_kg - rolling_avg_kg) END,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE house_id = NEW.house_id;
+        END
+    """)
+    # One row per batch a model scored, served or in shadow, with how long it took
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS model_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            model_version TEXT NOT NULL,
+            role TEXT NOT NULL,
+            date TEXT,
+            rows INTEGER NOT NULL,
+            seconds REAL NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_model_runs_version ON model_runs (model_version)")
+    # Each model's prediction per planned house and date, compared with collected_weights once collected
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS model_predictions (
+            model_version TEXT NOT NULL,
+            date TEXT NOT NULL,
+            house_id INTEGER NOT NULL,
+            predicted_kg REAL NOT NULL,
+            PRIMARY KEY (model_version, date, house_id)
+        )
+    """)
+    create_analytics_tables(cursor)
+    ensure_rollups(cursor)
+    backfill_visit_events(cursor)
+
+
+VISIT_EVENTS_TABLE = f"""
+    CREATE TABLE IF NOT EXISTS {{name}} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        house_id INTEGER NOT NULL,
+        event_type TEXT NOT NULL CHECK (event_type IN {EVENT_TYPES}),
+        date TEXT NOT NULL,
+        occurred_at TEXT,
+        collected_kg REAL,
+        route_id INTEGER,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+VISIT_EVENTS_COLUMNS = "id, house_id, event_type, date, occurred_at, collected_kg, route_id, created_at"
+
+
+# Columns added to a table after databases were created with it
+def add_missing_column(cursor, table, column, definition):
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in cursor.fetchall()}:
+        try:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        except sqlite3.OperationalError as e:
+            # Another connection preparing the same database added it since
+            if "duplicate column" not in str(e):
+                raise
+
+
+# A log created before an event type existed has a CHECK that rejects it. The log is copied into a table with
+# the current CHECK; dropping the old one drops its indexes and triggers, create_tables then adds them back
+# in their current form. Summaries and rollups stay as they are, the copied events are already counted
+def migrate_visit_events(cursor):
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'visit_events'")
+    row = cursor.fetchone()
+    if row is None or all(f"'{event_type}'" in row[0] for event_type in EVENT_TYPES):
+        return
+    cursor.execute(VISIT_EVENTS_TABLE.format(name="visit_events_migrated"))
+    cursor.execute(f"INSERT INTO visit_events_migrated ({VISIT_EVENTS_COLUMNS}) "
+                   f"SELECT {VISIT_EVENTS_COLUMNS} FROM visit_events ORDER BY id")
+    cursor.execute("DROP TABLE visit_events")
+    cursor.execute("ALTER TABLE visit_events_migrated RENAME TO visit_events")
+
+
+# Seed the event log from the tables that recorded visits before it existed: planned visits,
+# the latest check-in per house and collected weights. Runs once, while the log is empty
+def backfill_visit_events(cursor):
+    cursor.execute("SELECT 1 FROM visit_events LIMIT 1")
+    if cursor.fetchone():
+        return
+    cursor.execute("""
+        INSERT INTO visit_events (house_id, event_type, date, occurred_at)
+        SELECT house_id, 'planned', date, date FROM visits ORDER BY rowid
+    """)
+    cursor.execute("""
+        INSERT INTO visit_events (house_id, event_type, date, occurred_at)
+        SELECT house_id, 'visited', substr(last_visited_date, 1, 10), last_visited_date
+        FROM house_visits WHERE last_visited_date IS NOT NULL AND last_visited_date != ''
+    """)
+    cursor.execute("""
+        INSERT INTO visit_events (house_id, event_type, date, occurred_at, collected_kg)
+        SELECT house_id, 'collected', date, recorded_at, collected_kg FROM collected_weights ORDER BY id
+    """)
+
+
+def init_db(path):
+    conn = sqlite3.connect(path)
+    create_tables(conn.cursor())
+    conn.commit()
+    return conn
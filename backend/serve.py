@@ -0,0 +1,77 @@
+"""Multi-worker server with read-only artifacts shared between workers.
+
+Usage (from the backend directory):
+
+    python serve.py --workers 8 --bind 0.0.0.0:8000
+
+With gunicorn installed the app is imported once in the master process, the
+model, dataset and distance matrix are loaded there, and the heap is frozen
+before forking, so workers share those pages copy-on-write instead of each
+holding a copy. A distance matrix in .npy form (python distances.py
+distance_matrix.csv distance_matrix.npy, then DISTANCE_MATRIX_PATH=distance_matrix.npy)
+is memory-mapped and shared through the page cache even without gunicorn.
+
+State that must agree across workers lives outside the processes: routes are
+planned single-flight through a SQLite write lock, and the served model
+version is the models/current.json pointer every worker polls.
+"""
+import argparse
+import gc
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Loaded in the master before forking. The SMS client holds network sessions, so
+# every worker builds its own.
+SHARED_RESOURCES = ["model", "dataset", "distances"]
+
+
+def load_shared_app():
+    import main
+    main.resources.preload(SHARED_RESOURCES)
+    # Objects that survive to here are never collected, moving them out of the GC's reach keeps
+    # collections in the workers from writing to (and so un-sharing) their pages
+    gc.collect()
+    gc.freeze()
+    return main.app
+
+
+def run_gunicorn(bind, workers, timeout):
+    from gunicorn.app.base import BaseApplication
+
+    class PreloadedApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", bind)
+            self.cfg.set("workers", workers)
+            self.cfg.set("worker_class", "uvicorn.workers.UvicornWorker")
+            self.cfg.set("preload_app", True)
+            self.cfg.set("timeout", timeout)
+
+        def load(self):
+            return load_shared_app()
+
+    PreloadedApplication().run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the API with several worker processes")
+    parser.add_argument("--bind", default="0.0.0.0:8000")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--timeout", type=int, default=120)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        import uvicorn
+        logger.warning("gunicorn is not installed, starting uvicorn workers without a preloading master")
+        host, port = args.bind.rsplit(":", 1)
+        uvicorn.run("main:app", host=host, port=int(port), workers=args.workers)
+        return
+    run_gunicorn(args.bind, args.workers, args.timeout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""Several municipalities or wards served by one deployment.
+
+Every request runs for one tenant, named by its X-Tenant-ID header; requests
+without the header use the "default" tenant, configured by the WASTE_* and
+*_PATH environment variables as before. Other tenants are listed in a JSON
+file (TENANTS_PATH, default tenants.json):
+
+    {
+        "pune-ward-1": {"root": "/data/pune-ward-1", "fleet": {"truck_capacity": 800, "num_trucks": 3}},
+        "pune-ward-2": {"db_path": "/data/w2.db", "distance_matrix_path": "/data/w2_matrix.npy"}
+    }
+
+With "root", every path not given defaults to the citygen.py layout inside
+that directory. A tenant's database, houses, matrix, dataset and model are
+loaded on its first request; only the TENANT_CACHE_SIZE most recently used
+tenants keep theirs resident, idle ones beyond that are dropped and reloaded
+when they are next needed.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TENANT = "default"
+TENANT_HEADER = "X-Tenant-ID"
+TENANTS_PATH = os.getenv("TENANTS_PATH", "tenants.json")
+# Tenants whose artifacts stay loaded at once, least recently used idle ones are evicted first
+TENANT_CACHE_SIZE = int(os.getenv("TENANT_CACHE_SIZE", "8"))
+
+# Paths of a tenant directory, as citygen.py writes it
+ROOT_LAYOUT = {
+    "db_path": "waste_management.db",
+    "distance_matrix_path": "distance_matrix.csv",
+    "houses_path": "houses.csv",
+    "dataset_path": "enhanced_dataset.csv",
+    "models_dir": "models",
+    "model_path": "random_forest_model.joblib",
+}
+
+_current_tenant = contextvars.ContextVar("current_tenant", default=DEFAULT_TENANT)
+
+
+def current_tenant():
+    return _current_tenant.get()
+
+
+# Run the enclosed code, and anything it starts with a copy of the context, for `tenant_id`
+@contextmanager
+def use_tenant(tenant_id):
+    token = _current_tenant.set(tenant_id)
+    try:
+        yield
+    finally:
+        _current_tenant.reset(token)
+
+
+class TenantConfig:
+    def __init__(self, tenant_id, db_path, distance_matrix_path, houses_path, dataset_path, models_dir, model_path,
+                 fleet=None):
+        self.tenant_id = tenant_id
+        self.db_path = db_path
+        self.distance_matrix_path = distance_matrix_path
+        self.houses_path = houses_path
+        self.dataset_path = dataset_path
+        self.models_dir = models_dir
+        self.model_path = model_path
+        # Default truck_capacity and num_trucks for this tenant's routes
+        self.fleet = fleet or {}
+
+    @classmethod
+    def from_entry(cls, tenant_id, entry, defaults):
+        paths = {}
+        root = entry.get("root")
+        for key, filename in ROOT_LAYOUT.items():
+            if key in entry:
+                paths[key] = entry[key]
+            elif root and (key != "model_path" or os.path.exists(os.path.join(root, filename))):
+                paths[key] = os.path.join(root, filename)
+            else:
+                # Without its own file a tenant shares the default model, never the default data
+                if key != "model_path":
+                    raise ValueError(f"Tenant {tenant_id} needs {key} or a root directory")
+                paths[key] = defaults.model_path
+        return cls(tenant_id, fleet=entry.get("fleet"), **paths)
+
+
+def load_tenant_configs(default, path=TENANTS_PATH):
+    configs = {DEFAULT_TENANT: default}
+    if path and os.path.exists(path):
+        with open(path) as f:
+            entries = json.load(f)
+        for tenant_id, entry in entries.items():
+            configs[tenant_id] = TenantConfig.from_entry(tenant_id, entry, default)
+        logger.info(f"Configured {len(configs)} tenants from {path}")
+    return configs
+
+
+# Loaded state of each tenant, built on first use by `build(config)` and kept for the most recently
+# used ones. State with a close() method is closed when evicted
+class TenantRegistry:
+    def __init__(self, configs, build, max_resident=TENANT_CACHE_SIZE):
+        self.configs = configs
+        self.build = build
+        self.max_resident = max_resident
+        self._states = OrderedDict()
+        self._active = {}
+        self._building = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, tenant_id):
+        return tenant_id in self.configs
+
+    def config(self, tenant_id=None):
+        return self.configs[tenant_id or current_tenant()]
+
+    def state(self, tenant_id=None):
+        tenant_id = tenant_id or current_tenant()
+        with self._lock:
+            state = self._states.get(tenant_id)
+            if state is not None:
+                self._states.move_to_end(tenant_id)
+                return state
+            build_lock = self._building.setdefault(tenant_id, threading.Lock())
+        # Built outside the registry lock, so one tenant's slow load doesn't hold up the others
+        with build_lock:
+            with self._lock:
+                state = self._states.get(tenant_id)
+            if state is None:
+                state = self.build(self.configs[tenant_id])
+                with self._lock:
+                    self._states[tenant_id] = state
+                    evicted = self._evict()
+                for old in evicted:
+                    self._close(old)
+        return state
+
+    # Least recently used tenants without requests in flight, beyond max_resident
+    def _evict(self):
+        evicted = []
+        for tenant_id in list(self._states):
+            if len(self._states) <= self.max_resident:
+                break
+            if self._active.get(tenant_id):
+                continue
+            evicted.append(self._states.pop(tenant_id))
+            logger.info(f"Evicted idle tenant {tenant_id}")
+        return evicted
+
+    def _close(self, state):
+        close = getattr(state, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception:
+                logger.exception("Failed to close evicted tenant state")
+
+    # Marks a tenant busy for the enclosed request, so its state is not evicted under it
+    @contextmanager
+    def active(self, tenant_id):
+        with self._lock:
+            self._active[tenant_id] = self._active.get(tenant_id, 0) + 1
+        try:
+            with use_tenant(tenant_id):
+                yield
+        finally:
+            with self._lock:
+                self._active[tenant_id] -= 1
+
+    def resident(self):
+        with self._lock:
+            return list(self._states)
+
+
+# ResourceRegistry interface over the current tenant's registry. Names in `shared` (such as the SMS
+# client) live in one process-wide registry instead
+class TenantResources:
+    def __init__(self, tenants, shared, shared_names=()):
+        self.tenants = tenants
+        self.shared = shared
+        self.shared_names = set(shared_names)
+
+    def _registry(self, name=None):
+        if name in self.shared_names:
+            return self.shared
+        return self.tenants.state().resources
+
+    def get(self, name):
+        return self._registry(name).get(name)
+
+    def set(self, name, value):
+        self._registry(name).set(name, value)
+
+    def preload(self, names=None, max_workers=None):
+        self._registry().preload(names, max_workers)
+
+    # The thread preloads the tenant that is current here, not the default one
+    def preload_in_background(self, names=None):
+        return self._registry().preload_in_background(names)
+
+    def ready(self):
+        return self._registry().ready()
+
+    def status(self):
+        return self._registry().status()
@@ -0,0 +1,294 @@
+"""Offline training for the waste prediction model.
+
+Usage (from the backend directory):
+
+    python training.py --db waste_management.db --seed-csv ../enhanced_dataset.csv --n-jobs -1
+
+Training rows are streamed out of the seed CSV and the `collected_weights`
+table in chunks, a forest is fitted with `n_jobs` parallelism, and the result is
+published as a new version under `models/`. Running API workers pick it up on
+their next prediction through `LiveModel` without a restart.
+
+Other model families can be trained as candidates, which the API scores in
+shadow next to the served model (see model_registry.py):
+
+    python training.py --seed-csv ../enhanced_dataset.csv --estimator gradient_boosting --candidate
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import joblib
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Feature order the model is trained and served with
+FEATURE_COLUMNS = ['house_id', 'day_encoded', 'isholiday', 'neighborhood_encoded', 'weather_encoded', 'previous_day_waste']
+TARGET_COLUMN = 'waste_weight'
+
+# Serving encodings, the training data is re-encoded with these so both sides agree
+DAYS_OF_WEEK = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+WEATHER_CONDITIONS = ["Sunny", "Rainy", "Cloudy"]
+
+MODELS_DIR = "models"
+CURRENT_POINTER = "current.json"
+# Versions scored in shadow next to the served one, see model_registry.py
+CANDIDATES_FILE = "candidates.json"
+# Model families compared in shama.ipynb
+ESTIMATORS = ["random_forest", "gradient_boosting", "decision_tree", "knn", "svr"]
+
+
+# Stream seed rows (the enhanced_dataset.csv layout) in chunks
+def iter_seed_chunks(csv_path, chunksize):
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+        chunk['day_encoded'] = chunk['day'].map({day: i for i, day in enumerate(DAYS_OF_WEEK)})
+        chunk['weather_encoded'] = chunk['weather'].map({w: i for i, w in enumerate(WEATHER_CONDITIONS)})
+        yield chunk[FEATURE_COLUMNS + [TARGET_COLUMN]].dropna()
+
+
+# Stream logged check-ins out of SQLite in chunks
+def iter_collected_chunks(db_path, chunksize):
+    conn = sqlite3.connect(db_path)
+    try:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'collected_weights'").fetchone():
+            logger.warning(f"{db_path} has no collected_weights table yet, skipping logged visits")
+            return
+        query = f"""
+            SELECT {', '.join(FEATURE_COLUMNS)}, collected_kg AS {TARGET_COLUMN}
+            FROM collected_weights
+            WHERE weather_encoded IS NOT NULL AND previous_day_waste IS NOT NULL
+        """
+        for chunk in pd.read_sql_query(query, conn, chunksize=chunksize):
+            yield chunk
+    finally:
+        conn.close()
+
+
+# Stream rows written by features.py, one Parquet record batch at a time
+def iter_feature_chunks(parquet_path, chunksize):
+    import pyarrow.parquet as pq
+    for batch in pq.ParquetFile(parquet_path).iter_batches(batch_size=chunksize, columns=FEATURE_COLUMNS + [TARGET_COLUMN]):
+        yield batch.to_pandas()
+
+
+def load_training_data(db_path=None, seed_csv=None, features_path=None, chunksize=200_000):
+    features, targets = [], []
+    sources = []
+    if seed_csv:
+        sources.append(iter_seed_chunks(seed_csv, chunksize))
+    if features_path:
+        sources.append(iter_feature_chunks(features_path, chunksize))
+    if db_path:
+        sources.append(iter_collected_chunks(db_path, chunksize))
+    for source in sources:
+        for chunk in source:
+            features.append(chunk[FEATURE_COLUMNS].to_numpy(dtype=np.float32))
+            targets.append(chunk[TARGET_COLUMN].to_numpy(dtype=np.float32))
+    if not features:
+        raise ValueError("No training data found")
+    X = pd.DataFrame(np.concatenate(features), columns=FEATURE_COLUMNS)
+    y = np.concatenate(targets)
+    return X, y
+
+
+def make_estimator(estimator, n_jobs=-1, n_estimators=100, max_depth=12, min_samples_leaf=10,
+                   max_samples=0.25, random_state=42):
+    # Imported here so the API doesn't pay for sklearn's import when it only serves a model
+    from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
+    from sklearn.neighbors import KNeighborsRegressor
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.svm import SVR
+    from sklearn.tree import DecisionTreeRegressor
+
+    if estimator == "random_forest":
+        return RandomForestRegressor(
+            n_estimators=n_estimators,
+            max_depth=max_depth,
+            min_samples_leaf=min_samples_leaf,
+            max_samples=max_samples,
+            n_jobs=n_jobs,
+            random_state=random_state,
+        )
+    if estimator == "gradient_boosting":
+        return HistGradientBoostingRegressor(
+            max_iter=n_estimators, max_depth=max_depth, min_samples_leaf=min_samples_leaf, random_state=random_state
+        )
+    if estimator == "decision_tree":
+        return DecisionTreeRegressor(max_depth=max_depth, min_samples_leaf=min_samples_leaf, random_state=random_state)
+    # Distance and kernel based models need features on one scale
+    if estimator == "knn":
+        return make_pipeline(StandardScaler(), KNeighborsRegressor(n_neighbors=min_samples_leaf, n_jobs=n_jobs))
+    if estimator == "svr":
+        return make_pipeline(StandardScaler(), SVR())
+    raise ValueError(f"Unknown estimator {estimator}, expected one of {ESTIMATORS}")
+
+
+def train_model(X, y, n_jobs=-1, n_estimators=100, max_depth=12, min_samples_leaf=10,
+                max_samples=0.25, holdout=0.1, random_state=42, estimator="random_forest"):
+    from sklearn.metrics import mean_absolute_error, r2_score
+
+    rng = np.random.default_rng(random_state)
+    order = rng.permutation(len(X))
+    n_test = int(len(X) * holdout)
+    test_idx, train_idx = order[:n_test], order[n_test:]
+
+    model = make_estimator(
+        estimator,
+        n_jobs=n_jobs,
+        n_estimators=n_estimators,
+        max_depth=max_depth,
+        min_samples_leaf=min_samples_leaf,
+        max_samples=max_samples,
+        random_state=random_state,
+    )
+    started = time.perf_counter()
+    model.fit(X.iloc[train_idx], y[train_idx])
+    metrics = {
+        "train_rows": int(len(train_idx)),
+        "train_seconds": round(time.perf_counter() - started, 2),
+    }
+    if n_test:
+        y_pred = model.predict(X.iloc[test_idx])
+        metrics["mae"] = float(mean_absolute_error(y[test_idx], y_pred))
+        metrics["r2"] = float(r2_score(y[test_idx], y_pred))
+    return model, metrics
+
+
+def _write_json_atomic(path, payload):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(payload, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def read_candidates(models_dir=MODELS_DIR):
+    try:
+        with open(os.path.join(models_dir, CANDIDATES_FILE)) as f:
+            return json.load(f)["candidates"]
+    except FileNotFoundError:
+        return []
+
+
+def write_candidates(candidates, models_dir=MODELS_DIR):
+    _write_json_atomic(os.path.join(models_dir, CANDIDATES_FILE), {"candidates": candidates})
+
+
+# Save a new model version and atomically point `current.json` at it, or add it to the
+# shadow-scored candidates instead
+def publish_model(model, metrics, models_dir=MODELS_DIR, estimator="random_forest", candidate=False):
+    os.makedirs(models_dir, exist_ok=True)
+    version = datetime.now().strftime("%Y%m%d%H%M%S")
+    filename = f"waste_model-{version}.joblib"
+    path = os.path.join(models_dir, filename)
+    joblib.dump(model, f"{path}.tmp")
+    os.replace(f"{path}.tmp", path)
+
+    metadata = {
+        "version": version,
+        "path": filename,
+        "estimator": estimator,
+        "features": FEATURE_COLUMNS,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "metrics": metrics,
+    }
+    _write_json_atomic(os.path.join(models_dir, f"waste_model-{version}.json"), metadata)
+    if candidate:
+        write_candidates(read_candidates(models_dir) + [metadata], models_dir)
+    else:
+        _write_json_atomic(os.path.join(models_dir, CURRENT_POINTER), metadata)
+    return version
+
+
+# Holds the served model and swaps it when `current.json` changes
+class LiveModel:
+    def __init__(self, models_dir=MODELS_DIR, fallback_path="random_forest_model.joblib"):
+        self.models_dir = models_dir
+        self.fallback_path = fallback_path
+        self.version = None
+        self._model = None
+        self._pointer_mtime = None
+        self._lock = threading.Lock()
+
+    def _pointer_path(self):
+        return os.path.join(self.models_dir, CURRENT_POINTER)
+
+    def _current_mtime(self):
+        try:
+            return os.stat(self._pointer_path()).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _load(self, mtime):
+        if mtime is None:
+            path, version = self.fallback_path, "fallback"
+        else:
+            with open(self._pointer_path()) as f:
+                metadata = json.load(f)
+            path = os.path.join(self.models_dir, metadata["path"])
+            version = metadata["version"]
+        try:
+            model = joblib.load(path)
+        except Exception:
+            if self._model is None:
+                raise
+            logger.exception(f"Failed to load model version {version}, keeping {self.version}")
+        else:
+            self._model = model
+            self.version = version
+            logger.info(f"Serving model version {version}")
+        self._pointer_mtime = mtime
+
+    def get(self):
+        mtime = self._current_mtime()
+        if self._model is None or mtime != self._pointer_mtime:
+            with self._lock:
+                if self._model is None or mtime != self._pointer_mtime:
+                    self._load(mtime)
+        return self._model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrain the waste prediction model")
+    parser.add_argument("--db", default="waste_management.db", help="SQLite database with collected_weights")
+    parser.add_argument("--seed-csv", default=None, help="Historical dataset in enhanced_dataset.csv layout")
+    parser.add_argument("--features", default=None, help="Parquet feature file built by features.py")
+    parser.add_argument("--models-dir", default=MODELS_DIR)
+    parser.add_argument("--estimator", choices=ESTIMATORS, default="random_forest")
+    parser.add_argument("--candidate", action="store_true", help="Score the new version in shadow instead of serving it")
+    parser.add_argument("--n-jobs", type=int, default=-1)
+    parser.add_argument("--n-estimators", type=int, default=100)
+    parser.add_argument("--max-depth", type=int, default=12)
+    parser.add_argument("--min-samples-leaf", type=int, default=10)
+    parser.add_argument("--max-samples", type=float, default=0.25, help="Bootstrap fraction drawn per tree")
+    parser.add_argument("--chunksize", type=int, default=200_000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    X, y = load_training_data(
+        db_path=args.db, seed_csv=args.seed_csv, features_path=args.features, chunksize=args.chunksize
+    )
+    logger.info(f"Loaded {len(X)} training rows")
+    model, metrics = train_model(
+        X, y,
+        n_jobs=args.n_jobs,
+        n_estimators=args.n_estimators,
+        max_depth=args.max_depth,
+        min_samples_leaf=args.min_samples_leaf,
+        max_samples=args.max_samples,
+        estimator=args.estimator,
+    )
+    version = publish_model(model, metrics, models_dir=args.models_dir, estimator=args.estimator, candidate=args.candidate)
+    role = "candidate" if args.candidate else "model"
+    logger.info(f"Published {args.estimator} {role} version {version}: {metrics}")
+
+
+if __name__ == "__main__":
+    main()